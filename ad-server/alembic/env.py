@@ -23,6 +23,9 @@ from app.models import (
     Impression,
     Click,
     SongLikeRecord,
+    EventHourlyRollup,
+    RollupWatermark,
+    CampaignReachSketch,
 )
 
 # this is the Alembic Config object, which provides
@@ -0,0 +1,34 @@
+"""Add UNLOGGED tracking_replay_keys table for the postgres replay backend
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-16
+
+"""
+from alembic import op
+
+revision = "006"
+down_revision = "005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # UNLOGGED: no WAL, contents may be lost on crash (keys live minutes anyway)
+    op.execute(
+        "CREATE UNLOGGED TABLE tracking_replay_keys ("
+        "key bigint PRIMARY KEY, "
+        "expires_at double precision NOT NULL"
+        ")"
+    )
+    op.create_index(
+        "ix_tracking_replay_keys_expires_at",
+        "tracking_replay_keys",
+        ["expires_at"],
+        unique=False,
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_tracking_replay_keys_expires_at", table_name="tracking_replay_keys")
+    op.drop_table("tracking_replay_keys")
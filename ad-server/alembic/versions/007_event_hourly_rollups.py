@@ -0,0 +1,57 @@
+"""Add hourly impression/click rollups and rollup watermark
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-16
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "007"
+down_revision = "006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "event_hourly_rollups",
+        sa.Column("hour", sa.DateTime(), nullable=False),
+        sa.Column("campaign_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("ad_creative_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("impressions", sa.BigInteger(), server_default="0", nullable=False),
+        sa.Column("clicks", sa.BigInteger(), server_default="0", nullable=False),
+        sa.ForeignKeyConstraint(["campaign_id"], ["campaigns.id"], ondelete="CASCADE"),
+        sa.ForeignKeyConstraint(["ad_creative_id"], ["ad_creatives.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("hour", "campaign_id", "ad_creative_id"),
+    )
+    op.create_index(
+        "idx_rollup_campaign_hour", "event_hourly_rollups", ["campaign_id", "hour"], unique=False
+    )
+
+    op.create_table(
+        "rollup_watermarks",
+        sa.Column("name", sa.String(length=50), nullable=False),
+        sa.Column("watermark", sa.DateTime(), nullable=True),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("name"),
+    )
+    # NULL watermark: nothing rolled up yet (run scripts/backfill_rollups.py)
+    op.execute(
+        "INSERT INTO rollup_watermarks (name, watermark, updated_at) "
+        "VALUES ('hourly_events', NULL, now())"
+    )
+
+    # The aggregator and the raw tail of reports select rows by insert time
+    op.create_index("ix_impressions_created_at", "impressions", ["created_at"], unique=False)
+    op.create_index("ix_clicks_created_at", "clicks", ["created_at"], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_clicks_created_at", table_name="clicks")
+    op.drop_index("ix_impressions_created_at", table_name="impressions")
+    op.drop_table("rollup_watermarks")
+    op.drop_index("idx_rollup_campaign_hour", table_name="event_hourly_rollups")
+    op.drop_table("event_hourly_rollups")
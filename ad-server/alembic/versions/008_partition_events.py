@@ -0,0 +1,133 @@
+"""Convert impressions and clicks to monthly range partitions with BRIN indexes
+
+Revision ID: 008
+Revises: 007
+Create Date: 2026-10-16
+
+The existing tables are renamed, recreated as PARTITION BY RANGE (timestamp)
+with one partition per month that has rows (plus the current month and
+PREMAKE_MONTHS ahead, and a DEFAULT partition as a safety net), and the rows
+are copied over. Primary keys become (id, timestamp) because a partitioned
+table's unique constraints must include the partition key.
+
+Afterwards scripts/manage_event_partitions.py keeps future partitions created
+(moving any rows that landed in DEFAULT into them) and detaches partitions
+past EVENT_RETENTION_MONTHS.
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+revision = "008"
+down_revision = "007"
+branch_labels = None
+depends_on = None
+
+PREMAKE_MONTHS = 3
+
+IMPRESSION_COLUMNS = (
+    "id uuid NOT NULL, "
+    "ad_creative_id uuid NOT NULL REFERENCES ad_creatives(id) ON DELETE CASCADE, "
+    "campaign_id uuid NOT NULL REFERENCES campaigns(id) ON DELETE CASCADE, "
+    "user_id varchar(255) NOT NULL, "
+    "city varchar(100), "
+    "state varchar(50), "
+    "timestamp timestamp NOT NULL, "
+    "created_at timestamp NOT NULL, "
+    "PRIMARY KEY (id, timestamp)"
+)
+CLICK_COLUMNS = (
+    "id uuid NOT NULL, "
+    "ad_creative_id uuid NOT NULL REFERENCES ad_creatives(id) ON DELETE CASCADE, "
+    "campaign_id uuid NOT NULL REFERENCES campaigns(id) ON DELETE CASCADE, "
+    "user_id varchar(255) NOT NULL, "
+    "timestamp timestamp NOT NULL, "
+    "created_at timestamp NOT NULL, "
+    "PRIMARY KEY (id, timestamp)"
+)
+
+COLUMN_NAMES = {
+    "impressions": "id, ad_creative_id, campaign_id, user_id, city, state, timestamp, created_at",
+    "clicks": "id, ad_creative_id, campaign_id, user_id, timestamp, created_at",
+}
+
+# (name, columns, using) per table; BRIN for the append-ordered time columns
+INDEXES = {
+    "impressions": [
+        ("ix_impressions_timestamp", "timestamp", "brin"),
+        ("ix_impressions_created_at", "created_at", "brin"),
+        ("ix_impressions_campaign_timestamp", "campaign_id, timestamp", "btree"),
+        ("ix_impressions_user_campaign", "user_id, campaign_id, timestamp", "btree"),
+        ("ix_impressions_campaign_id", "campaign_id", "btree"),
+        ("ix_impressions_user_id", "user_id", "btree"),
+    ],
+    "clicks": [
+        ("ix_clicks_timestamp", "timestamp", "brin"),
+        ("ix_clicks_created_at", "created_at", "brin"),
+        ("ix_clicks_campaign_timestamp", "campaign_id, timestamp", "btree"),
+        ("ix_clicks_campaign_id", "campaign_id", "btree"),
+    ],
+}
+
+
+def _add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def _months(first: datetime, last: datetime):
+    month = first.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    while month <= last:
+        yield month
+        month = _add_months(month, 1)
+
+
+def _partition(table: str, columns: str) -> None:
+    bind = op.get_bind()
+    legacy = f"{table}_unpartitioned"
+    op.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+    op.execute(f"ALTER TABLE {legacy} RENAME CONSTRAINT {table}_pkey TO {legacy}_pkey")
+    for name, _, _ in INDEXES[table]:
+        op.execute(f"ALTER INDEX IF EXISTS {name} RENAME TO {name}_unpartitioned")
+
+    op.execute(f"CREATE TABLE {table} ({columns}) PARTITION BY RANGE (timestamp)")
+    now = datetime.utcnow()
+    first = bind.execute(sa.text(f"SELECT min(timestamp) FROM {legacy}")).scalar() or now
+    for month in _months(first, _add_months(now, PREMAKE_MONTHS)):
+        op.execute(
+            f"CREATE TABLE {table}_p{month:%Y%m} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{_add_months(month, 1):%Y-%m-%d}')"
+        )
+    op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+    for name, index_columns, using in INDEXES[table]:
+        op.execute(f"CREATE INDEX {name} ON {table} USING {using} ({index_columns})")
+
+    names = COLUMN_NAMES[table]
+    op.execute(f"INSERT INTO {table} ({names}) SELECT {names} FROM {legacy}")
+    op.execute(f"DROP TABLE {legacy}")
+
+
+def _unpartition(table: str, columns: str) -> None:
+    # Only rows in attached partitions come back; detached ones stay standalone
+    legacy = f"{table}_partitioned"
+    op.execute(f"ALTER TABLE {table} RENAME TO {legacy}")
+    op.execute(f"ALTER TABLE {legacy} RENAME CONSTRAINT {table}_pkey TO {legacy}_pkey")
+    for name, _, _ in INDEXES[table]:
+        op.execute(f"DROP INDEX IF EXISTS {name}")
+    op.execute(f"CREATE TABLE {table} ({columns.replace('(id, timestamp)', '(id)')})")
+    for name, index_columns, _ in INDEXES[table]:
+        op.execute(f"CREATE INDEX {name} ON {table} ({index_columns})")
+    names = COLUMN_NAMES[table]
+    op.execute(f"INSERT INTO {table} ({names}) SELECT {names} FROM {legacy}")
+    op.execute(f"DROP TABLE {legacy}")
+
+
+def upgrade() -> None:
+    _partition("impressions", IMPRESSION_COLUMNS)
+    _partition("clicks", CLICK_COLUMNS)
+
+
+def downgrade() -> None:
+    _unpartition("clicks", CLICK_COLUMNS)
+    _unpartition("impressions", IMPRESSION_COLUMNS)
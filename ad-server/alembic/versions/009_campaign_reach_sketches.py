@@ -0,0 +1,34 @@
+"""Add daily HyperLogLog reach sketches per campaign
+
+Revision ID: 009
+Revises: 008
+Create Date: 2026-10-16
+
+Sketches are filled by the hourly rollup aggregator from rows inserted after
+the rollup watermark. To include earlier history run
+scripts/backfill_rollups.py --rebuild once after upgrading.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+revision = "009"
+down_revision = "008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "campaign_reach_sketches",
+        sa.Column("campaign_id", postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("registers", sa.LargeBinary(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(["campaign_id"], ["campaigns.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("campaign_id", "day"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("campaign_reach_sketches")
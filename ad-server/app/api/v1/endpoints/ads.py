@@ -1,32 +1,66 @@
 """
 API endpoints for ad serving and tracking (QS-Prompt 3).
 """
-from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, status
 from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
-from typing import Union
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import ValidationError
+from typing import Any, List, Optional, Union
+import json
 import logging
 
-from app.api.dependencies import get_db
+from app.api.dependencies import get_async_db
+from app.core.config import settings
 from app.schemas.ad_serving import (
+    AdBatchRequest,
+    AdBatchResponse,
     AdRequest,
+    AdRequestLocation,
     AdResponse,
     NoAdResponse,
     ImpressionTrackingRequest,
     ImpressionTrackingResponse,
     ClickTrackingRequest,
-    ClickTrackingResponse
+    ClickTrackingResponse,
+    TrackingBatchEvent,
+    TrackingBatchItemResult,
+    TrackingBatchResponse
 )
-from app.services.ad_selection import AdSelectionService
-from app.services.geoip import merge_geo_with_client, resolve_request_geo
+from app.services.ad_deadline import GEO, AdDeadline, AdDeadlineExceeded
+from app.services.ad_selection import AsyncAdSelectionService
+from app.services.geoip import GeoLocation, merge_geo_with_client, resolve_request_geo
 from app.services.house_ad import get_house_ad_response
-from app.services.tracking import TrackingService
+from app.services.tracking import AsyncTrackingService, cached_click_url, record_click_detached
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
+async def _resolve_geo(
+    http_request: Request,
+    location: Optional[AdRequestLocation],
+    deadline: AdDeadline,
+) -> tuple[Optional[str], Optional[str], Optional[str]]:
+    """
+    Country/city/state for targeting: server geo wins for country, client may add city/state.
+
+    A lookup that misses the geo cut-off is not fatal: selection goes on
+    without server geo while the lookup finishes in the background and fills
+    the geo cache for this listener's next request.
+    """
+    try:
+        server_geo = await deadline.run(GEO, resolve_request_geo(http_request))
+    except AdDeadlineExceeded:
+        server_geo = GeoLocation(source="none")
+    return merge_geo_with_client(
+        server_geo,
+        location.country if location else None,
+        location.city if location else None,
+        location.state if location else None,
+    )
+
+
 @router.post(
     "/request",
     response_model=Union[AdResponse, NoAdResponse],
@@ -40,6 +74,7 @@ router = APIRouter()
     - **location**: Optional location data for geographic targeting
     
     Returns ad data with tracking tokens, or fallback instruction if no ad available.
+    If the decision takes longer than AD_SELECTION_TIMEOUT the house promo is served.
     """,
     responses={
         200: {
@@ -57,8 +92,8 @@ router = APIRouter()
                                 "image_height": 90,
                                 "click_url": "https://advertiser.com",
                                 "alt_text": "Amazing Product",
-                                "impression_tracking_token": "eyJhbGc...",
-                                "click_tracking_token": "eyJhbGc..."
+                                "impression_tracking_token": "AQNVDoQA4ptB1Kc...",
+                                "click_tracking_token": "AQNVDoQA4ptB1Kc..."
                             }
                         },
                         "no_ad": {
@@ -79,7 +114,7 @@ router = APIRouter()
 async def request_ad(
     body: AdRequest,
     http_request: Request,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ) -> Union[AdResponse, NoAdResponse]:
     """
     Request an ad to display.
@@ -88,22 +123,19 @@ async def request_ad(
     or a fallback instruction (e.g., for AdSense).
     """
     try:
-        server_geo = await resolve_request_geo(http_request)
-        client_country = body.location.country if body.location else None
-        client_city = body.location.city if body.location else None
-        client_state = body.location.state if body.location else None
-        country, city, state = merge_geo_with_client(
-            server_geo, client_country, client_city, client_state
-        )
+        # Geo, selection and token minting share AD_SELECTION_TIMEOUT
+        deadline = AdDeadline()
+        country, city, state = await _resolve_geo(http_request, body.location, deadline)
         
-        # Use AdSelectionService to select an ad
-        ad_service = AdSelectionService(db)
-        ad_data = ad_service.select_ad(
+        # Use AsyncAdSelectionService to select an ad
+        ad_service = AsyncAdSelectionService(db)
+        ad_data = await ad_service.select_ad(
             user_id=body.user_id,
             placement=body.placement,
             country=country,
             city=city,
             state=state,
+            deadline=deadline,
         )
         
         # If no paid ad, serve built-in New Stars house promo (never empty slot)
@@ -136,6 +168,174 @@ async def request_ad(
         )
 
 
+@router.post(
+    "/request/batch",
+    response_model=AdBatchResponse,
+    status_code=status.HTTP_200_OK,
+    summary="Request ads for several placements",
+    description="""
+    Fill several ad placements (e.g. banner_top, banner_bottom, events_modal) in one call.
+    
+    - **user_id**: Unique identifier for the user/device
+    - **placements**: Placement identifiers to fill (up to 10)
+    - **location**: Optional location data for geographic targeting
+    
+    Geo is resolved once for the whole page and the whole batch shares one
+    AD_SELECTION_TIMEOUT deadline. The same campaign is not shown in two
+    slots when another eligible campaign exists. Slots without a paid ad get the
+    house promo.
+    """,
+    responses={
+        200: {"description": "One ad per requested placement"},
+        400: {"description": "Invalid request data"},
+        500: {"description": "Internal server error"}
+    }
+)
+async def request_ads_batch(
+    body: AdBatchRequest,
+    http_request: Request,
+    db: AsyncSession = Depends(get_async_db),
+) -> AdBatchResponse:
+    """Request one ad per placement for a page load."""
+    try:
+        deadline = AdDeadline()
+        country, city, state = await _resolve_geo(http_request, body.location, deadline)
+        
+        ad_service = AsyncAdSelectionService(db)
+        selected = await ad_service.select_ads(
+            user_id=body.user_id,
+            placements=body.placements,
+            country=country,
+            city=city,
+            state=state,
+            deadline=deadline,
+        )
+        
+        ads = {
+            placement: AdResponse(**ad_data) if ad_data else get_house_ad_response(placement)
+            for placement, ad_data in selected.items()
+        }
+        logger.info(
+            "Serving batch: user=%s, country=%s, slots=%s",
+            body.user_id,
+            country,
+            {placement: ad.campaign_id for placement, ad in ads.items()},
+        )
+        return AdBatchResponse(ads=ads)
+        
+    except Exception as e:
+        logger.error(f"Error in request_ads_batch: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to process ad request"
+        )
+
+
+def _parse_batch_body(body: bytes) -> List[Any]:
+    """
+    Raw events of a batch beacon: a JSON array, {"events": [...]} or NDJSON.
+    
+    The body is parsed by hand because navigator.sendBeacon posts text/plain.
+    """
+    try:
+        text = body.decode("utf-8").strip()
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Body must be UTF-8")
+    if not text:
+        return []
+    try:
+        data = json.loads(text)
+    except ValueError:
+        # NDJSON: one event per line; undecodable lines are rejected individually
+        events: List[Any] = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                events.append(None)
+        return events
+    if isinstance(data, dict) and "events" in data:
+        data = data["events"]
+    if isinstance(data, dict):
+        return [data]
+    if not isinstance(data, list):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Expected a JSON array, {\"events\": [...]} or NDJSON"
+        )
+    return data
+
+
+@router.post(
+    "/tracking/batch",
+    response_model=TrackingBatchResponse,
+    summary="Track a batch of impressions and clicks",
+    description="""
+    Track several impression and click events in one request, e.g. from
+    `navigator.sendBeacon` when the app is backgrounded.
+    
+    The body may be a JSON array of events, `{"events": [...]}`, or NDJSON
+    (one event per line), sent as application/json, application/x-ndjson or
+    text/plain. Each event has the fields of the impression/click tracking
+    requests plus **type** (`impression` or `click`).
+    
+    Events are validated together and a status is returned for each one, in
+    request order: `tracked`, `duplicate`, `rejected` (with the reason) or
+    `retry` (server busy, send the event again later).
+    """,
+    responses={
+        200: {"description": "Per-event results"},
+        400: {"description": "Body could not be parsed or has too many events"},
+        500: {"description": "Internal server error"}
+    }
+)
+async def track_batch(
+    http_request: Request,
+    db: AsyncSession = Depends(get_async_db)
+) -> TrackingBatchResponse:
+    """Track a batch of impression and click events."""
+    raw_events = _parse_batch_body(await http_request.body())
+    if len(raw_events) > settings.TRACKING_BATCH_MAX_EVENTS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.TRACKING_BATCH_MAX_EVENTS} events per batch"
+        )
+    
+    try:
+        results: List[Optional[TrackingBatchItemResult]] = [None] * len(raw_events)
+        valid: List[tuple[int, TrackingBatchEvent]] = []
+        for index, raw in enumerate(raw_events):
+            try:
+                valid.append((index, TrackingBatchEvent.model_validate(raw)))
+            except ValidationError as e:
+                error = e.errors()[0]
+                field = ".".join(str(part) for part in error["loc"]) or "event"
+                results[index] = TrackingBatchItemResult(
+                    index=index, status="rejected", error=f"{field}: {error['msg']}"
+                )
+        
+        tracking_service = AsyncTrackingService(db)
+        tracked = await tracking_service.track_batch([event for _, event in valid])
+        for (index, _), result in zip(valid, tracked):
+            results[index] = TrackingBatchItemResult(**{**result, "index": index})
+        
+        return TrackingBatchResponse(
+            tracked=sum(1 for result in results if result.status == "tracked"),
+            results=results
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in track_batch: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to track batch"
+        )
+
+
 @router.post(
     "/tracking/impression",
     response_model=ImpressionTrackingResponse,
@@ -147,7 +347,7 @@ async def request_ad(
     - **ad_id**: UUID of the ad creative
     - **campaign_id**: UUID of the campaign
     - **user_id**: User/device identifier
-    - **tracking_token**: JWT token from ad request
+    - **tracking_token**: Tracking token from ad request
     - **timestamp**: When the impression occurred (ISO 8601)
     - **location**: Optional location data
     
@@ -162,7 +362,7 @@ async def request_ad(
 )
 async def track_impression(
     request: ImpressionTrackingRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> ImpressionTrackingResponse:
     """
     Track an ad impression.
@@ -174,9 +374,9 @@ async def track_impression(
         city = request.location.city if request.location else None
         state = request.location.state if request.location else None
         
-        # Use TrackingService to track impression
-        tracking_service = TrackingService(db)
-        result = tracking_service.track_impression(
+        # Use AsyncTrackingService to track impression
+        tracking_service = AsyncTrackingService(db)
+        result = await tracking_service.track_impression(
             ad_creative_id=request.ad_id,
             campaign_id=request.campaign_id,
             user_id=request.user_id,
@@ -186,6 +386,9 @@ async def track_impression(
             state=state
         )
         
+        if result["duplicate"]:
+            return ImpressionTrackingResponse(impression_id=None, status="duplicate")
+        
         logger.info(
             f"Impression tracked: impression_id={result['impression_id']}, "
             f"ad_id={request.ad_id}, user={request.user_id}"
@@ -218,7 +421,7 @@ async def track_impression(
     - **ad_id**: UUID of the ad creative
     - **campaign_id**: UUID of the campaign
     - **user_id**: User/device identifier
-    - **tracking_token**: JWT token from ad request
+    - **tracking_token**: Tracking token from ad request
     - **timestamp**: When the click occurred (ISO 8601)
     
     Returns the click URL for redirect. Duplicate clicks are detected but still redirected.
@@ -232,7 +435,7 @@ async def track_impression(
 )
 async def track_click(
     request: ClickTrackingRequest,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> ClickTrackingResponse:
     """
     Track an ad click and return redirect URL.
@@ -241,9 +444,9 @@ async def track_click(
     Duplicate clicks are detected but still redirected.
     """
     try:
-        # Use TrackingService to track click
-        tracking_service = TrackingService(db)
-        result = tracking_service.track_click(
+        # Use AsyncTrackingService to track click
+        tracking_service = AsyncTrackingService(db)
+        result = await tracking_service.track_click(
             ad_creative_id=request.ad_id,
             campaign_id=request.campaign_id,
             user_id=request.user_id,
@@ -287,6 +490,9 @@ async def track_click(
     
     - **token**: Combined tracking token containing ad_id, campaign_id, and timestamp
     
+    Tokens that pin the click URL are redirected from the in-memory creative map
+    without a database read; the click is recorded after the response is sent.
+    
     This is the recommended method for click tracking in web environments.
     """,
     responses={
@@ -298,7 +504,8 @@ async def track_click(
 )
 async def track_click_redirect(
     token: str,
-    db: Session = Depends(get_db)
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_db)
 ) -> RedirectResponse:
     """
     Track click and redirect to advertiser URL.
@@ -330,9 +537,26 @@ async def track_click_redirect(
         # Generate a user_id from the token (for tracking purposes)
         user_id = f"redirect-{uuid.uuid4().hex[:8]}"
         
+        # Fast path: URL from the snapshot, click recorded after the redirect is sent
+        click_url = cached_click_url(payload)
+        if click_url is not None:
+            background_tasks.add_task(
+                record_click_detached,
+                ad_creative_id=ad_id,
+                campaign_id=campaign_id,
+                user_id=user_id,
+                tracking_token=token,
+                timestamp=timestamp,
+            )
+            logger.info(f"Click redirect (cached): ad_id={ad_id}, url={click_url}")
+            return RedirectResponse(
+                url=click_url,
+                status_code=status.HTTP_307_TEMPORARY_REDIRECT
+            )
+        
         # Track the click
-        tracking_service = TrackingService(db)
-        result = tracking_service.track_click(
+        tracking_service = AsyncTrackingService(db)
+        result = await tracking_service.track_click(
             ad_creative_id=ad_id,
             campaign_id=campaign_id,
             user_id=user_id,
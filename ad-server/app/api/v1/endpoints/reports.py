@@ -1,13 +1,14 @@
 """
 Reports and analytics endpoints.
 """
-from fastapi import APIRouter, Depends, HTTPException, Query
-from fastapi.responses import Response
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from uuid import UUID
 from datetime import datetime
 
+from app.core.config import settings
 from app.core.database import get_db
 from app.api.dependencies import get_current_user
 from app.schemas.report import (
@@ -16,17 +17,25 @@ from app.schemas.report import (
     CampaignReportDetail,
     ReportShareResponse,
     DashboardOverview,
+    ReportTimeseries,
     TopCampaignRow,
 )
 from app.models.campaign import Campaign
 from app.models.ad_creative import AdCreative
-from app.models.impression import Impression
-from app.models.click import Click
 from app.models.user import User
+from app.services.event_rollups import event_counts, total_counts
 from app.services.report_service import (
+    EVENT_EXPORT_KINDS,
     get_campaign_report_detail,
-    build_campaigns_csv,
-    build_campaign_csv,
+    get_campaign_stats_rows,
+    get_report_timeseries,
+    get_shared_report,
+    campaign_csv_rows,
+    campaigns_csv_rows,
+    event_csv_rows,
+    iter_csv,
+    naive_utc,
+    stream_in_new_session,
     create_share_link_for_campaign,
     campaign_id_from_share_token,
 )
@@ -34,39 +43,6 @@ from app.services.report_service import (
 router = APIRouter()
 
 
-def _campaign_stats_row(
-    db: Session,
-    campaign: Campaign,
-    start_date: Optional[datetime],
-    end_date: Optional[datetime],
-) -> CampaignStats:
-    impression_query = db.query(Impression).filter(Impression.campaign_id == campaign.id)
-    click_query = db.query(Click).filter(Click.campaign_id == campaign.id)
-
-    if start_date:
-        impression_query = impression_query.filter(Impression.timestamp >= start_date)
-        click_query = click_query.filter(Click.timestamp >= start_date)
-
-    if end_date:
-        impression_query = impression_query.filter(Impression.timestamp <= end_date)
-        click_query = click_query.filter(Click.timestamp <= end_date)
-
-    impressions_count = impression_query.count()
-    clicks_count = click_query.count()
-    click_through_rate = (clicks_count / impressions_count * 100) if impressions_count > 0 else 0.0
-
-    return CampaignStats(
-        campaign_id=campaign.id,
-        campaign_name=campaign.name,
-        impressions=impressions_count,
-        clicks=clicks_count,
-        click_through_rate=round(click_through_rate, 2),
-        impressions_served=campaign.impressions_served,
-        budget_remaining=max(0, campaign.impression_budget - campaign.impressions_served),
-        budget_utilized_percentage=campaign.budget_utilized_percentage,
-    )
-
-
 @router.get("/overview", response_model=DashboardOverview)
 async def get_dashboard_overview(
     db: Session = Depends(get_db),
@@ -74,7 +50,7 @@ async def get_dashboard_overview(
 ):
     """Aggregated dashboard metrics and top campaigns."""
     campaigns = db.query(Campaign).all()
-    rows = [_campaign_stats_row(db, campaign, None, None) for campaign in campaigns]
+    rows = get_campaign_stats_rows(db, campaigns)
     total_impressions = sum(r.impressions for r in rows)
     total_clicks = sum(r.clicks for r in rows)
     overall_ctr = (total_clicks / total_impressions * 100) if total_impressions > 0 else 0.0
@@ -114,21 +90,44 @@ async def get_all_campaigns_stats(
 ):
     """Get statistics for all campaigns."""
     campaigns = db.query(Campaign).all()
-    return [_campaign_stats_row(db, campaign, start_date, end_date) for campaign in campaigns]
+    return get_campaign_stats_rows(db, campaigns, start_date, end_date)
 
 
 @router.get("/campaigns/export.csv")
 async def export_all_campaigns_csv(
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
-    db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
-    """Download CSV summary for all campaigns."""
-    csv_text = build_campaigns_csv(db, start_date, end_date)
+    """Download CSV summary for all campaigns (streamed)."""
     filename = f"new-stars-radio-campaigns-{datetime.utcnow().strftime('%Y%m%d')}.csv"
-    return Response(
-        content=csv_text,
+    return StreamingResponse(
+        stream_in_new_session(lambda session: campaigns_csv_rows(session, start_date, end_date)),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.get("/events/export.csv")
+async def export_events_csv(
+    start_date: datetime = Query(...),
+    end_date: datetime = Query(...),
+    kind: Optional[str] = Query(None, pattern="^(impressions|clicks)$"),
+    campaign_id: Optional[UUID] = Query(None),
+    current_user: User = Depends(get_current_user),
+):
+    """Download raw impression/click rows for a date range (streamed)."""
+    start_date, end_date = naive_utc(start_date), naive_utc(end_date)
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    kinds = (kind,) if kind else EVENT_EXPORT_KINDS
+    filename = (
+        f"new-stars-radio-events-{start_date.strftime('%Y%m%d')}-{end_date.strftime('%Y%m%d')}.csv"
+    )
+    return StreamingResponse(
+        stream_in_new_session(
+            lambda session: event_csv_rows(session, start_date, end_date, kinds, campaign_id)
+        ),
         media_type="text/csv",
         headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
@@ -146,7 +145,7 @@ async def get_campaign_stats(
     campaign = db.query(Campaign).filter(Campaign.id == campaign_id).first()
     if not campaign:
         raise HTTPException(status_code=404, detail="Campaign not found")
-    return _campaign_stats_row(db, campaign, start_date, end_date)
+    return get_campaign_stats_rows(db, [campaign], start_date, end_date)[0]
 
 
 @router.get("/campaigns/{campaign_id}/detail", response_model=CampaignReportDetail)
@@ -170,17 +169,32 @@ async def export_campaign_csv(
     current_user: User = Depends(get_current_user),
 ):
     """Download CSV report for one campaign."""
-    csv_text = build_campaign_csv(db, campaign_id, start_date, end_date)
     detail = get_campaign_report_detail(db, campaign_id, start_date, end_date)
     safe_name = "".join(c if c.isalnum() or c in "-_" else "-" for c in detail.campaign_name)[:40]
     filename = f"report-{safe_name}-{datetime.utcnow().strftime('%Y%m%d')}.csv"
-    return Response(
-        content=csv_text,
+    return StreamingResponse(
+        iter_csv(campaign_csv_rows(detail)),
         media_type="text/csv",
         headers={"Content-Disposition": f'attachment; filename="{filename}"'},
     )
 
 
+@router.get("/campaigns/{campaign_id}/timeseries", response_model=ReportTimeseries)
+async def get_campaign_timeseries(
+    campaign_id: UUID,
+    bucket: str = Query("day", pattern="^(hour|day|week)$"),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Impressions, clicks and CTR per hour/day/week bucket for one campaign."""
+    campaign = db.query(Campaign).filter(Campaign.id == campaign_id).first()
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return get_report_timeseries(db, bucket, start_date, end_date, campaign_id=campaign_id)
+
+
 @router.post("/campaigns/{campaign_id}/share", response_model=ReportShareResponse)
 async def create_campaign_share_link(
     campaign_id: UUID,
@@ -196,16 +210,37 @@ async def create_campaign_share_link(
     return ReportShareResponse(**share)
 
 
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match uses weak comparison: W/ prefixes are ignored."""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or any(tag.removeprefix("W/") == etag for tag in candidates)
+
+
 @router.get("/share", response_model=CampaignReportDetail)
 async def get_shared_campaign_report(
+    request: Request,
     token: str = Query(..., min_length=10),
     start_date: Optional[datetime] = Query(None),
     end_date: Optional[datetime] = Query(None),
     db: Session = Depends(get_db),
 ):
-    """Public read-only campaign report (token from share link)."""
+    """
+    Public read-only campaign report (token from share link).
+
+    Served from the share report cache with a strong ETag; a matching
+    If-None-Match gets 304 Not Modified.
+    """
     campaign_id = campaign_id_from_share_token(token)
-    return get_campaign_report_detail(db, campaign_id, start_date, end_date)
+    report = get_shared_report(db, campaign_id, start_date, end_date)
+    headers = {
+        "ETag": report.etag,
+        "Cache-Control": f"private, max-age={settings.SHARE_REPORT_CACHE_TTL}",
+    }
+    if _etag_matches(request.headers.get("if-none-match"), report.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=report.body, media_type="application/json", headers=headers)
 
 
 @router.get("/creatives/{creative_id}/stats", response_model=CreativeStats)
@@ -221,25 +256,28 @@ async def get_creative_stats(
     if not creative:
         raise HTTPException(status_code=404, detail="Creative not found")
 
-    impression_query = db.query(Impression).filter(Impression.ad_creative_id == creative_id)
-    click_query = db.query(Click).filter(Click.ad_creative_id == creative_id)
-
-    if start_date:
-        impression_query = impression_query.filter(Impression.timestamp >= start_date)
-        click_query = click_query.filter(Click.timestamp >= start_date)
-
-    if end_date:
-        impression_query = impression_query.filter(Impression.timestamp <= end_date)
-        click_query = click_query.filter(Click.timestamp <= end_date)
-
-    impressions_count = impression_query.count()
-    clicks_count = click_query.count()
-    click_through_rate = (clicks_count / impressions_count * 100) if impressions_count > 0 else 0.0
+    totals = total_counts(event_counts(db, start_date, end_date, creative_id=creative_id))
 
     return CreativeStats(
         creative_id=creative.id,
         creative_name=creative.name,
-        impressions=impressions_count,
-        clicks=clicks_count,
-        click_through_rate=round(click_through_rate, 2),
+        impressions=totals.impressions,
+        clicks=totals.clicks,
+        click_through_rate=round(totals.click_through_rate, 2),
     )
+
+
+@router.get("/creatives/{creative_id}/timeseries", response_model=ReportTimeseries)
+async def get_creative_timeseries(
+    creative_id: UUID,
+    bucket: str = Query("day", pattern="^(hour|day|week)$"),
+    start_date: Optional[datetime] = Query(None),
+    end_date: Optional[datetime] = Query(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """Impressions, clicks and CTR per hour/day/week bucket for one creative."""
+    creative = db.query(AdCreative).filter(AdCreative.id == creative_id).first()
+    if not creative:
+        raise HTTPException(status_code=404, detail="Creative not found")
+    return get_report_timeseries(db, bucket, start_date, end_date, creative_id=creative_id)
@@ -60,8 +60,47 @@ class Settings(BaseSettings):
     
     # Ad Serving
     DEFAULT_AD_PRIORITY: int = 5
-    AD_SELECTION_TIMEOUT: int = 100  # milliseconds
+    AD_SELECTION_TIMEOUT: int = 100  # milliseconds for geo + selection + token minting before the house promo
+    AD_SNAPSHOT_MAX_AGE: int = 30  # seconds before the in-memory eligibility snapshot is reloaded
+    IMPRESSION_LEASE_SIZE: int = 50  # impressions reserved from a campaign budget per lease
+    IMPRESSION_LEASE_TTL: int = 60  # seconds before an idle lease returns unused quota
+    IMPRESSION_FLUSH_INTERVAL: int = 5  # seconds between bulk writes of served counters
+    AD_REQUEST_CACHE_TTL: int = 10  # seconds a listener's repeat request gets the same ad (0 disables)
+    AD_REQUEST_CACHE_SIZE: int = 20000  # max cached (user, placement, geo) entries
+    AD_NO_FILL_TTL: int = 5  # seconds a (placement, country) with no eligible campaign is remembered
+    AD_NO_FILL_LOG_INTERVAL: int = 60  # seconds between no-fill diagnostic log lines
+    GEOIP_CACHE_TTL: int = 3600  # seconds an IP's ip-api country/city is reused
+    GEOIP_MISS_TTL: int = 60  # seconds a failed or empty IP lookup is reused
+    GEOIP_CACHE_SIZE: int = 50000  # IPs kept in the geo cache
+
+    # Tracking ingestion (write-behind)
+    TRACKING_QUEUE_MAX_SIZE: int = 20000  # events buffered before tracking answers 503
+    TRACKING_FLUSH_BATCH: int = 500  # max events per bulk INSERT
+    TRACKING_FLUSH_INTERVAL: float = 1.0  # seconds a partial batch may wait
+    TRACKING_SPOOL_DIR: str = ""  # local spool while the DB is degraded (persistent absolute path), "" disables
+    TRACKING_SPOOL_SEGMENT_BYTES: int = 8 * 1024 * 1024  # spool segment file size before roll-over
+    TRACKING_SPOOL_REPLAY_INTERVAL: float = 2.0  # seconds between spool sync/replay attempts
+    TRACKING_BATCH_MAX_EVENTS: int = 100  # events per batch beacon request
+    TRACKING_REPLAY_MAX_ENTRIES: int = 500000  # used tokens remembered for replay checks
+    TRACKING_REPLAY_BUCKET_SECONDS: float = 30.0  # expiry bucket width of the replay store
+    TRACKING_REPLAY_BACKEND: str = "memory"  # memory (per process), redis (REDIS_URL) or postgres
+    TRACKING_STATUS_CACHE_TTL: float = 30.0  # seconds a cached creative status is trusted
+    TRACKING_STATUS_CACHE_SIZE: int = 50000  # creatives kept in the tracking status cache
+    IMPRESSION_DEDUP_WINDOW: float = 30.0  # seconds; repeat (user_id, creative) impressions dropped, 0 disables
+    IMPRESSION_DEDUP_MAX_ENTRIES: int = 200000  # (user_id, creative) pairs remembered
     
+    # Reporting
+    ROLLUP_INTERVAL: float = 300.0  # seconds between hourly rollup runs, 0 disables
+    ROLLUP_SETTLE_SECONDS: int = 60  # rows are rolled up this long after insert
+    REPORT_EXPORT_YIELD_PER: int = 5000  # rows fetched per server-side cursor batch in CSV exports
+    REPORT_TIMESERIES_MAX_BUCKETS: int = 1000  # buckets one timeseries request may return
+    EVENT_PARTITION_PREMAKE_MONTHS: int = 3  # monthly impression/click partitions created ahead
+    EVENT_RETENTION_MONTHS: int = 0  # raw event partitions older than this are detached, 0 keeps all
+    EVENT_ARCHIVE_BATCH_ROWS: int = 50000  # rows per Parquet row group in archive exports
+    SHARE_REPORT_CACHE_TTL: int = 60  # seconds a rendered share report is served (0 disables)
+    SHARE_REPORT_CACHE_SIZE: int = 1000  # (campaign, date range) share reports kept
+    SHARE_REPORT_INVALIDATE_EVENTS: int = 500  # new events of a campaign that refresh its share reports
+
     # Rate Limiting
     RATE_LIMIT_REQUESTS: int = 1000
     RATE_LIMIT_WINDOW: int = 60  # seconds
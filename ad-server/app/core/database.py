@@ -2,9 +2,10 @@
 Database connection and session management.
 """
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
-from typing import Generator
+from typing import AsyncGenerator, Generator
 import logging
 
 from app.core.config import settings
@@ -36,6 +37,37 @@ SessionLocal = sessionmaker(
     bind=engine
 )
 
+
+def _async_database_url(url: str) -> str:
+    """Same database via asyncpg (listener-facing ad serving and tracking)."""
+    for prefix in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefix):
+            url = "postgresql+asyncpg://" + url[len(prefix):]
+            break
+    # asyncpg takes ssl=require rather than libpq's sslmode=require
+    return url.replace("sslmode=", "ssl=")
+
+
+# Async engine shares the pool settings; admin endpoints keep using the sync engine.
+try:
+    async_engine = create_async_engine(
+        _async_database_url(settings.DATABASE_URL),
+        pool_size=settings.DATABASE_POOL_SIZE,
+        max_overflow=settings.DATABASE_MAX_OVERFLOW,
+        pool_pre_ping=True,
+        echo=settings.DEBUG,
+        connect_args={"timeout": 10}  # 10 second connection timeout
+    )
+except Exception as e:
+    logger.error(f"Failed to create async database engine: {str(e)}")
+    raise
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
 # Create Base class for models
 Base = declarative_base()
 
@@ -53,3 +85,15 @@ def get_db() -> Generator[Session, None, None]:
         yield db
     finally:
         db.close()
+
+
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Dependency that yields an async database session.
+    Used by listener-facing endpoints so DB round trips do not block the event loop.
+    
+    Yields:
+        Async database session
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -2,8 +2,16 @@
 Security utilities for JWT tokens and password hashing.
 """
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from functools import lru_cache
+from typing import Optional, Dict, Any, Iterable, Union
+from uuid import UUID
 from jose import JWTError, jwt
+import base64
+import calendar
+import hashlib
+import hmac
+import struct
+import time
 import bcrypt
 from fastapi import HTTPException, status
 
@@ -157,6 +165,119 @@ def create_tracking_token(
     )
 
 
+# Compact tracking tokens: one HMAC-signed token covers impression and click.
+# v1: version (1) | type bits (1) | ad id (16) | campaign id (16) | issued at,
+#     epoch seconds (4) | HMAC-SHA256 truncated (16) = 54 bytes, 72 chars base64url.
+# v2: v1 body + click URL digest (8), so the click redirect can trust a cached
+#     creative URL without reading the database = 62 bytes, 83 chars.
+COMPACT_TOKEN_VERSION = 2
+TRACKING_TOKEN_MAX_AGE = 300  # seconds, same lifetime as the JWT tracking tokens
+_TOKEN_TYPE_BITS = {"impression": 0x01, "click": 0x02}
+_COMPACT_BODIES = {
+    1: struct.Struct(">BB16s16sI"),
+    2: struct.Struct(">BB16s16sI8s"),
+}
+_COMPACT_MAC_SIZE = 16
+
+
+@lru_cache(maxsize=4)
+def _tracking_mac_key(secret_key: str) -> bytes:
+    # Separate key so a tracking token can never be confused with another signed value
+    return hashlib.sha256(b"tracking-token-v1:" + secret_key.encode("utf-8")).digest()
+
+
+def _tracking_mac(body: bytes) -> bytes:
+    key = _tracking_mac_key(settings.SECRET_KEY)
+    return hmac.new(key, body, hashlib.sha256).digest()[:_COMPACT_MAC_SIZE]
+
+
+def _as_uuid(value: Union[str, UUID]) -> UUID:
+    return value if isinstance(value, UUID) else UUID(str(value))
+
+
+def click_url_digest(click_url: str) -> bytes:
+    """8-byte digest of a click URL as carried in compact tracking tokens."""
+    return hashlib.sha256(click_url.encode("utf-8")).digest()[:8]
+
+
+def create_compact_tracking_token(
+    ad_creative_id: Union[str, UUID],
+    campaign_id: Union[str, UUID],
+    timestamp: datetime,
+    token_types: Iterable[str] = ("impression", "click"),
+    click_url: Optional[str] = None,
+) -> str:
+    """
+    Create a compact tracking token valid for the given types.
+
+    Much cheaper to mint and verify than a JWT; by default one token is used
+    for both impression and click tracking. With click_url the token also pins
+    the destination (v2), see click_url_digest.
+    """
+    type_bits = 0
+    for token_type in token_types:
+        type_bits |= _TOKEN_TYPE_BITS[token_type]
+    fields = [
+        type_bits,
+        _as_uuid(ad_creative_id).bytes,
+        _as_uuid(campaign_id).bytes,
+        calendar.timegm(timestamp.utctimetuple()),
+    ]
+    if click_url is None:
+        body = _COMPACT_BODIES[1].pack(1, *fields)
+    else:
+        body = _COMPACT_BODIES[2].pack(2, *fields, click_url_digest(click_url))
+    return base64.urlsafe_b64encode(body + _tracking_mac(body)).rstrip(b"=").decode("ascii")
+
+
+def is_compact_tracking_token(token: str) -> bool:
+    """JWTs always contain dots; compact tokens never do."""
+    return "." not in token
+
+
+def verify_compact_tracking_token(token: str, expected_type: str = "impression") -> Dict[str, Any]:
+    """
+    Verify a compact tracking token (constant-time MAC check).
+
+    Returns the same payload keys as a JWT tracking token: ad_id, campaign_id,
+    timestamp (ISO 8601), type and exp (epoch seconds), plus click_url_digest
+    (bytes, v2 only).
+    """
+    invalid = HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail="Invalid or expired tracking token"
+    )
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    except (ValueError, TypeError):
+        raise invalid
+    layout = _COMPACT_BODIES.get(raw[0]) if raw else None
+    if layout is None or len(raw) != layout.size + _COMPACT_MAC_SIZE:
+        raise invalid
+
+    body, mac = raw[:layout.size], raw[layout.size:]
+    if not hmac.compare_digest(mac, _tracking_mac(body)):
+        raise invalid
+
+    _, type_bits, ad_id, campaign_id, issued_at, *rest = layout.unpack(body)
+    if time.time() - issued_at > TRACKING_TOKEN_MAX_AGE:
+        raise invalid
+    if not type_bits & _TOKEN_TYPE_BITS.get(expected_type, 0):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid tracking token type"
+        )
+
+    return {
+        "ad_id": str(UUID(bytes=ad_id)),
+        "campaign_id": str(UUID(bytes=campaign_id)),
+        "timestamp": datetime.utcfromtimestamp(issued_at).isoformat(),
+        "type": expected_type,
+        "exp": issued_at + TRACKING_TOKEN_MAX_AGE,
+        "click_url_digest": rest[0] if rest else None,
+    }
+
+
 def create_report_share_token(campaign_id: str, days_valid: int = 30) -> str:
     """Create a public, read-only report link token for an advertiser."""
     expire = datetime.utcnow() + timedelta(days=days_valid)
@@ -197,7 +318,7 @@ def verify_report_share_token(token: str) -> Dict[str, Any]:
 
 def verify_tracking_token(token: str, expected_type: str = "impression") -> Dict[str, Any]:
     """
-    Verify a tracking token.
+    Verify a tracking token (compact or, during rollout, JWT).
     
     Args:
         token: Tracking token string
@@ -209,6 +330,9 @@ def verify_tracking_token(token: str, expected_type: str = "impression") -> Dict
     Raises:
         HTTPException: If token is invalid or expired
     """
+    if is_compact_tracking_token(token):
+        return verify_compact_tracking_token(token, expected_type)
+    
     try:
         payload = jwt.decode(
             token,
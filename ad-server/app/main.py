@@ -9,16 +9,26 @@ from fastapi.responses import JSONResponse
 from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.requests import Request
 from sqlalchemy import text
+import asyncio
 import logging
 import sys
 from pathlib import Path
 
 from app.core.config import settings
-from app.core.database import engine
+from app.core.database import async_engine, engine
 from app.api.v1.router import api_router
 from app.middleware import RateLimitMiddleware
 from app.db.seed import create_initial_admin, create_starter_campaigns
 from app.services.password_reset_email import password_reset_delivery_mode
+from app.services.impression_budget import impression_budget
+from app.services.ad_deadline import deadline_overruns
+from app.services.no_fill_cache import run_no_fill_report
+from app.services.event_ingestion import event_ingestion
+from app.services.event_spool import default_spool
+from app.services.event_rollups import run_rollup_loop
+from app.services.impression_dedup import impression_deduper
+from app.services.share_report_cache import share_report_cache
+from app.services.replay_store import replay_guard, replay_store
 
 # Configure logging
 logging.basicConfig(
@@ -29,6 +39,9 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# Background tasks started on startup and cancelled on shutdown
+_background_tasks: list[asyncio.Task] = []
+
 # Create FastAPI application
 app = FastAPI(
     title=settings.APP_NAME,
@@ -185,6 +198,19 @@ async def startup_event():
     else:
         logger.info("Password reset email delivery: %s", mode)
 
+    _background_tasks.append(
+        asyncio.create_task(impression_budget.run_flush_loop(settings.IMPRESSION_FLUSH_INTERVAL))
+    )
+    _background_tasks.append(
+        asyncio.create_task(run_no_fill_report(settings.AD_NO_FILL_LOG_INTERVAL))
+    )
+    event_ingestion.spool = default_spool()
+    _background_tasks.append(asyncio.create_task(event_ingestion.run()))
+    if event_ingestion.spool is not None:
+        _background_tasks.append(asyncio.create_task(event_ingestion.run_replayer()))
+    if settings.ROLLUP_INTERVAL > 0:
+        _background_tasks.append(asyncio.create_task(run_rollup_loop(settings.ROLLUP_INTERVAL)))
+
     logger.info("Startup complete")
 
 
@@ -192,6 +218,15 @@ async def startup_event():
 async def shutdown_event():
     """Application shutdown event handler."""
     logger.info("Shutting down application")
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+    # Write tracking events still queued, then return unused impression leases
+    await event_ingestion.drain()
+    await asyncio.to_thread(impression_budget.release_all)
+    await replay_guard.close()
+    await async_engine.dispose()
 
 
 @app.get("/")
@@ -226,4 +261,17 @@ async def health_check():
         "version": settings.VERSION,
         "password_reset_email_delivery": password_reset_delivery_mode(),
         "admin_password_reset_enabled": settings.ADMIN_PASSWORD_RESET,
+        "ad_deadline": deadline_overruns.snapshot(),
+        "tracking_queue": {
+            **event_ingestion.stats,
+            "pending": event_ingestion.pending(),
+            "spool_segments": event_ingestion.spool.segments() if event_ingestion.spool else None,
+        },
+        "replay_store": {
+            "backend": replay_guard.backend.name,
+            **replay_guard.stats,
+            "local": replay_store.stats(),
+        },
+        "impression_dedup": impression_deduper.stats(),
+        "share_report_cache": {**share_report_cache.stats, "size": len(share_report_cache)},
     }
@@ -0,0 +1,223 @@
+"""Export impressions, clicks and song likes to day-partitioned Parquet files."""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from uuid import UUID
+
+from sqlalchemy import DateTime, select
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.click import Click
+from app.models.impression import Impression
+from app.models.song_like import SongLikeRecord
+from app.services.event_rollups import lock_watermark
+
+
+@dataclass(frozen=True)
+class ArchiveTable:
+    name: str
+    model: Any
+    # Files are partitioned by the UTC day of this column
+    day_column: str
+
+
+ARCHIVE_TABLES: Dict[str, ArchiveTable] = {
+    "impressions": ArchiveTable("impressions", Impression, "timestamp"),
+    "clicks": ArchiveTable("clicks", Click, "timestamp"),
+    "song_like_records": ArchiveTable("song_like_records", SongLikeRecord, "created_at"),
+}
+
+
+def archive_watermark_name(table: str) -> str:
+    return f"archive:{table}"
+
+
+def partition_path(root: Path, table: str, day: date, label: str) -> Path:
+    """Hive-style layout: <root>/<table>/day=YYYY-MM-DD/part-<label>.parquet"""
+    return root / table / f"day={day:%Y-%m-%d}" / f"part-{label}.parquet"
+
+
+def _plain(value: Any) -> Any:
+    return str(value) if isinstance(value, UUID) else value
+
+
+class DayPartitionedBuffer:
+    """
+    Buffers the current day's rows and hands each full batch to
+    write_batch(day, rows). Rows must arrive in day order: when the day
+    changes, the previous day is flushed and close_day(day) is called.
+    """
+
+    def __init__(
+        self,
+        write_batch: Callable[[date, List[tuple]], None],
+        batch_rows: int,
+        close_day: Optional[Callable[[date], None]] = None,
+    ):
+        self.write_batch = write_batch
+        self.close_day = close_day
+        self.batch_rows = batch_rows
+        self._day: Optional[date] = None
+        self._rows: List[tuple] = []
+        self.total = 0
+
+    def add(self, day: date, row: tuple) -> None:
+        if day != self._day:
+            if self._day is not None and day < self._day:
+                raise ValueError(f"Rows for {day} arrived after {self._day}; expected day order")
+            self.flush()
+            self._day = day
+        self._rows.append(row)
+        self.total += 1
+        if len(self._rows) >= self.batch_rows:
+            self.write_batch(day, self._rows)
+            self._rows = []
+
+    def flush(self) -> None:
+        if self._day is None:
+            return
+        if self._rows:
+            self.write_batch(self._day, self._rows)
+            self._rows = []
+        if self.close_day is not None:
+            self.close_day(self._day)
+        self._day = None
+
+
+class _ParquetSink:
+    """A zstd-compressed ParquetWriter per day file, opened on first write and closed by close_day()."""
+
+    def __init__(self, table: ArchiveTable, root: Path, label: str):
+        import pyarrow as pa
+
+        self._pa = pa
+        self.table = table
+        self.root = root
+        self.label = label
+        self.columns = [column.name for column in table.model.__table__.columns]
+        self.schema = pa.schema([
+            (
+                column.name,
+                pa.timestamp("us") if isinstance(column.type, DateTime) else pa.string(),
+            )
+            for column in table.model.__table__.columns
+        ])
+        self._writers: Dict[date, Any] = {}
+        self.files: List[str] = []
+
+    def write_batch(self, day: date, rows: List[tuple]) -> None:
+        import pyarrow.parquet as pq
+
+        writer = self._writers.get(day)
+        if writer is None:
+            path = partition_path(self.root, self.table.name, day, self.label)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            writer = pq.ParquetWriter(str(path), self.schema, compression="zstd")
+            self._writers[day] = writer
+            self.files.append(str(path))
+        columns = {name: [row[i] for row in rows] for i, name in enumerate(self.columns)}
+        writer.write_table(self._pa.Table.from_pydict(columns, schema=self.schema))
+
+    def close_day(self, day: date) -> None:
+        writer = self._writers.pop(day, None)
+        if writer is not None:
+            writer.close()
+
+    def close(self) -> None:
+        for writer in self._writers.values():
+            writer.close()
+        self._writers.clear()
+
+
+@dataclass
+class TableArchiveResult:
+    table: str
+    since: Optional[datetime]
+    until: datetime
+    rows: int
+    files: List[str] = field(default_factory=list)
+
+
+@dataclass
+class ArchiveSummary:
+    incremental: bool
+    results: List[TableArchiveResult] = field(default_factory=list)
+
+
+def export_table(
+    db: Session,
+    table: ArchiveTable,
+    root: Path,
+    since: Optional[datetime],
+    until: datetime,
+    batch_rows: Optional[int] = None,
+) -> TableArchiveResult:
+    """
+    Stream rows created in [since, until) through a server-side cursor into
+    per-day Parquet files. Rows are ordered by the day column, so only one
+    day's writer and one batch are held at a time.
+    """
+    batch_rows = batch_rows or settings.EVENT_ARCHIVE_BATCH_ROWS
+    model = table.model
+    columns = list(model.__table__.columns)
+    day_index = [column.name for column in columns].index(table.day_column)
+    stmt = (
+        select(*columns)
+        .where(model.created_at < until)
+        .order_by(getattr(model, table.day_column))
+    )
+    if since is not None:
+        stmt = stmt.where(model.created_at >= since)
+
+    sink = _ParquetSink(table, root, f"{until:%Y%m%dT%H%M%S}")
+    buffer = DayPartitionedBuffer(sink.write_batch, batch_rows, close_day=sink.close_day)
+    try:
+        for row in db.execute(stmt.execution_options(yield_per=batch_rows)):
+            buffer.add(row[day_index].date(), tuple(_plain(value) for value in row))
+        buffer.flush()
+    finally:
+        sink.close()
+    return TableArchiveResult(
+        table=table.name, since=since, until=until, rows=buffer.total, files=sink.files
+    )
+
+
+def export_event_archive(
+    db: Session,
+    root: Path,
+    *,
+    tables: Optional[Sequence[str]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+) -> ArchiveSummary:
+    """
+    Export each table's rows created in [since, until). Without since the
+    export is incremental: it starts at the table's stored archive watermark
+    and advances it to until once the files are written. until defaults to
+    now minus ROLLUP_SETTLE_SECONDS, so in-flight inserts are not skipped.
+    """
+    incremental = since is None
+    if until is None:
+        until = datetime.utcnow() - timedelta(seconds=settings.ROLLUP_SETTLE_SECONDS)
+    summary = ArchiveSummary(incremental=incremental)
+
+    for name in tables or ARCHIVE_TABLES:
+        table = ARCHIVE_TABLES[name]
+        if not incremental:
+            summary.results.append(export_table(db, table, root, since, until))
+            continue
+        mark = lock_watermark(db, archive_watermark_name(name))
+        start = mark.watermark
+        if start is not None and start >= until:
+            db.commit()
+            summary.results.append(TableArchiveResult(name, start, until, rows=0))
+            continue
+        summary.results.append(export_table(db, table, root, start, until))
+        mark.watermark = until
+        mark.updated_at = datetime.utcnow()
+        db.commit()
+    return summary
@@ -0,0 +1,167 @@
+"""Monthly partitions of impressions and clicks: pre-create ahead, detach past retention."""
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.services.event_rollups import get_watermark
+
+PARTITIONED_TABLES = ("impressions", "clicks")
+PARTITION_SUFFIX = re.compile(r"_p(\d{4})(\d{2})$")
+
+
+def month_start(value: datetime) -> datetime:
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month: datetime, months: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + months
+    return month.replace(year=index // 12, month=index % 12 + 1)
+
+
+def partition_name(table: str, month: datetime) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def partition_month(name: str) -> Optional[datetime]:
+    """Month a partition named by partition_name() holds, or None for other children."""
+    match = PARTITION_SUFFIX.search(name)
+    if not match:
+        return None
+    return datetime(int(match.group(1)), int(match.group(2)), 1)
+
+
+def default_partition_name(table: str) -> str:
+    return f"{table}_default"
+
+
+def _month_bounds(month: datetime) -> str:
+    return f"FROM ('{month:%Y-%m-%d}') TO ('{add_months(month, 1):%Y-%m-%d}')"
+
+
+def _month_filter(month: datetime) -> str:
+    return f"timestamp >= '{month:%Y-%m-%d}' AND timestamp < '{add_months(month, 1):%Y-%m-%d}'"
+
+
+def create_partition_sql(table: str, month: datetime) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table, month)} "
+        f"PARTITION OF {table} FOR VALUES {_month_bounds(month)}"
+    )
+
+
+def move_default_rows_sql(table: str, month: datetime) -> list[str]:
+    """
+    Create month's partition when the DEFAULT partition already holds rows in
+    its range (Postgres refuses CREATE ... PARTITION OF then): build it as a
+    plain table, move the rows out of DEFAULT into it, and attach it.
+    """
+    name = partition_name(table, month)
+    return [
+        f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)",
+        f"WITH moved AS (DELETE FROM {default_partition_name(table)} "
+        f"WHERE {_month_filter(month)} RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved",
+        f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES {_month_bounds(month)}",
+    ]
+
+
+def count_default_rows(db: Session, table: str, month: datetime) -> int:
+    return db.execute(
+        text(f"SELECT count(*) FROM {default_partition_name(table)} WHERE {_month_filter(month)}")
+    ).scalar() or 0
+
+
+def list_partitions(db: Session, table: str) -> list[str]:
+    rows = db.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+            "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+            "WHERE parent.relname = :table ORDER BY child.relname"
+        ),
+        {"table": table},
+    )
+    return [row[0] for row in rows]
+
+
+@dataclass
+class PartitionMaintenanceSummary:
+    dry_run: bool
+    created: list[str] = field(default_factory=list)
+    # Created partitions whose rows were first moved out of the DEFAULT partition
+    moved_from_default: list[str] = field(default_factory=list)
+    detached: list[str] = field(default_factory=list)
+    dropped: list[str] = field(default_factory=list)
+    # Past retention but not yet rolled up (kept until the rollups cover them)
+    held_for_rollup: list[str] = field(default_factory=list)
+
+
+def maintain_event_partitions(
+    db: Session,
+    *,
+    dry_run: bool = True,
+    premake_months: Optional[int] = None,
+    retention_months: Optional[int] = None,
+    drop_detached: bool = False,
+    now: Optional[datetime] = None,
+) -> PartitionMaintenanceSummary:
+    """
+    Create partitions for the current month and premake_months ahead, and
+    detach (optionally drop) partitions that ended more than retention_months
+    ago. Rows that already landed in DEFAULT for a new month are moved into
+    its partition. Detached partitions stay as standalone tables for archiving. A
+    partition is only detached once the hourly rollups cover it, so reports
+    over old ranges keep working from the rollups.
+    """
+    premake = settings.EVENT_PARTITION_PREMAKE_MONTHS if premake_months is None else premake_months
+    retention = settings.EVENT_RETENTION_MONTHS if retention_months is None else retention_months
+    current = month_start(now or datetime.utcnow())
+    cutoff = add_months(current, -retention) if retention > 0 else None
+    watermark = get_watermark(db)
+    summary = PartitionMaintenanceSummary(dry_run=dry_run)
+
+    for table in PARTITIONED_TABLES:
+        existing = set(list_partitions(db, table))
+        has_default = default_partition_name(table) in existing
+        for offset in range(premake + 1):
+            month = add_months(current, offset)
+            name = partition_name(table, month)
+            if name in existing:
+                continue
+            summary.created.append(name)
+            if has_default and count_default_rows(db, table, month):
+                summary.moved_from_default.append(name)
+                statements = move_default_rows_sql(table, month)
+            else:
+                statements = [create_partition_sql(table, month)]
+            if not dry_run:
+                for statement in statements:
+                    db.execute(text(statement))
+
+        if cutoff is None:
+            continue
+        for name in sorted(existing):
+            month = partition_month(name)
+            if month is None or add_months(month, 1) > cutoff:
+                continue
+            if watermark is None or watermark < add_months(month, 1):
+                summary.held_for_rollup.append(name)
+                continue
+            summary.detached.append(name)
+            if not dry_run:
+                db.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+            if drop_detached:
+                summary.dropped.append(name)
+                if not dry_run:
+                    db.execute(text(f"DROP TABLE {name}"))
+
+    if not dry_run:
+        db.commit()
+    return summary
@@ -0,0 +1,54 @@
+"""Backfill or rebuild the hourly impression/click rollups."""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from app.models.event_rollup import EventHourlyRollup
+from app.models.reach_sketch import CampaignReachSketch
+from app.services.event_rollups import lock_watermark, get_watermark, roll_up_events
+
+
+@dataclass
+class RollupBackfillSummary:
+    rebuilt: bool
+    deleted_rows: int
+    deleted_sketches: int
+    previous_watermark: Optional[datetime]
+    watermark: Optional[datetime]
+    steps: int
+
+
+def backfill_event_rollups(
+    db: Session,
+    *,
+    rebuild: bool = False,
+    step_hours: int = 24,
+) -> RollupBackfillSummary:
+    """
+    Roll up every event row not yet counted. With rebuild=True the rollups and
+    reach sketches are emptied and recomputed from the raw tables first (reports read raw rows
+    while this runs, so they stay correct).
+    """
+    previous = get_watermark(db)
+    deleted = deleted_sketches = 0
+    if rebuild:
+        mark = lock_watermark(db)
+        deleted = db.query(EventHourlyRollup).delete(synchronize_session=False)
+        deleted_sketches = db.query(CampaignReachSketch).delete(synchronize_session=False)
+        mark.watermark = None
+        mark.updated_at = datetime.utcnow()
+        db.commit()
+
+    steps = roll_up_events(db, step=timedelta(hours=step_hours))
+    return RollupBackfillSummary(
+        rebuilt=rebuild,
+        deleted_rows=deleted,
+        deleted_sketches=deleted_sketches,
+        previous_watermark=previous,
+        watermark=get_watermark(db),
+        steps=steps,
+    )
@@ -22,6 +22,7 @@ RATE_LIMITS = {
     "/api/v1/ads/request": (100, 60),  # 100 requests per 60 seconds
     "/api/v1/ads/tracking/impression": (200, 60),  # 200 requests per 60 seconds
     "/api/v1/ads/tracking/click": (200, 60),  # 200 requests per 60 seconds
+    "/api/v1/ads/tracking/batch": (200, 60),  # each beacon carries up to TRACKING_BATCH_MAX_EVENTS events
     "/api/v1/media/i": (600, 60),  # banner images — generous for page loads
     "/api/v1/likes": (120, 60),  # radio app like/unlike sync
     "/api/v1/auth/forgot-password": (10, 300),  # limit abuse — 10 per 5 minutes per IP
@@ -8,6 +8,8 @@ from app.models.ad_creative import AdCreative
 from app.models.impression import Impression
 from app.models.click import Click
 from app.models.song_like import SongLikeRecord
+from app.models.event_rollup import EventHourlyRollup, RollupWatermark
+from app.models.reach_sketch import CampaignReachSketch
 
 __all__ = [
     "User",
@@ -17,4 +19,7 @@ __all__ = [
     "Impression",
     "Click",
     "SongLikeRecord",
+    "EventHourlyRollup",
+    "RollupWatermark",
+    "CampaignReachSketch",
 ]
@@ -32,7 +32,8 @@ class Click(Base):
     user_id = Column(String(255), nullable=False)
     
     # Tracking
-    timestamp = Column(DateTime, nullable=False, index=True)
+    # Partition key, hence part of the primary key (monthly partitions, migration 008)
+    timestamp = Column(DateTime, primary_key=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     
     # Relationships
@@ -42,6 +43,9 @@ class Click(Base):
     # Index for reporting queries
     __table_args__ = (
         Index('idx_click_campaign_timestamp', 'campaign_id', 'timestamp'),
+        Index('ix_clicks_timestamp', 'timestamp', postgresql_using='brin'),
+        Index('ix_clicks_created_at', 'created_at', postgresql_using='brin'),
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
     )
     
     def __repr__(self):
@@ -0,0 +1,54 @@
+"""
+Hourly impression/click rollups for reporting.
+"""
+from datetime import datetime
+from sqlalchemy import BigInteger, Column, String, DateTime, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import UUID
+
+from app.core.database import Base
+
+
+class EventHourlyRollup(Base):
+    """
+    Impressions and clicks per (hour, campaign, creative).
+
+    Maintained by app.services.event_rollups from rows inserted before the
+    rollup watermark; hour is the event timestamp truncated to the hour.
+    """
+    __tablename__ = "event_hourly_rollups"
+
+    hour = Column(DateTime, primary_key=True)
+    campaign_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("campaigns.id", ondelete="CASCADE"),
+        primary_key=True
+    )
+    ad_creative_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("ad_creatives.id", ondelete="CASCADE"),
+        primary_key=True
+    )
+    impressions = Column(BigInteger, nullable=False, default=0, server_default="0")
+    clicks = Column(BigInteger, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (
+        Index('idx_rollup_campaign_hour', 'campaign_id', 'hour'),
+    )
+
+    def __repr__(self):
+        return f"<EventHourlyRollup {self.hour} - Campaign {self.campaign_id}>"
+
+
+class RollupWatermark(Base):
+    """
+    Progress of an incremental job over event rows (hourly rollups, archive
+    exports): every row created before watermark has been processed.
+    """
+    __tablename__ = "rollup_watermarks"
+
+    name = Column(String(50), primary_key=True)
+    watermark = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<RollupWatermark {self.name} @ {self.watermark}>"
@@ -36,7 +36,8 @@ class Impression(Base):
     state = Column(String(50), nullable=True)
     
     # Tracking
-    timestamp = Column(DateTime, nullable=False, index=True)
+    # Partition key, hence part of the primary key (monthly partitions, migration 008)
+    timestamp = Column(DateTime, primary_key=True)
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     
     # Relationships
@@ -47,6 +48,9 @@ class Impression(Base):
     __table_args__ = (
         Index('idx_impression_campaign_timestamp', 'campaign_id', 'timestamp'),
         Index('idx_impression_user_campaign', 'user_id', 'campaign_id', 'timestamp'),
+        Index('ix_impressions_timestamp', 'timestamp', postgresql_using='brin'),
+        Index('ix_impressions_created_at', 'created_at', postgresql_using='brin'),
+        {'postgresql_partition_by': 'RANGE (timestamp)'},
     )
     
     def __repr__(self):
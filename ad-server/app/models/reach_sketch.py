@@ -0,0 +1,30 @@
+"""
+Daily unique-listener sketches per campaign.
+"""
+from datetime import datetime
+from sqlalchemy import Column, Date, DateTime, ForeignKey, LargeBinary
+from sqlalchemy.dialects.postgresql import UUID
+
+from app.core.database import Base
+
+
+class CampaignReachSketch(Base):
+    """
+    HyperLogLog sketch of the user_ids that saw a campaign on one (UTC) day.
+
+    registers is the zlib-compressed register array of
+    app.services.reach_sketch.HyperLogLog; days merge by register-wise max.
+    """
+    __tablename__ = "campaign_reach_sketches"
+
+    campaign_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("campaigns.id", ondelete="CASCADE"),
+        primary_key=True
+    )
+    day = Column(Date, primary_key=True)
+    registers = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f"<CampaignReachSketch {self.campaign_id} @ {self.day}>"
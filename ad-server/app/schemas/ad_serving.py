@@ -2,7 +2,7 @@
 Pydantic schemas for ad serving and tracking endpoints.
 """
 from datetime import datetime
-from typing import Optional
+from typing import Dict, List, Literal, Optional
 from pydantic import BaseModel, Field, field_validator
 
 
@@ -73,8 +73,8 @@ class AdResponse(BaseModel):
     image_height: int = Field(..., gt=0, description="Image height in pixels")
     click_url: str = Field(..., description="Advertiser's destination URL")
     alt_text: str = Field(..., description="Alt text for the image")
-    impression_tracking_token: str = Field(..., description="JWT token for impression tracking")
-    click_tracking_token: str = Field(..., description="JWT token for click tracking")
+    impression_tracking_token: str = Field(..., description="Token for impression tracking")
+    click_tracking_token: str = Field(..., description="Token for click tracking (same token as impression tracking)")
     is_house_ad: bool = Field(
         default=False,
         description="True for built-in New Stars promo when no paid ad matched",
@@ -90,12 +90,60 @@ class AdResponse(BaseModel):
                 "image_height": 90,
                 "click_url": "https://advertiser.com/landing",
                 "alt_text": "Check out our amazing product!",
-                "impression_tracking_token": "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9...",
-                "click_tracking_token": "eyJhbGciOiJIUzI1NiIsInR5cCI6IkpXVCJ9..."
+                "impression_tracking_token": "AQNVDoQA4ptB1KcWRGZVRAAAZg6EAOKbQdSnFkRmVUQAAWZ...",
+                "click_tracking_token": "AQNVDoQA4ptB1KcWRGZVRAAAZg6EAOKbQdSnFkRmVUQAAWZ..."
             }
         }
 
 
+class AdBatchRequest(BaseModel):
+    """Request body for filling several placements in one call."""
+    user_id: str = Field(
+        ...,
+        min_length=1,
+        max_length=100,
+        description="Unique identifier for user/device",
+        examples=["user-123"]
+    )
+    placements: List[str] = Field(
+        ...,
+        min_length=1,
+        max_length=10,
+        description="Ad placement identifiers to fill (duplicates are ignored)",
+        examples=[["banner_top", "banner_bottom", "events_modal"]]
+    )
+    location: Optional[AdRequestLocation] = Field(
+        None,
+        description="Optional location data for geographic targeting"
+    )
+    
+    @field_validator('user_id')
+    @classmethod
+    def validate_user_id(cls, v: str) -> str:
+        """Validate user_id format (alphanumeric, dashes, underscores)."""
+        if not v.replace("-", "").replace("_", "").isalnum():
+            raise ValueError("user_id must be alphanumeric with optional dashes/underscores")
+        return v
+    
+    @field_validator('placements')
+    @classmethod
+    def validate_placements(cls, v: List[str]) -> List[str]:
+        """Normalize placements and drop duplicates, keeping request order."""
+        normalized: List[str] = []
+        for placement in v:
+            key = placement.strip().lower()
+            if not key or len(key) > 50:
+                raise ValueError("placements must be 1-50 characters")
+            if key not in normalized:
+                normalized.append(key)
+        return normalized
+
+
+class AdBatchResponse(BaseModel):
+    """One ad (paid or house promo) per requested placement."""
+    ads: Dict[str, AdResponse] = Field(..., description="Ad keyed by placement")
+
+
 class NoAdResponse(BaseModel):
     """Response when no ad is available (fallback to AdSense)."""
     fallback: str = Field(default="adsense", description="Fallback provider")
@@ -118,7 +166,7 @@ class ImpressionTrackingRequest(BaseModel):
     ad_id: str = Field(..., description="UUID of the ad creative")
     campaign_id: str = Field(..., description="UUID of the campaign")
     user_id: str = Field(..., min_length=1, max_length=100, description="User/device identifier")
-    tracking_token: str = Field(..., description="JWT token from ad request")
+    tracking_token: str = Field(..., description="Tracking token from ad request")
     timestamp: datetime = Field(..., description="When the impression occurred (ISO 8601)")
     location: Optional[AdRequestLocation] = Field(
         None,
@@ -151,8 +199,14 @@ class ImpressionTrackingRequest(BaseModel):
 
 class ImpressionTrackingResponse(BaseModel):
     """Response for successful impression tracking."""
-    impression_id: str = Field(..., description="UUID of the recorded impression")
-    status: str = Field(default="tracked", description="Tracking status")
+    impression_id: Optional[str] = Field(
+        None,
+        description="UUID of the recorded impression (null when it was a duplicate)"
+    )
+    status: str = Field(
+        default="tracked",
+        description="tracked, or duplicate (same listener and ad within the de-dup window)"
+    )
     
     class Config:
         json_schema_extra = {
@@ -168,7 +222,7 @@ class ClickTrackingRequest(BaseModel):
     ad_id: str = Field(..., description="UUID of the ad creative")
     campaign_id: str = Field(..., description="UUID of the campaign")
     user_id: str = Field(..., min_length=1, max_length=100, description="User/device identifier")
-    tracking_token: str = Field(..., description="JWT token from ad request")
+    tracking_token: str = Field(..., description="Tracking token from ad request")
     timestamp: datetime = Field(..., description="When the click occurred (ISO 8601)")
     
     @field_validator('user_id')
@@ -207,9 +261,47 @@ class ClickTrackingResponse(BaseModel):
         }
 
 
+class TrackingBatchEvent(BaseModel):
+    """One impression or click in a batch beacon."""
+    type: Literal["impression", "click"] = Field(..., description="Event type")
+    ad_id: str = Field(..., description="UUID of the ad creative")
+    campaign_id: str = Field(..., description="UUID of the campaign")
+    user_id: str = Field(..., min_length=1, max_length=100, description="User/device identifier")
+    tracking_token: str = Field(..., description="Tracking token from ad request")
+    timestamp: datetime = Field(..., description="When the event occurred (ISO 8601)")
+    location: Optional[AdRequestLocation] = Field(
+        None,
+        description="Optional location data (impressions only)"
+    )
 
 
+class TrackingBatchItemResult(BaseModel):
+    """Outcome for one event of a batch, in request order."""
+    index: int = Field(..., description="Position of the event in the request")
+    status: Literal["tracked", "duplicate", "rejected", "retry"] = Field(
+        ...,
+        description=(
+            "tracked, duplicate (already counted, or a repeat impression within the "
+            "de-dup window), rejected (invalid), or retry (server busy)"
+        )
+    )
+    id: Optional[str] = Field(None, description="UUID of the recorded impression or click")
+    error: Optional[str] = Field(None, description="Why the event was rejected")
 
 
-
+class TrackingBatchResponse(BaseModel):
+    """Per-event results of a batch beacon."""
+    tracked: int = Field(..., description="Number of events recorded")
+    results: List[TrackingBatchItemResult]
+    
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "tracked": 1,
+                "results": [
+                    {"index": 0, "status": "tracked", "id": "770e8400-e29b-41d4-a716-446655440002"},
+                    {"index": 1, "status": "rejected", "error": "Invalid or expired tracking token"}
+                ]
+            }
+        }
 
@@ -46,6 +46,8 @@ class CampaignReportDetail(CampaignStats):
     report_period_start: Optional[datetime] = None
     report_period_end: Optional[datetime] = None
     generated_at: datetime
+    # Approximate distinct listeners (HyperLogLog) over the UTC days of the period
+    unique_reach: Optional[int] = None
     creatives: List[CreativeStatsBrief] = Field(default_factory=list)
 
 
@@ -77,6 +79,24 @@ class DashboardOverview(BaseModel):
     top_campaigns: List[TopCampaignRow] = Field(default_factory=list)
 
 
+class TimeseriesPoint(BaseModel):
+    """Counts for one time bucket (bucket_start is UTC, as date_trunc computes it)."""
+    bucket_start: datetime
+    impressions: int
+    clicks: int
+    click_through_rate: float
+
+
+class ReportTimeseries(BaseModel):
+    """Bucketed impressions/clicks for a campaign or creative."""
+    campaign_id: Optional[UUID] = None
+    creative_id: Optional[UUID] = None
+    bucket: str
+    start_date: datetime
+    end_date: datetime
+    points: List[TimeseriesPoint] = Field(default_factory=list)
+
+
 class DateRange(BaseModel):
     """Date range for reports."""
     start_date: datetime
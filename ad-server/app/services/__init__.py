@@ -3,12 +3,14 @@ Services package - Business logic layer.
 
 Contains core services for ad selection, tracking, and reporting.
 """
-from app.services.ad_selection import AdSelectionService
-from app.services.tracking import TrackingService
+from app.services.ad_selection import AdSelectionService, AsyncAdSelectionService
+from app.services.tracking import AsyncTrackingService, TrackingService
 
 __all__ = [
     "AdSelectionService",
+    "AsyncAdSelectionService",
     "TrackingService",
+    "AsyncTrackingService",
 ]
 
 
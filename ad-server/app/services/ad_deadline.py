@@ -0,0 +1,115 @@
+"""
+Per-request deadline for the ad decision pipeline.
+
+A banner request gets settings.AD_SELECTION_TIMEOUT milliseconds end to end.
+The stages run in order and each must finish by its cut-off (a fraction of the
+total, so time a fast stage leaves unused carries over to the next one):
+
+- geo: edge headers / ip-api lookup
+- selection: eligibility snapshot and budget lease
+- tokens: minting the tracking tokens
+
+When selection or token minting misses its cut-off the caller serves the
+house promo instead; a geo overrun only drops server geo for that request.
+Overruns are counted per stage (see deadline_overruns).
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Awaitable, Optional, TypeVar
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+GEO = "geo"
+SELECTION = "selection"
+TOKENS = "tokens"
+
+# Fraction of the total budget by which each stage must have finished.
+STAGE_CUTOFFS = {GEO: 0.5, SELECTION: 0.9, TOKENS: 1.0}
+
+
+class AdDeadlineExceeded(Exception):
+    """A pipeline stage ran past its cut-off."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Ad decision deadline exceeded during {stage}")
+        self.stage = stage
+
+
+class DeadlineCounters:
+    """Process-wide counts of deadline-bound requests and overruns per stage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._requests = 0
+        self._overruns: dict[str, int] = {stage: 0 for stage in STAGE_CUTOFFS}
+
+    def record_request(self) -> None:
+        with self._lock:
+            self._requests += 1
+
+    def record_overrun(self, stage: str) -> None:
+        with self._lock:
+            self._overruns[stage] = self._overruns.get(stage, 0) + 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"requests": self._requests, "overruns": dict(self._overruns)}
+
+
+deadline_overruns = DeadlineCounters()
+
+
+class AdDeadline:
+    """Time budget for one ad request (or one batch of placements)."""
+
+    def __init__(
+        self,
+        timeout_ms: Optional[int] = None,
+        counters: Optional[DeadlineCounters] = None,
+    ):
+        self.timeout = (settings.AD_SELECTION_TIMEOUT if timeout_ms is None else timeout_ms) / 1000
+        self.started = time.monotonic()
+        self.counters = counters or deadline_overruns
+        self.counters.record_request()
+
+    def remaining(self, stage: str) -> float:
+        """Seconds left before the stage's cut-off."""
+        cutoff = self.started + self.timeout * STAGE_CUTOFFS[stage]
+        return cutoff - time.monotonic()
+
+    def check(self, stage: str) -> None:
+        """Raise AdDeadlineExceeded if the stage's cut-off has already passed."""
+        if self.remaining(stage) <= 0:
+            self._overrun(stage)
+
+    async def run(self, stage: str, awaitable: Awaitable[T]) -> T:
+        """Await a stage, cancelling it at its cut-off."""
+        remaining = self.remaining(stage)
+        if remaining <= 0:
+            # Close the coroutine so it is not reported as never awaited.
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            self._overrun(stage)
+        try:
+            return await asyncio.wait_for(awaitable, timeout=remaining)
+        except asyncio.TimeoutError:
+            self._overrun(stage)
+
+    def _overrun(self, stage: str) -> None:
+        self.counters.record_overrun(stage)
+        elapsed_ms = (time.monotonic() - self.started) * 1000
+        logger.warning(
+            "Ad decision deadline exceeded: stage=%s, elapsed=%.0fms, budget=%.0fms",
+            stage,
+            elapsed_ms,
+            self.timeout * 1000,
+        )
+        raise AdDeadlineExceeded(stage)
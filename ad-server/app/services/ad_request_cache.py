@@ -0,0 +1,80 @@
+"""
+Short-lived per-listener cache of served ads.
+
+The radio app re-renders banners on route changes and metadata updates, so the
+same user_id + placement often asks for an ad several times within a few
+seconds. Repeats within AD_REQUEST_CACHE_TTL get the ad (and tracking tokens)
+already selected for them instead of a fresh selection, so one listener does
+not spend several impressions of a campaign's budget. Tracking tokens live for
+five minutes, well beyond the TTL, and the impression token can only be
+tracked once.
+
+Entries are keyed by (user_id, placement, country, city, state), bounded to
+AD_REQUEST_CACHE_SIZE (least recently used evicted first) and dropped when
+campaigns or creatives change.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.core.config import settings
+from app.services.inventory_events import inventory_version
+
+RequestKey = tuple[str, str, Optional[str], Optional[str], Optional[str]]
+
+
+def request_key(
+    user_id: str,
+    placement: str,
+    country: Optional[str] = None,
+    city: Optional[str] = None,
+    state: Optional[str] = None,
+) -> RequestKey:
+    return (user_id, (placement or "").strip().lower(), country, city, state)
+
+
+class AdRequestCache:
+    """Thread-safe TTL + LRU map from request key to the ad served for it."""
+
+    def __init__(self, ttl_seconds: Optional[float] = None, max_entries: Optional[int] = None):
+        self.ttl = settings.AD_REQUEST_CACHE_TTL if ttl_seconds is None else ttl_seconds
+        self.max_entries = settings.AD_REQUEST_CACHE_SIZE if max_entries is None else max_entries
+        self._lock = threading.Lock()
+        # key -> (expires_at, inventory version, ad data)
+        self._entries: OrderedDict[RequestKey, tuple[float, int, Dict[str, Any]]] = OrderedDict()
+
+    def get(self, key: RequestKey) -> Optional[Dict[str, Any]]:
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, version, ad_data = entry
+            if expires_at <= time.monotonic() or version != inventory_version():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return ad_data
+
+    def put(self, key: RequestKey, ad_data: Dict[str, Any]) -> None:
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, inventory_version(), ad_data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+ad_request_cache = AdRequestCache()
@@ -6,23 +6,32 @@ This service implements the ad selection algorithm with:
 - Geographic targeting
 - Budget management
 - Fair rotation among creatives
+
+Eligibility is answered from a process-local snapshot (see eligibility_snapshot),
+so picking a campaign does not read the database.
 """
 from datetime import datetime
 from typing import Optional, Dict, Any
-from sqlalchemy.orm import Session, selectinload
-from sqlalchemy import and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
 import logging
 import random
+from uuid import UUID
 
-from app.models.campaign import Campaign, CampaignStatus
-from app.models.ad_creative import AdCreative, CreativeStatus
-from app.constants.placements import (
-    creative_matches_placement,
-    preferred_sizes_for_placement,
-    size_matches,
-)
-from app.core.security import create_tracking_token
+from app.core.security import create_compact_tracking_token
 from app.integrations.creative_media import creative_media_path
+from app.services.ad_deadline import SELECTION, TOKENS, AdDeadline, AdDeadlineExceeded
+from app.services.ad_request_cache import AdRequestCache, ad_request_cache, request_key
+from app.services.eligibility_snapshot import (
+    EligibilityCache,
+    EligibilitySnapshot,
+    SnapshotCampaign,
+    SnapshotCreative,
+    SnapshotEntry,
+    eligibility_cache,
+)
+from app.services.impression_budget import ImpressionBudgetLedger, impression_budget
+from app.services.no_fill_cache import NoFillCache, no_fill_cache
 
 logger = logging.getLogger(__name__)
 
@@ -30,8 +39,17 @@ logger = logging.getLogger(__name__)
 class AdSelectionService:
     """Service for selecting which ad to serve based on targeting and priority."""
     
-    def __init__(self, db: Session):
+    def __init__(
+        self,
+        db: Session,
+        snapshot_cache: Optional[EligibilityCache] = None,
+        budget: Optional[ImpressionBudgetLedger] = None,
+        no_fill: Optional[NoFillCache] = None,
+    ):
         self.db = db
+        self.snapshot_cache = snapshot_cache or eligibility_cache
+        self.budget = budget or impression_budget
+        self.no_fill = no_fill if no_fill is not None else no_fill_cache
     
     def select_ad(
         self,
@@ -49,8 +67,8 @@ class AdSelectionService:
         2. Apply geographic targeting filters
         3. Weighted random selection (priority 5 = 5x more likely than priority 1)
         4. Select active creative from chosen campaign
-        5. Generate tracking tokens
-        6. Update campaign metrics
+        5. Generate the tracking token (one compact token for impression and click)
+        6. Count the impression against the campaign's budget lease
         
         Args:
             user_id: Unique identifier for the user/device
@@ -65,58 +83,117 @@ class AdSelectionService:
         logger.info(f"Selecting ad for user={user_id}, placement={placement}, location={country}/{city}/{state}")
         
         try:
-            # Step 1: Find eligible campaigns
-            eligible_campaign = self._find_eligible_campaign(country, city, state, placement)
+            return self._select(placement, country, city, state)
+        except Exception as e:
+            logger.error(f"Error selecting ad: {str(e)}", exc_info=True)
+            return None
+    
+    def select_ads(
+        self,
+        user_id: str,
+        placements: list[str],
+        country: Optional[str] = None,
+        city: Optional[str] = None,
+        state: Optional[str] = None
+    ) -> Dict[str, Optional[Dict[str, Any]]]:
+        """
+        Select one ad per placement for a single page load.
+        
+        Uses one eligibility snapshot for every slot and avoids showing the same
+        campaign in two slots when another eligible campaign exists.
+        
+        Returns:
+            Mapping of placement to ad data (None where no paid ad is available)
+        """
+        logger.info(f"Selecting ads for user={user_id}, placements={placements}, location={country}/{city}/{state}")
+        
+        results: Dict[str, Optional[Dict[str, Any]]] = {}
+        try:
+            snapshot = self.snapshot_cache.get(self.db)
+        except Exception as e:
+            logger.error(f"Error loading eligibility snapshot: {str(e)}", exc_info=True)
+            return {placement: None for placement in placements}
+        
+        used_campaigns: set[UUID] = set()
+        for placement in placements:
+            try:
+                ad_data = self._select(
+                    placement, country, city, state,
+                    snapshot=snapshot,
+                    exclude=frozenset(used_campaigns),
+                )
+                if ad_data is None and used_campaigns:
+                    # Only campaigns already on the page fit this slot; repeat one rather than go empty.
+                    ad_data = self._select(placement, country, city, state, snapshot=snapshot)
+            except Exception as e:
+                logger.error(f"Error selecting ad for placement={placement}: {str(e)}", exc_info=True)
+                ad_data = None
+            if ad_data is not None:
+                used_campaigns.add(UUID(ad_data["campaign_id"]))
+            results[placement] = ad_data
+        return results
+    
+    def _select(
+        self,
+        placement: str,
+        country: Optional[str],
+        city: Optional[str],
+        state: Optional[str],
+        snapshot: Optional[EligibilitySnapshot] = None,
+        exclude: frozenset = frozenset(),
+    ) -> Optional[Dict[str, Any]]:
+        """Pick, count and package one ad for a placement (see select_ad)."""
+        # Steps 1-2: Find an eligible campaign and creative, then spend budget from its lease.
+        # A campaign whose budget ran out since the snapshot was built is skipped on retry.
+        for _ in range(3):
+            entry = self._find_eligible_campaign(
+                country, city, state, placement, snapshot=snapshot, exclude=exclude
+            )
             
-            if not eligible_campaign:
+            if not entry:
                 logger.info("No eligible campaigns found - returning None for AdSense fallback")
                 return None
             
-            # Step 2: Select an active creative from the campaign
-            creative = self._select_creative(eligible_campaign, placement)
-            
-            if not creative:
-                logger.warning(f"No active creatives for campaign {eligible_campaign.id}")
-                return None
+            eligible_campaign = entry.campaign
             
-            # Step 3: Generate tracking tokens
-            timestamp = datetime.utcnow()
-            impression_token = create_tracking_token(
-                ad_creative_id=str(creative.id),
-                campaign_id=str(eligible_campaign.id),
-                timestamp=timestamp,
-                token_type="impression"
-            )
+            # Select an active creative from the campaign (pre-filtered for this placement)
+            creative = random.choice(entry.creatives)
             
-            click_token = create_tracking_token(
-                ad_creative_id=str(creative.id),
-                campaign_id=str(eligible_campaign.id),
-                timestamp=timestamp,
-                token_type="click"
-            )
-            
-            # Step 4: Update campaign metrics (atomic)
-            self._update_campaign_served(eligible_campaign)
-            
-            # Step 5: Build response
-            ad_data = {
-                "ad_id": str(creative.id),
-                "campaign_id": str(eligible_campaign.id),
-                "image_url": creative_media_path(creative.id),
-                "image_width": creative.image_width,
-                "image_height": creative.image_height,
-                "click_url": creative.click_url,
-                "alt_text": creative.alt_text or eligible_campaign.name,
-                "impression_tracking_token": impression_token,
-                "click_tracking_token": click_token,
-            }
-            
-            logger.info(f"Selected ad: creative={creative.id}, campaign={eligible_campaign.id}")
-            return ad_data
-            
-        except Exception as e:
-            logger.error(f"Error selecting ad: {str(e)}", exc_info=True)
+            if self._update_campaign_served(eligible_campaign, creative):
+                break
+        else:
+            logger.info("Eligible campaigns exhausted their budget - returning None")
             return None
+        
+        return self._build_ad_data(eligible_campaign, creative)
+    
+    def _build_ad_data(
+        self, campaign: SnapshotCampaign, creative: SnapshotCreative
+    ) -> Dict[str, Any]:
+        """Mint tracking tokens and package the ad response for a served creative."""
+        # Step 3: Generate one compact tracking token for impression and click
+        tracking_token = create_compact_tracking_token(
+            ad_creative_id=creative.id,
+            campaign_id=campaign.id,
+            timestamp=datetime.utcnow(),
+            click_url=creative.click_url,
+        )
+        
+        # Step 4: Build response
+        ad_data = {
+            "ad_id": str(creative.id),
+            "campaign_id": str(campaign.id),
+            "image_url": creative_media_path(creative.id),
+            "image_width": creative.image_width,
+            "image_height": creative.image_height,
+            "click_url": creative.click_url,
+            "alt_text": creative.alt_text or campaign.name,
+            "impression_tracking_token": tracking_token,
+            "click_tracking_token": tracking_token,
+        }
+        
+        logger.info(f"Selected ad: creative={creative.id}, campaign={campaign.id}")
+        return ad_data
     
     def _find_eligible_campaign(
         self,
@@ -124,158 +201,240 @@ class AdSelectionService:
         city: Optional[str],
         state: Optional[str],
         placement: str,
-    ) -> Optional[Campaign]:
+        snapshot: Optional[EligibilitySnapshot] = None,
+        exclude: frozenset = frozenset(),
+    ) -> Optional[SnapshotEntry]:
         """
         Find an eligible campaign based on status, date range, budget, and targeting.
         
-        Returns a campaign chosen by weighted random selection. All eligible
-        campaigns can be shown; higher priority = more impressions.
+        Returns a campaign (with its creatives for this placement) chosen by
+        weighted random selection from the eligibility snapshot. All eligible
+        campaigns can be shown; higher priority = more impressions. Campaign ids
+        in ``exclude`` (already shown in another slot) are skipped.
         - Has status = 'active'
         - Current time is between start_date and end_date
         - Has remaining impression budget
         - Matches geographic targeting (if specified)
+        - Has at least one active creative sized for the placement
         """
-        now = datetime.utcnow()
+        if not exclude and self.no_fill.is_empty(placement, country):
+            return None
         
-        # Base query: active campaigns with budget remaining
-        query = self.db.query(Campaign).filter(
-            and_(
-                Campaign.status == CampaignStatus.ACTIVE,
-                Campaign.start_date <= now,
-                Campaign.end_date >= now,
-                Campaign.impressions_served < Campaign.impression_budget
-            )
-        ).options(
-            selectinload(Campaign.creatives)  # Eager load creatives
-        )
+        now = datetime.utcnow()
+        if snapshot is None:
+            snapshot = self.snapshot_cache.get(self.db, now)
         
-        no_geo_targeting = and_(
-            or_(Campaign.target_countries.is_(None), Campaign.target_countries == []),
-            or_(Campaign.target_cities.is_(None), Campaign.target_cities == []),
-            or_(Campaign.target_states.is_(None), Campaign.target_states == []),
-        )
-
-        # Apply geographic targeting
-        if country or city or state:
-            targeting_conditions = [no_geo_targeting]
-
-            if country:
-                targeting_conditions.append(
-                    Campaign.target_countries.contains([country.upper()])
-                )
-
-            if city:
-                targeting_conditions.append(
-                    Campaign.target_cities.contains([city])
-                )
-
-            if state:
-                targeting_conditions.append(
-                    Campaign.target_states.contains([state])
-                )
-
-            query = query.filter(or_(*targeting_conditions))
-        else:
-            # Unknown country: only worldwide campaigns (never country-specific inventory)
-            query = query.filter(no_geo_targeting)
+        def accept(campaign: SnapshotCampaign) -> bool:
+            return campaign.id not in exclude and self.budget.may_serve(campaign)
         
-        # Get all eligible campaigns - ALL active ads get a chance to show
-        all_eligible = query.all()
-
-        # Keep only campaigns with at least one creative sized for this placement
-        all_eligible = [
-            c
-            for c in all_eligible
-            if self._active_creatives_for_placement(c, placement)
-        ]
-
         # Do not fall back to other countries' campaigns when geo targeting yields no match.
-        if not all_eligible:
-            active_count = self.db.query(Campaign).filter(
-                Campaign.status == CampaignStatus.ACTIVE,
-                Campaign.start_date <= now,
-                Campaign.end_date >= now,
-                Campaign.impressions_served < Campaign.impression_budget
-            ).count()
-            logger.info(
-                "No eligible campaigns for placement=%s. Active campaigns with budget: %d. "
-                "Check admin: campaigns must be ACTIVE, within dates, have budget, "
-                "and have active creatives matching placement size.",
+        entry = snapshot.pick(
+            placement,
+            country,
+            city,
+            state,
+            now=now,
+            accept=accept,
+        )
+        if entry is None:
+            # Counted for the periodic no-fill report; only cached when the answer
+            # does not depend on excluded slots or on city/state targeting.
+            self.no_fill.record(
                 placement,
-                active_count,
+                country,
+                valid_until=snapshot.valid_until,
+                cacheable=not exclude and not snapshot.has_local_targeting(placement),
             )
-            return None
-
-        # Weighted selection: higher priority = more impressions, but ALL ads display
-        # Priority 5 shows ~5x more than priority 1, but priority 1 still shows
-        weights = [max(1, c.priority) for c in all_eligible]
-        campaign = random.choices(all_eligible, weights=weights, k=1)[0]
-        return campaign
+        return entry
     
-    def _active_creatives_for_placement(
-        self, campaign: Campaign, placement: str
-    ) -> list[AdCreative]:
-        return [
-            c
-            for c in campaign.creatives
-            if c.status == CreativeStatus.ACTIVE
-            and creative_matches_placement(c.image_width, c.image_height, placement)
-        ]
-
-    def _select_creative(
-        self, campaign: Campaign, placement: str
-    ) -> Optional[AdCreative]:
+    def _update_campaign_served(
+        self, campaign: SnapshotCampaign, creative: SnapshotCreative
+    ) -> bool:
         """
-        Select an active creative from the campaign that fits the placement slot.
-
-        Random choice among matching creatives for fair rotation.
+        Count a served impression against the campaign budget.
+        
+        Spends one impression from this worker's lease on the campaign budget;
+        impressions_served is reserved in chunks and times_served/last_served_at
+        are flushed in bulk (see impression_budget). Returns False when the
+        budget is exhausted.
         """
-        active_creatives = self._active_creatives_for_placement(campaign, placement)
+        return self.budget.consume(campaign.id, creative.id)
 
-        if not active_creatives:
-            return None
 
-        # Prefer the best-listed size for this placement (e.g. 320×50 before 728×90 in Events).
-        for target_w, target_h in preferred_sizes_for_placement(placement):
-            sized = [
-                c
-                for c in active_creatives
-                if size_matches(c.image_width, c.image_height, target_w, target_h)
-            ]
-            if sized:
-                return random.choice(sized)
-
-        return random.choice(active_creatives)
+class AsyncAdSelectionService(AdSelectionService):
+    """
+    AdSelectionService for the listener-facing async endpoints.
+    
+    Same selection rules; the snapshot is rebuilt and budget leases renewed
+    through an AsyncSession so the event loop is never blocked on the database.
+    With an AdDeadline, selection and token minting must finish within their
+    share of AD_SELECTION_TIMEOUT or no paid ad is returned. A listener asking
+    again for the same placement within AD_REQUEST_CACHE_TTL gets the ad they
+    were just served (see ad_request_cache) without spending more budget.
+    """
+    
+    def __init__(
+        self,
+        db: AsyncSession,
+        snapshot_cache: Optional[EligibilityCache] = None,
+        budget: Optional[ImpressionBudgetLedger] = None,
+        request_cache: Optional[AdRequestCache] = None,
+        no_fill: Optional[NoFillCache] = None,
+    ):
+        super().__init__(db, snapshot_cache=snapshot_cache, budget=budget, no_fill=no_fill)
+        self.request_cache = request_cache if request_cache is not None else ad_request_cache
     
-    def _update_campaign_served(self, campaign: Campaign) -> None:
+    async def select_ad(
+        self,
+        user_id: str,
+        placement: str,
+        country: Optional[str] = None,
+        city: Optional[str] = None,
+        state: Optional[str] = None,
+        deadline: Optional[AdDeadline] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Select an ad to serve (see AdSelectionService.select_ad)."""
+        logger.info(f"Selecting ad for user={user_id}, placement={placement}, location={country}/{city}/{state}")
+        
+        key = request_key(user_id, placement, country, city, state)
+        cached = self.request_cache.get(key)
+        if cached is not None:
+            logger.info(f"Repeat request, reusing ad: creative={cached['ad_id']}, user={user_id}")
+            return cached
+        
+        try:
+            ad_data = await self._select_async(placement, country, city, state, deadline=deadline)
+            if ad_data is not None:
+                self.request_cache.put(key, ad_data)
+            return ad_data
+        except AdDeadlineExceeded:
+            return None
+        except Exception as e:
+            logger.error(f"Error selecting ad: {str(e)}", exc_info=True)
+            return None
+    
+    async def select_ads(
+        self,
+        user_id: str,
+        placements: list[str],
+        country: Optional[str] = None,
+        city: Optional[str] = None,
+        state: Optional[str] = None,
+        deadline: Optional[AdDeadline] = None,
+    ) -> Dict[str, Optional[Dict[str, Any]]]:
         """
-        Update campaign metrics atomically after serving an ad.
+        Select one ad per placement for a page load (see AdSelectionService.select_ads).
         
-        Increments impressions_served and updates last_served_at.
-        Uses database-level atomic operations to prevent race conditions.
+        Once the deadline is exceeded the remaining placements get None.
         """
+        logger.info(f"Selecting ads for user={user_id}, placements={placements}, location={country}/{city}/{state}")
+        
+        # Slots this listener was just served keep their ad; only the rest are selected.
+        keys = {placement: request_key(user_id, placement, country, city, state) for placement in placements}
+        results: Dict[str, Optional[Dict[str, Any]]] = {
+            placement: self.request_cache.get(key) for placement, key in keys.items()
+        }
+        if all(ad_data is not None for ad_data in results.values()):
+            return results
+        used_campaigns: set[UUID] = {
+            UUID(ad_data["campaign_id"]) for ad_data in results.values() if ad_data is not None
+        }
+        
         try:
-            # Update using SQLAlchemy's update() for atomic operation
-            self.db.query(Campaign).filter(
-                Campaign.id == campaign.id
-            ).update(
-                {
-                    "impressions_served": Campaign.impressions_served + 1,
-                    "last_served_at": datetime.utcnow()
-                },
-                synchronize_session=False
+            snapshot_load = self.snapshot_cache.get_async()
+            if deadline is not None:
+                snapshot = await deadline.run(SELECTION, snapshot_load)
+            else:
+                snapshot = await snapshot_load
+        except AdDeadlineExceeded:
+            return results
+        except Exception as e:
+            logger.error(f"Error loading eligibility snapshot: {str(e)}", exc_info=True)
+            return results
+        
+        for placement in placements:
+            if results[placement] is not None:
+                continue
+            try:
+                ad_data = await self._select_async(
+                    placement, country, city, state,
+                    snapshot=snapshot,
+                    exclude=frozenset(used_campaigns),
+                    deadline=deadline,
+                )
+                if ad_data is None and used_campaigns:
+                    # Only campaigns already on the page fit this slot; repeat one rather than go empty.
+                    ad_data = await self._select_async(
+                        placement, country, city, state, snapshot=snapshot, deadline=deadline
+                    )
+            except AdDeadlineExceeded:
+                break
+            except Exception as e:
+                logger.error(f"Error selecting ad for placement={placement}: {str(e)}", exc_info=True)
+                ad_data = None
+            if ad_data is not None:
+                used_campaigns.add(UUID(ad_data["campaign_id"]))
+                self.request_cache.put(keys[placement], ad_data)
+            results[placement] = ad_data
+        return results
+    
+    async def _select_async(
+        self,
+        placement: str,
+        country: Optional[str],
+        city: Optional[str],
+        state: Optional[str],
+        snapshot: Optional[EligibilitySnapshot] = None,
+        exclude: frozenset = frozenset(),
+        deadline: Optional[AdDeadline] = None,
+    ) -> Optional[Dict[str, Any]]:
+        """Async counterpart of AdSelectionService._select, bounded by the deadline."""
+        choice = self._choose_async(placement, country, city, state, snapshot, exclude)
+        if deadline is None:
+            chosen = await choice
+        else:
+            chosen = await deadline.run(SELECTION, choice)
+        if chosen is None:
+            return None
+        
+        campaign, creative = chosen
+        if deadline is not None:
+            try:
+                deadline.check(TOKENS)
+            except AdDeadlineExceeded:
+                # The impression is not going to be shown; return it to the lease.
+                self.budget.refund(campaign.id, creative.id)
+                raise
+        return self._build_ad_data(campaign, creative)
+    
+    async def _choose_async(
+        self,
+        placement: str,
+        country: Optional[str],
+        city: Optional[str],
+        state: Optional[str],
+        snapshot: Optional[EligibilitySnapshot],
+        exclude: frozenset,
+    ) -> Optional[tuple[SnapshotCampaign, SnapshotCreative]]:
+        """Pick a campaign and creative and spend one impression from its lease."""
+        if not exclude and self.no_fill.is_empty(placement, country):
+            return None
+        if snapshot is None:
+            snapshot = await self.snapshot_cache.get_async()
+        
+        for _ in range(3):
+            entry = self._find_eligible_campaign(
+                country, city, state, placement, snapshot=snapshot, exclude=exclude
             )
-            self.db.commit()
             
-        except Exception as e:
-            logger.error(f"Error updating campaign metrics: {str(e)}")
-            self.db.rollback()
-            raise
-
-
-
-
-
-
-
-
+            if not entry:
+                logger.info("No eligible campaigns found - returning None for AdSense fallback")
+                return None
+            
+            creative = random.choice(entry.creatives)
+            
+            if await self.budget.consume_async(entry.campaign.id, creative.id):
+                return entry.campaign, creative
+        
+        logger.info("Eligible campaigns exhausted their budget - returning None")
+        return None
@@ -1,21 +1,95 @@
 """
 Ad serving service with ad selection logic.
 """
-import random
-from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_, func
+from collections import Counter
+from dataclasses import dataclass
+from sqlalchemy.orm import Session, contains_eager
+from sqlalchemy import and_, or_, func, insert, select, update
 from datetime import datetime
-from typing import Optional
+from typing import Iterable, List, Optional
 from uuid import UUID
+import uuid
 
 from app.models.campaign import Campaign, CampaignStatus
 from app.models.ad_creative import AdCreative, CreativeStatus
 from app.models.impression import Impression
 
+# Creatives within 20% of the requested width/height are accepted.
+SIZE_TOLERANCE = 0.2
+
+
+@dataclass(frozen=True)
+class ImpressionRecord:
+    """One impression to write with AdService.record_impressions."""
+    creative_id: UUID
+    campaign_id: UUID
+    user_id: str
+    city: Optional[str] = None
+    state: Optional[str] = None
+    timestamp: Optional[datetime] = None
+
 
 class AdService:
     """Service for selecting and serving ads."""
-    
+
+    @staticmethod
+    def eligible_creatives_query(
+        now: datetime,
+        city: Optional[str] = None,
+        state: Optional[str] = None,
+        width: Optional[int] = None,
+        height: Optional[int] = None
+    ):
+        """
+        Active creatives of eligible campaigns, with their campaign joined in.
+
+        Campaign status, dates, budget, targeting and creative size are all
+        filtered in SQL, highest priority first and random within a priority.
+        """
+        query = (
+            select(AdCreative)
+            .join(AdCreative.campaign)
+            .options(contains_eager(AdCreative.campaign))
+            .where(
+                Campaign.status == CampaignStatus.ACTIVE,
+                Campaign.start_date <= now,
+                Campaign.end_date >= now,
+                Campaign.impressions_served < Campaign.impression_budget,
+                AdCreative.status == CreativeStatus.ACTIVE
+            )
+        )
+
+        # Apply targeting filters if location data provided
+        if city:
+            query = query.where(
+                or_(
+                    Campaign.target_cities.is_(None),
+                    Campaign.target_cities.contains([city])
+                )
+            )
+        if state:
+            query = query.where(
+                or_(
+                    Campaign.target_states.is_(None),
+                    Campaign.target_states.contains([state])
+                )
+            )
+
+        # Filter by size if provided, within SIZE_TOLERANCE of the slot
+        if width and height:
+            query = query.where(
+                and_(
+                    AdCreative.image_width.between(
+                        int(width * (1 - SIZE_TOLERANCE)), int(width * (1 + SIZE_TOLERANCE))
+                    ),
+                    AdCreative.image_height.between(
+                        int(height * (1 - SIZE_TOLERANCE)), int(height * (1 + SIZE_TOLERANCE))
+                    )
+                )
+            )
+
+        return query.order_by(Campaign.priority.desc(), func.random())
+
     @staticmethod
     def select_ad(
         db: Session,
@@ -32,79 +106,17 @@ class AdService:
         - Budget availability (impressions_served < impression_budget)
         - Creative status (must be ACTIVE)
         - Targeting (city/state if provided)
+        - Size (within SIZE_TOLERANCE of width/height if provided)
         - Priority (higher priority campaigns first)
-        
+
+        One query returns a random matching creative from the highest-priority
+        eligible campaigns, with its campaign loaded.
+
         Returns the selected AdCreative or None if no ad available.
         """
-        now = datetime.utcnow()
-        
-        # Build query for eligible campaigns
-        query = db.query(Campaign).join(AdCreative).filter(
-            Campaign.status == CampaignStatus.ACTIVE,
-            Campaign.start_date <= now,
-            Campaign.end_date >= now,
-            Campaign.impressions_served < Campaign.impression_budget,
-            AdCreative.status == CreativeStatus.ACTIVE
-        )
-        
-        # Apply targeting filters if location data provided
-        if city or state:
-            targeting_filters = []
-            if city:
-                targeting_filters.append(
-                    or_(
-                        Campaign.target_cities.is_(None),
-                        Campaign.target_cities.contains([city])
-                    )
-                )
-            if state:
-                targeting_filters.append(
-                    or_(
-                        Campaign.target_states.is_(None),
-                        Campaign.target_states.contains([state])
-                    )
-                )
-            if targeting_filters:
-                query = query.filter(and_(*targeting_filters))
-        
-        # Filter by size if provided (optional - can be relaxed)
-        if width and height:
-            # Allow ads that match size or are flexible
-            query = query.filter(
-                or_(
-                    and_(
-                        AdCreative.image_width == width,
-                        AdCreative.image_height == height
-                    ),
-                    # Allow ads that are close in size (within 20% tolerance)
-                    and_(
-                        AdCreative.image_width.between(int(width * 0.8), int(width * 1.2)),
-                        AdCreative.image_height.between(int(height * 0.8), int(height * 1.2))
-                    )
-                )
-            )
-        
-        # Order by priority (descending) and randomize within same priority
-        campaigns = query.order_by(
-            Campaign.priority.desc(),
-            func.random()
-        ).all()
-        
-        # Select first campaign with available creatives
-        for campaign in campaigns:
-            # Get active creatives for this campaign
-            creatives = db.query(AdCreative).filter(
-                AdCreative.campaign_id == campaign.id,
-                AdCreative.status == CreativeStatus.ACTIVE
-            ).all()
-            
-            if creatives:
-                # Select a random creative from the campaign
-                selected_creative = random.choice(creatives)
-                return selected_creative
-        
-        return None
-    
+        query = AdService.eligible_creatives_query(datetime.utcnow(), city, state, width, height)
+        return db.execute(query.limit(1)).scalars().first()
+
     @staticmethod
     def record_impression(
         db: Session,
@@ -115,23 +127,64 @@ class AdService:
         state: Optional[str] = None
     ) -> Impression:
         """Record an ad impression."""
+        now = datetime.utcnow()
         impression = Impression(
             ad_creative_id=creative_id,
             campaign_id=campaign_id,
             user_id=user_id,
             city=city,
             state=state,
-            timestamp=datetime.utcnow()
+            timestamp=now
         )
         db.add(impression)
-        
-        # Update campaign impressions_served counter
-        campaign = db.query(Campaign).filter(Campaign.id == campaign_id).first()
-        if campaign:
-            campaign.impressions_served += 1
-            campaign.last_served_at = datetime.utcnow()
-        
+
+        # Update campaign impressions_served counter in SQL (no read of the campaign)
+        AdService._add_campaign_impressions(db, {campaign_id: 1}, now)
+
         db.commit()
         db.refresh(impression)
         return impression
 
+    @staticmethod
+    def record_impressions(db: Session, records: Iterable[ImpressionRecord]) -> List[UUID]:
+        """
+        Record many impressions in one transaction.
+
+        Impressions are bulk inserted and each campaign's impressions_served is
+        incremented once by its count. Returns the new impression ids.
+        """
+        now = datetime.utcnow()
+        rows = [
+            {
+                "id": uuid.uuid4(),
+                "ad_creative_id": record.creative_id,
+                "campaign_id": record.campaign_id,
+                "user_id": record.user_id,
+                "city": record.city,
+                "state": record.state,
+                "timestamp": record.timestamp or now,
+            }
+            for record in records
+        ]
+        if not rows:
+            return []
+
+        db.execute(insert(Impression), rows)
+        AdService._add_campaign_impressions(
+            db, Counter(row["campaign_id"] for row in rows), now
+        )
+        db.commit()
+        return [row["id"] for row in rows]
+
+    @staticmethod
+    def _add_campaign_impressions(db: Session, counts: dict, served_at: datetime) -> None:
+        for campaign_id, served in counts.items():
+            db.execute(
+                update(Campaign)
+                .where(Campaign.id == campaign_id)
+                .values(
+                    impressions_served=Campaign.impressions_served + served,
+                    last_served_at=served_at,
+                )
+                .execution_options(synchronize_session=False)
+            )
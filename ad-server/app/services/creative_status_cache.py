@@ -0,0 +1,96 @@
+"""
+In-memory creative status map for tracking validation.
+
+Every impression and click must reference an existing, ACTIVE creative of an
+existing campaign. Instead of two primary-key queries per event, tracking
+looks the creative up here: creative id -> (campaign id, status, click URL).
+Misses are read from the database and remembered.
+
+The whole map is dropped when campaigns or creatives change in this process
+(inventory version) and entries expire after TRACKING_STATUS_CACHE_TTL
+seconds, which picks up admin writes made through other workers.
+"""
+from __future__ import annotations
+
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Optional
+
+from app.core.config import settings
+from app.models.ad_creative import AdCreative
+from app.services.inventory_events import inventory_version
+
+
+@dataclass(frozen=True)
+class CreativeState:
+    """What tracking needs to know about a creative."""
+    id: uuid.UUID
+    campaign_id: uuid.UUID
+    status: str
+    click_url: Optional[str]
+
+    @classmethod
+    def of(cls, creative: AdCreative) -> "CreativeState":
+        return cls(
+            id=creative.id,
+            campaign_id=creative.campaign_id,
+            status=creative.status,
+            click_url=creative.click_url,
+        )
+
+
+class CreativeStatusCache:
+    """Thread-safe, versioned map of creative id to CreativeState."""
+
+    def __init__(self, ttl_seconds: Optional[float] = None, max_entries: Optional[int] = None):
+        self.ttl = settings.TRACKING_STATUS_CACHE_TTL if ttl_seconds is None else ttl_seconds
+        self.max_entries = (
+            settings.TRACKING_STATUS_CACHE_SIZE if max_entries is None else max_entries
+        )
+        self._lock = threading.Lock()
+        self._version = inventory_version()
+        # creative id -> (expires_at, state)
+        self._entries: dict[uuid.UUID, tuple[float, CreativeState]] = {}
+        self.stats = {"hits": 0, "misses": 0}
+
+    def _check_version(self) -> None:
+        version = inventory_version()
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+
+    def get(self, creative_id: uuid.UUID) -> Optional[CreativeState]:
+        with self._lock:
+            self._check_version()
+            entry = self._entries.get(creative_id)
+            if entry is None or entry[0] <= time.monotonic():
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            return entry[1]
+
+    def put(self, creative: AdCreative) -> CreativeState:
+        """Remember a creative read from the database; returns its status entry."""
+        entry = CreativeState.of(creative)
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return entry
+        with self._lock:
+            self._check_version()
+            self._entries.pop(entry.id, None)
+            self._entries[entry.id] = (time.monotonic() + self.ttl, entry)
+            while len(self._entries) > self.max_entries:
+                # Oldest insert first
+                del self._entries[next(iter(self._entries))]
+        return entry
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+creative_status_cache = CreativeStatusCache()
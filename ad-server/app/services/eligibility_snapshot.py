@@ -0,0 +1,418 @@
+"""
+Process-local eligibility snapshot for ad selection.
+
+Active campaigns and their creatives are loaded once, bucketed by placement and
+targeting key (worldwide / country / state / city) with cumulative priority
+weights, and reused across requests. The snapshot is rebuilt when campaigns or
+creatives change, when a campaign start/end boundary passes, and at least every
+AD_SNAPSHOT_MAX_AGE seconds (which also picks up writes made by other workers).
+"""
+from __future__ import annotations
+
+import asyncio
+import bisect
+import logging
+import random
+import threading
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Iterable, Optional
+from uuid import UUID
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, selectinload
+
+from app.constants.placements import (
+    DEFAULT_PLACEMENT,
+    PLACEMENT_SIZE_PREFERENCES,
+    creative_matches_placement,
+    preferred_sizes_for_placement,
+    size_matches,
+)
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.ad_creative import CreativeStatus
+from app.models.campaign import Campaign, CampaignStatus
+from app.services.inventory_events import inventory_version
+
+logger = logging.getLogger(__name__)
+
+WORLDWIDE = "worldwide"
+COUNTRY = "country"
+STATE = "state"
+CITY = "city"
+
+BucketKey = tuple[str, str, str]  # (placement, targeting kind, targeting value)
+
+
+def placement_key(placement: Optional[str]) -> str:
+    """Placement bucket name; unknown placements share the default slot sizes."""
+    key = (placement or DEFAULT_PLACEMENT).strip().lower()
+    return key if key in PLACEMENT_SIZE_PREFERENCES else DEFAULT_PLACEMENT
+
+
+def best_fit_creatives(creatives: Iterable, placement: str) -> list:
+    """
+    Active creatives for a placement, narrowed to the best-listed size present
+    (e.g. 320×50 before 728×90 in Events). Empty when nothing fits the slot.
+    """
+    matching = [
+        c
+        for c in creatives
+        if c.status == CreativeStatus.ACTIVE
+        and creative_matches_placement(c.image_width, c.image_height, placement)
+    ]
+    for target_w, target_h in preferred_sizes_for_placement(placement):
+        sized = [
+            c for c in matching if size_matches(c.image_width, c.image_height, target_w, target_h)
+        ]
+        if sized:
+            return sized
+    return matching
+
+
+@dataclass(frozen=True)
+class SnapshotCreative:
+    id: UUID
+    image_width: int
+    image_height: int
+    click_url: str
+    alt_text: Optional[str]
+
+
+@dataclass(frozen=True)
+class SnapshotCampaign:
+    id: UUID
+    name: str
+    priority: int
+    start_date: datetime
+    end_date: datetime
+    impression_budget: int
+    impressions_served: int
+    target_countries: frozenset[str]
+    target_states: frozenset[str]
+    target_cities: frozenset[str]
+
+    def is_live(self, now: datetime) -> bool:
+        return self.start_date <= now <= self.end_date
+
+    def targeting_keys(self) -> list[tuple[str, str]]:
+        if not (self.target_countries or self.target_states or self.target_cities):
+            return [(WORLDWIDE, "")]
+        return (
+            [(COUNTRY, c) for c in self.target_countries]
+            + [(STATE, s) for s in self.target_states]
+            + [(CITY, c) for c in self.target_cities]
+        )
+
+
+@dataclass(frozen=True)
+class SnapshotEntry:
+    """A campaign paired with its best-fit creatives for one placement."""
+    campaign: SnapshotCampaign
+    creatives: tuple[SnapshotCreative, ...]
+
+
+@dataclass(frozen=True)
+class WeightedBucket:
+    entries: tuple[SnapshotEntry, ...]
+    cumulative_weights: tuple[int, ...]
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[SnapshotEntry]) -> "WeightedBucket":
+        entries = tuple(entries)
+        cumulative: list[int] = []
+        total = 0
+        for entry in entries:
+            # Priority 5 shows ~5x more than priority 1, but priority 1 still shows
+            total += max(1, entry.campaign.priority)
+            cumulative.append(total)
+        return cls(entries=entries, cumulative_weights=tuple(cumulative))
+
+    @property
+    def total_weight(self) -> int:
+        return self.cumulative_weights[-1] if self.cumulative_weights else 0
+
+    def pick(self, rng: random.Random) -> SnapshotEntry:
+        point = rng.random() * self.total_weight
+        index = bisect.bisect_right(self.cumulative_weights, point)
+        return self.entries[min(index, len(self.entries) - 1)]
+
+
+@dataclass(frozen=True)
+class EligibilitySnapshot:
+    version: int
+    built_at: datetime
+    valid_until: datetime
+    campaign_count: int
+    buckets: dict[BucketKey, WeightedBucket]
+    # Servable creatives by id (click redirects resolve their URL here)
+    creatives: dict[UUID, tuple[SnapshotCampaign, SnapshotCreative]] = field(default_factory=dict)
+
+    def has_local_targeting(self, placement: str) -> bool:
+        """True when some campaign for this placement targets a state or city."""
+        slot = placement_key(placement)
+        return any(key[0] == slot and key[1] in (STATE, CITY) for key in self.buckets)
+
+    def is_stale(self, now: datetime, version: int) -> bool:
+        return version != self.version or now >= self.valid_until
+
+    def buckets_for(
+        self,
+        placement: str,
+        country: Optional[str] = None,
+        city: Optional[str] = None,
+        state: Optional[str] = None,
+    ) -> list[WeightedBucket]:
+        slot = placement_key(placement)
+        # Unknown country: only worldwide campaigns (never country-specific inventory)
+        keys: list[BucketKey] = [(slot, WORLDWIDE, "")]
+        if country:
+            keys.append((slot, COUNTRY, country.upper()))
+        if state:
+            keys.append((slot, STATE, state))
+        if city:
+            keys.append((slot, CITY, city))
+        return [self.buckets[k] for k in keys if k in self.buckets]
+
+    def pick(
+        self,
+        placement: str,
+        country: Optional[str] = None,
+        city: Optional[str] = None,
+        state: Optional[str] = None,
+        *,
+        now: Optional[datetime] = None,
+        accept: Optional[Callable[[SnapshotCampaign], bool]] = None,
+        rng: Optional[random.Random] = None,
+    ) -> Optional[SnapshotEntry]:
+        """
+        Weighted random pick among campaigns eligible for this request.
+
+        With a single matching bucket the precomputed cumulative weights are used
+        directly; a few rejection-sampling attempts skip campaigns that ended or
+        ran out of budget since the build. Otherwise buckets are merged (a campaign
+        can target both a country and a city) and re-weighted.
+        """
+        now = now or datetime.utcnow()
+        rng = rng or random
+        buckets = self.buckets_for(placement, country, city, state)
+        if not buckets:
+            return None
+
+        def usable(entry: SnapshotEntry) -> bool:
+            return entry.campaign.is_live(now) and (accept is None or accept(entry.campaign))
+
+        if len(buckets) == 1:
+            for _ in range(3):
+                entry = buckets[0].pick(rng)
+                if usable(entry):
+                    return entry
+
+        merged: dict[UUID, SnapshotEntry] = {}
+        for bucket in buckets:
+            for entry in bucket.entries:
+                if entry.campaign.id not in merged and usable(entry):
+                    merged[entry.campaign.id] = entry
+        if not merged:
+            return None
+        return WeightedBucket.from_entries(merged.values()).pick(rng)
+
+
+def _snapshot_campaign(campaign: Campaign) -> SnapshotCampaign:
+    return SnapshotCampaign(
+        id=campaign.id,
+        name=campaign.name,
+        priority=campaign.priority,
+        start_date=campaign.start_date,
+        end_date=campaign.end_date,
+        impression_budget=campaign.impression_budget,
+        impressions_served=campaign.impressions_served,
+        target_countries=frozenset(campaign.target_countries or ()),
+        target_states=frozenset(campaign.target_states or ()),
+        target_cities=frozenset(campaign.target_cities or ()),
+    )
+
+
+def _snapshot_creative(creative) -> SnapshotCreative:
+    return SnapshotCreative(
+        id=creative.id,
+        image_width=creative.image_width,
+        image_height=creative.image_height,
+        click_url=creative.click_url,
+        alt_text=creative.alt_text,
+    )
+
+
+def build_snapshot(
+    campaigns: Iterable[Campaign],
+    now: datetime,
+    version: int,
+    max_age: timedelta,
+) -> EligibilitySnapshot:
+    """
+    Bucket live campaigns by placement and targeting key.
+
+    Budget is not checked here: impressions_served includes quota leased to
+    workers but not yet spent, so exhaustion is left to the budget ledger.
+    """
+    grouped: dict[BucketKey, list[SnapshotEntry]] = {}
+    creatives_by_id: dict[UUID, tuple[SnapshotCampaign, SnapshotCreative]] = {}
+    boundaries: list[datetime] = [now + max_age]
+    live_count = 0
+
+    for campaign in campaigns:
+        if campaign.status != CampaignStatus.ACTIVE:
+            continue
+        if campaign.end_date < now:
+            continue
+        if campaign.start_date > now:
+            boundaries.append(campaign.start_date)
+            continue
+        if campaign.end_date > now:
+            boundaries.append(campaign.end_date)
+
+        snap_campaign = _snapshot_campaign(campaign)
+        targeting = snap_campaign.targeting_keys()
+        placed = False
+        for slot in PLACEMENT_SIZE_PREFERENCES:
+            creatives = best_fit_creatives(campaign.creatives, slot)
+            if not creatives:
+                continue
+            placed = True
+            entry = SnapshotEntry(
+                campaign=snap_campaign,
+                creatives=tuple(_snapshot_creative(c) for c in creatives),
+            )
+            for creative in entry.creatives:
+                creatives_by_id.setdefault(creative.id, (snap_campaign, creative))
+            for kind, value in targeting:
+                grouped.setdefault((slot, kind, value), []).append(entry)
+        if placed:
+            live_count += 1
+
+    return EligibilitySnapshot(
+        version=version,
+        built_at=now,
+        valid_until=min(boundaries),
+        campaign_count=live_count,
+        buckets={key: WeightedBucket.from_entries(entries) for key, entries in grouped.items()},
+        creatives=creatives_by_id,
+    )
+
+
+def _candidate_campaigns_query(now: datetime):
+    """Active campaigns that have not ended (includes future starts)."""
+    return (
+        select(Campaign)
+        .where(
+            Campaign.status == CampaignStatus.ACTIVE,
+            Campaign.end_date >= now,
+        )
+        .options(selectinload(Campaign.creatives))
+    )
+
+
+def load_candidate_campaigns(db: Session, now: datetime) -> list[Campaign]:
+    return list(db.execute(_candidate_campaigns_query(now)).scalars().all())
+
+
+async def load_candidate_campaigns_async(db: AsyncSession, now: datetime) -> list[Campaign]:
+    result = await db.execute(_candidate_campaigns_query(now))
+    return list(result.scalars().all())
+
+
+class EligibilityCache:
+    """Holds the current snapshot and rebuilds it on demand (one rebuild at a time)."""
+
+    def __init__(
+        self,
+        loader: Callable[[Session, datetime], Iterable[Campaign]] = load_candidate_campaigns,
+        max_age_seconds: Optional[int] = None,
+        async_loader: Callable[
+            [AsyncSession, datetime], Awaitable[Iterable[Campaign]]
+        ] = load_candidate_campaigns_async,
+        async_session_factory: Callable[[], AsyncSession] = AsyncSessionLocal,
+    ):
+        self._loader = loader
+        self._async_loader = async_loader
+        self._async_session_factory = async_session_factory
+        self._rebuild_task: Optional[asyncio.Task] = None
+        self._max_age = timedelta(
+            seconds=settings.AD_SNAPSHOT_MAX_AGE if max_age_seconds is None else max_age_seconds
+        )
+        self._lock = threading.Lock()
+        self._snapshot: Optional[EligibilitySnapshot] = None
+
+    def get(self, db: Session, now: Optional[datetime] = None) -> EligibilitySnapshot:
+        now = now or datetime.utcnow()
+        snapshot = self._snapshot
+        if snapshot is not None and not snapshot.is_stale(now, inventory_version()):
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            version = inventory_version()
+            if snapshot is not None and not snapshot.is_stale(now, version):
+                return snapshot
+            # Read the version before loading so a concurrent write forces another rebuild.
+            return self._install(self._loader(db, now), now, version)
+
+    async def get_async(self, now: Optional[datetime] = None) -> EligibilitySnapshot:
+        """
+        Same as get(), loading through an AsyncSession without blocking the event loop.
+
+        The rebuild runs as a single background task on its own session, so a caller
+        that gives up (request deadline) does not cancel it. While it runs callers
+        keep getting the previous snapshot; only the very first load waits for it.
+        """
+        now = now or datetime.utcnow()
+        snapshot = self._snapshot
+        if snapshot is not None and not snapshot.is_stale(now, inventory_version()):
+            return snapshot
+
+        task = self._rebuild_task
+        if task is None or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = asyncio.ensure_future(self._rebuild_async(now))
+            task.add_done_callback(self._rebuild_done)
+            self._rebuild_task = task
+        if snapshot is not None:
+            return snapshot
+        return await asyncio.shield(task)
+
+    async def _rebuild_async(self, now: datetime) -> EligibilitySnapshot:
+        # Read the version before loading so a concurrent write forces another rebuild.
+        version = inventory_version()
+        async with self._async_session_factory() as db:
+            campaigns = await self._async_loader(db, now)
+        with self._lock:
+            return self._install(campaigns, now, version)
+
+    @staticmethod
+    def _rebuild_done(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Eligibility snapshot rebuild failed: %s", task.exception())
+
+    def _install(
+        self, campaigns: Iterable[Campaign], now: datetime, version: int
+    ) -> EligibilitySnapshot:
+        snapshot = build_snapshot(campaigns, now, version, self._max_age)
+        self._snapshot = snapshot
+        logger.info(
+            "Eligibility snapshot rebuilt: %d campaigns, %d buckets, valid until %s",
+            snapshot.campaign_count,
+            len(snapshot.buckets),
+            snapshot.valid_until.isoformat(),
+        )
+        return snapshot
+
+    def peek(self) -> Optional[EligibilitySnapshot]:
+        """Current snapshot, possibly stale, without rebuilding (never touches the database)."""
+        return self._snapshot
+
+    def invalidate(self) -> None:
+        self._snapshot = None
+
+
+eligibility_cache = EligibilityCache()
@@ -0,0 +1,257 @@
+"""
+Write-behind ingestion of impression and click events.
+
+Tracking endpoints validate an event, hand it to the ingestion queue and
+respond immediately. A background task drains the queue and writes events in
+bulk (one executemany INSERT per table per batch) when TRACKING_FLUSH_BATCH
+events are waiting or TRACKING_FLUSH_INTERVAL seconds have passed.
+
+The queue is bounded by TRACKING_QUEUE_MAX_SIZE: when it is full, accept()
+refuses the event so the endpoint can answer 503 and the client retries later
+instead of the process buffering without limit.
+
+With a spool (app.services.event_spool) attached, batches that cannot be
+written go to local segment files instead, as does everything after them
+until the replayer has caught up, so events keep their order and tracking
+latency does not depend on database health. A full queue also overflows to
+the spool instead of refusing events.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import TYPE_CHECKING, Callable, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.models.click import Click
+from app.models.impression import Impression
+from app.services.share_report_cache import share_report_cache
+
+if TYPE_CHECKING:
+    from app.services.event_spool import EventSpool
+
+logger = logging.getLogger(__name__)
+
+IMPRESSION = "impression"
+CLICK = "click"
+
+
+@dataclass(frozen=True)
+class TrackingEvent:
+    """A validated impression or click, ready to be written."""
+    kind: str
+    ad_creative_id: uuid.UUID
+    campaign_id: uuid.UUID
+    user_id: str
+    timestamp: datetime
+    city: Optional[str] = None
+    state: Optional[str] = None
+    id: uuid.UUID = field(default_factory=uuid.uuid4)
+
+    def row(self) -> dict:
+        row = asdict(self)
+        del row["kind"]
+        if self.kind == CLICK:
+            del row["city"], row["state"]
+        return row
+
+
+class EventIngestionQueue:
+    """Bounded in-process queue of tracking events with a bulk-writing consumer."""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession] = AsyncSessionLocal,
+        max_size: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        spool: Optional["EventSpool"] = None,
+    ):
+        self._session_factory = session_factory
+        self.spool = spool
+        self.max_size = max_size or settings.TRACKING_QUEUE_MAX_SIZE
+        self.batch_size = batch_size or settings.TRACKING_FLUSH_BATCH
+        self.flush_interval = (
+            settings.TRACKING_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        )
+        self._queue: Optional[asyncio.Queue[TrackingEvent]] = None
+        # Batch that failed to write; retried before anything new is taken
+        self._retry: list[TrackingEvent] = []
+        self.stats = {
+            "accepted": 0, "rejected": 0, "written": 0, "failed_flushes": 0, "spooled": 0,
+        }
+
+    @property
+    def queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+        return self._queue
+
+    def accept(self, event: TrackingEvent) -> bool:
+        """Enqueue a validated event; False when the queue is full (backpressure)."""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            if self.spool is not None and self._spool_overflow(event):
+                return True
+            self.stats["rejected"] += 1
+            return False
+        self.stats["accepted"] += 1
+        return True
+
+    def _spool_overflow(self, event: TrackingEvent) -> bool:
+        # Buffered append; fsync'd by the replayer's periodic sync()
+        try:
+            self.spool.append([event], sync=False)
+        except OSError as e:
+            logger.error(f"Tracking spool append failed: {str(e)}")
+            return False
+        self.stats["accepted"] += 1
+        self.stats["spooled"] += 1
+        return True
+
+    def pending(self) -> int:
+        return self.queue.qsize() + len(self._retry)
+
+    async def _next_batch(self) -> list[TrackingEvent]:
+        """Wait up to flush_interval for the first event, then take what is queued."""
+        if self._retry:
+            batch, self._retry = self._retry, []
+            return batch
+        batch: list[TrackingEvent] = []
+        try:
+            batch.append(await asyncio.wait_for(self.queue.get(), timeout=self.flush_interval))
+        except asyncio.TimeoutError:
+            return batch
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def write(self, batch: list[TrackingEvent], idempotent: bool = False) -> None:
+        """
+        Insert a batch of events in one transaction (executemany per table).
+
+        idempotent skips events whose id is already stored (spool replay may
+        repeat a partly written segment).
+        """
+        impressions = [e.row() for e in batch if e.kind == IMPRESSION]
+        clicks = [e.row() for e in batch if e.kind == CLICK]
+        if idempotent:
+            impression_stmt = pg_insert(Impression).on_conflict_do_nothing(
+                index_elements=["id", "timestamp"]
+            )
+            click_stmt = pg_insert(Click).on_conflict_do_nothing(
+                index_elements=["id", "timestamp"]
+            )
+        else:
+            impression_stmt, click_stmt = insert(Impression), insert(Click)
+        async with self._session_factory() as db:
+            try:
+                if impressions:
+                    await db.execute(impression_stmt, impressions)
+                if clicks:
+                    await db.execute(click_stmt, clicks)
+                await db.commit()
+            except Exception:
+                await db.rollback()
+                raise
+        share_report_cache.record_events(event.campaign_id for event in batch)
+
+    async def _to_spool(self, batch: list[TrackingEvent]) -> bool:
+        try:
+            await asyncio.to_thread(self.spool.append, batch)
+        except OSError as e:
+            logger.error(f"Tracking spool append failed ({len(batch)} events): {str(e)}")
+            return False
+        self.stats["spooled"] += len(batch)
+        return True
+
+    async def flush_once(self) -> int:
+        """Write (or spool) one batch; returns the number of events handled."""
+        batch = await self._next_batch()
+        if not batch:
+            return 0
+        if self.spool is not None and self.spool.pending():
+            # Replayer still catching up: keep events in order behind the spool
+            if await self._to_spool(batch):
+                return len(batch)
+        try:
+            await self.write(batch)
+        except asyncio.CancelledError:
+            # Shutdown mid-write: keep the batch for drain()
+            self._retry = batch
+            raise
+        except Exception as e:
+            self.stats["failed_flushes"] += 1
+            if self.spool is not None and await self._to_spool(batch):
+                logger.warning(f"Tracking event flush failed, spooled {len(batch)} events: {str(e)}")
+                return len(batch)
+            logger.error(f"Tracking event flush failed ({len(batch)} events), will retry: {str(e)}")
+            self._retry = batch
+            return 0
+        self.stats["written"] += len(batch)
+        return len(batch)
+
+    async def replay_spool(self) -> int:
+        """Write the oldest spooled segment to the database; returns events replayed."""
+        path = await asyncio.to_thread(self.spool.oldest_segment)
+        if path is None:
+            return 0
+        events = await asyncio.to_thread(self.spool.read_segment, path)
+        for start in range(0, len(events), self.batch_size):
+            await self.write(events[start:start + self.batch_size], idempotent=True)
+        await asyncio.to_thread(self.spool.remove_segment, path, len(events))
+        self.stats["written"] += len(events)
+        logger.info(f"Replayed {len(events)} spooled tracking events from {path.name}")
+        return len(events)
+
+    async def run_replayer(self, interval_seconds: Optional[float] = None) -> None:
+        """Background task: fsync overflow appends and replay the spool until cancelled."""
+        interval = interval_seconds or settings.TRACKING_SPOOL_REPLAY_INTERVAL
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.spool.sync)
+                while self.spool.pending():
+                    await self.replay_spool()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Database still degraded: try again next interval
+                logger.warning(
+                    f"Tracking spool replay failed ({self.spool.segments()} segments waiting): {str(e)}"
+                )
+
+    async def run(self) -> None:
+        """Background task: flush batches until cancelled."""
+        while True:
+            written = await self.flush_once()
+            if not written and self._retry:
+                # Back off after a failed write instead of hammering the database
+                await asyncio.sleep(self.flush_interval)
+
+    async def drain(self) -> None:
+        """Write (or spool) everything still queued (shutdown); gives up after a failed write."""
+        try:
+            while self.pending():
+                if not await self.flush_once() and self._retry:
+                    logger.error(f"Dropping {self.pending()} tracking events that could not be written")
+                    return
+        finally:
+            if self.spool is not None:
+                # Whatever is spooled is replayed on the next start
+                await asyncio.to_thread(self.spool.close)
+
+
+event_ingestion = EventIngestionQueue()
@@ -0,0 +1,341 @@
+"""
+Hourly rollups of impressions and clicks, and the report counts read from them.
+
+event_hourly_rollups holds counts per (hour, campaign, creative). The periodic
+aggregator (run_rollup_loop) adds every impression/click row inserted since
+the rollup watermark, in created_at order, and then advances the watermark. It
+keys on created_at, not the event timestamp, so late events (spool replays,
+old client timestamps) are still counted exactly once. The same step folds
+new impressions into the daily reach sketches (app.services.reach_sketch). Rows are only rolled up
+ROLLUP_SETTLE_SECONDS after insert so in-flight transactions are not skipped.
+
+event_counts() and event_timeseries() answer a date range from the rollups for
+whole hours, plus raw rows for the partial hours at either edge and for rows
+newer than the watermark. Without a watermark (rollups never run) they count
+raw rows only.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+from uuid import UUID
+
+from sqlalchemy import and_, func, or_, select, true
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.click import Click
+from app.models.event_rollup import EventHourlyRollup, RollupWatermark
+from app.models.impression import Impression
+from app.services.reach_sketch import update_reach_sketches
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_NAME = "hourly_events"
+HOUR = timedelta(hours=1)
+
+CountKey = tuple[UUID, UUID]  # (campaign_id, ad_creative_id)
+
+
+@dataclass
+class EventCounts:
+    impressions: int = 0
+    clicks: int = 0
+
+    @property
+    def click_through_rate(self) -> float:
+        """CTR in percent."""
+        return (self.clicks / self.impressions * 100) if self.impressions > 0 else 0.0
+
+    def add(self, other: "EventCounts") -> "EventCounts":
+        self.impressions += other.impressions
+        self.clicks += other.clicks
+        return self
+
+
+def total_counts(counts: Dict[CountKey, EventCounts]) -> EventCounts:
+    total = EventCounts()
+    for value in counts.values():
+        total.add(value)
+    return total
+
+
+def hour_floor(value: datetime) -> datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def hour_ceil(value: datetime) -> datetime:
+    floor = hour_floor(value)
+    return floor if floor == value else floor + HOUR
+
+
+def get_watermark(db: Session, name: str = ROLLUP_NAME) -> Optional[datetime]:
+    return db.execute(
+        select(RollupWatermark.watermark).where(RollupWatermark.name == name)
+    ).scalar()
+
+
+def lock_watermark(db: Session, name: str = ROLLUP_NAME) -> RollupWatermark:
+    """Watermark row, locked so concurrent workers advance it one at a time."""
+    mark = (
+        db.query(RollupWatermark)
+        .filter(RollupWatermark.name == name)
+        .with_for_update()
+        .first()
+    )
+    if mark is None:
+        mark = RollupWatermark(name=name, watermark=None)
+        db.add(mark)
+        db.flush()
+    return mark
+
+
+def rollup_statement(model, column: str, created_from: Optional[datetime], created_to: datetime):
+    """INSERT ... SELECT of per-hour counts of model rows created in the window, added on conflict."""
+    hour = func.date_trunc("hour", model.timestamp)
+    counts = select(
+        hour.label("hour"),
+        model.campaign_id,
+        model.ad_creative_id,
+        func.count().label(column),
+    ).where(model.created_at < created_to)
+    if created_from is not None:
+        counts = counts.where(model.created_at >= created_from)
+    counts = counts.group_by(hour, model.campaign_id, model.ad_creative_id)
+
+    stmt = pg_insert(EventHourlyRollup).from_select(
+        ["hour", "campaign_id", "ad_creative_id", column], counts
+    )
+    return stmt.on_conflict_do_update(
+        index_elements=["hour", "campaign_id", "ad_creative_id"],
+        set_={column: getattr(EventHourlyRollup, column) + getattr(stmt.excluded, column)},
+    )
+
+
+def _first_created_at(db: Session) -> Optional[datetime]:
+    firsts = [
+        db.execute(select(func.min(model.created_at))).scalar()
+        for model in (Impression, Click)
+    ]
+    firsts = [first for first in firsts if first is not None]
+    return min(firsts) if firsts else None
+
+
+def roll_up_events(
+    db: Session,
+    until: Optional[datetime] = None,
+    step: timedelta = timedelta(days=1),
+) -> int:
+    """
+    Add rows created since the watermark (up to until) to the rollups, one
+    transaction per step of created_at. Returns the number of steps run.
+    """
+    if until is None:
+        until = datetime.utcnow() - timedelta(seconds=settings.ROLLUP_SETTLE_SECONDS)
+    steps = 0
+    while True:
+        mark = lock_watermark(db)
+        created_from = mark.watermark
+        start = created_from or _first_created_at(db)
+        if start is None or start >= until:
+            if start is None:
+                # No events at all yet: everything before until is counted
+                mark.watermark = until
+                mark.updated_at = datetime.utcnow()
+            db.commit()
+            return steps
+        created_to = min(start + step, until)
+        db.execute(rollup_statement(Impression, "impressions", created_from, created_to))
+        db.execute(rollup_statement(Click, "clicks", created_from, created_to))
+        update_reach_sketches(db, created_from, created_to)
+        mark.watermark = created_to
+        mark.updated_at = datetime.utcnow()
+        db.commit()
+        steps += 1
+
+
+def _raw_condition(
+    model,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    full_start: Optional[datetime],
+    full_end: Optional[datetime],
+    watermark: Optional[datetime],
+):
+    """Raw rows not covered by the rollups: edge partial hours and rows newer than the watermark."""
+    in_range = []
+    if start is not None:
+        in_range.append(model.timestamp >= start)
+    if end is not None:
+        in_range.append(model.timestamp <= end)
+    if watermark is None or (full_start and full_end and full_start >= full_end):
+        return and_(true(), *in_range)
+
+    full = [model.created_at >= watermark]
+    if full_start is not None:
+        full.append(model.timestamp >= full_start)
+    if full_end is not None:
+        full.append(model.timestamp < full_end)
+    edges = []
+    if start is not None:
+        edges.append(and_(model.timestamp >= start, model.timestamp < full_start))
+    if end is not None:
+        edges.append(and_(model.timestamp >= full_end, model.timestamp <= end))
+    return or_(and_(*full), *edges)
+
+
+def _aggregate(
+    db: Session,
+    start: Optional[datetime],
+    end: Optional[datetime],
+    campaign_id: Optional[UUID],
+    creative_id: Optional[UUID],
+    group_keys: Callable[[Any, Any], tuple],
+) -> Dict[tuple, EventCounts]:
+    """
+    Impressions and clicks with timestamp in [start, end], grouped by
+    group_keys(model, time_column). Three grouped queries (rollups, raw
+    impressions, raw clicks), whatever the history size.
+    """
+    watermark = get_watermark(db)
+    full_start = hour_ceil(start) if start is not None else None
+    full_end = hour_floor(end) if end is not None else None
+    counts: Dict[tuple, EventCounts] = defaultdict(EventCounts)
+
+    def _grouped(columns, model, time_column, *aggregates):
+        keys = group_keys(model, time_column)
+        query = select(*keys, *aggregates).where(*columns)
+        if campaign_id is not None:
+            query = query.where(model.campaign_id == campaign_id)
+        if creative_id is not None:
+            query = query.where(model.ad_creative_id == creative_id)
+        return query.group_by(*keys), len(keys)
+
+    if watermark is not None and not (full_start and full_end and full_start >= full_end):
+        window = []
+        if full_start is not None:
+            window.append(EventHourlyRollup.hour >= full_start)
+        if full_end is not None:
+            window.append(EventHourlyRollup.hour < full_end)
+        rollups, width = _grouped(
+            window,
+            EventHourlyRollup,
+            EventHourlyRollup.hour,
+            func.sum(EventHourlyRollup.impressions),
+            func.sum(EventHourlyRollup.clicks),
+        )
+        for row in db.execute(rollups):
+            impressions, clicks = row[width:]
+            counts[tuple(row[:width])].add(EventCounts(int(impressions or 0), int(clicks or 0)))
+
+    for model, field in ((Impression, "impressions"), (Click, "clicks")):
+        raw, width = _grouped(
+            [_raw_condition(model, start, end, full_start, full_end, watermark)],
+            model,
+            model.timestamp,
+            func.count(),
+        )
+        for row in db.execute(raw):
+            entry = counts[tuple(row[:width])]
+            setattr(entry, field, getattr(entry, field) + row[width])
+
+    return dict(counts)
+
+
+def event_counts(
+    db: Session,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    campaign_id: Optional[UUID] = None,
+    creative_id: Optional[UUID] = None,
+) -> Dict[CountKey, EventCounts]:
+    """
+    Impressions and clicks per (campaign, creative) with timestamp in
+    [start, end], optionally for one campaign or creative.
+    """
+    return _aggregate(
+        db, start, end, campaign_id, creative_id,
+        lambda model, _: (model.campaign_id, model.ad_creative_id),
+    )
+
+
+TIMESERIES_BUCKETS = ("hour", "day", "week")
+BUCKET_STEPS = {"hour": HOUR, "day": timedelta(days=1), "week": timedelta(weeks=1)}
+
+
+def bucket_floor(value: datetime, bucket: str) -> datetime:
+    """Start of the bucket holding value, as Postgres date_trunc computes it."""
+    value = hour_floor(value)
+    if bucket == "hour":
+        return value
+    value = value.replace(hour=0)
+    if bucket == "week":
+        value -= timedelta(days=value.weekday())
+    return value
+
+
+def bucket_count(start: datetime, end: datetime, bucket: str) -> int:
+    """Number of buckets overlapping [start, end], without listing them."""
+    if end < start:
+        return 0
+    return (end - bucket_floor(start, bucket)) // BUCKET_STEPS[bucket] + 1
+
+
+def bucket_starts(start: datetime, end: datetime, bucket: str) -> List[datetime]:
+    """Start of every bucket overlapping [start, end]."""
+    step = BUCKET_STEPS[bucket]
+    current = bucket_floor(start, bucket)
+    starts = []
+    while current <= end:
+        starts.append(current)
+        current += step
+    return starts
+
+
+def event_timeseries(
+    db: Session,
+    start: datetime,
+    end: datetime,
+    bucket: str,
+    campaign_id: Optional[UUID] = None,
+    creative_id: Optional[UUID] = None,
+) -> Dict[datetime, EventCounts]:
+    """
+    Impressions and clicks per date_trunc(bucket) of the event timestamp, for
+    timestamps in [start, end]. Whole hours come from the rollups (re-bucketed
+    by their hour), so the raw tables are only range-scanned at the edges.
+    """
+    if bucket not in TIMESERIES_BUCKETS:
+        raise ValueError(f"Unknown bucket {bucket!r}")
+    counts = _aggregate(
+        db, start, end, campaign_id, creative_id,
+        lambda _, time_column: (func.date_trunc(bucket, time_column),),
+    )
+    return {key[0]: value for key, value in counts.items()}
+
+
+def roll_up_with_new_session() -> int:
+    db = SessionLocal()
+    try:
+        return roll_up_events(db)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+async def run_rollup_loop(interval_seconds: float) -> None:
+    """Background task: roll up new events every interval until cancelled."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await asyncio.to_thread(roll_up_with_new_session)
+        except Exception as e:
+            logger.warning(f"Event rollup failed: {str(e)}")
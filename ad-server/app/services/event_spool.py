@@ -0,0 +1,228 @@
+"""
+Durable local spool for tracking events.
+
+When Postgres is slow, failing over or down, the ingestion queue appends the
+batches it cannot write to segment files under TRACKING_SPOOL_DIR instead of
+holding them in memory (and eventually answering 503). A background replayer
+writes spooled segments back in order once the database recovers.
+
+Each segment is an append-only sequence of records:
+    payload length (4 bytes) | CRC32 of payload (4 bytes) | payload (JSON)
+Appends are fsync'd once per batch (or by the periodic sync() for single
+events), segments roll over at TRACKING_SPOOL_SEGMENT_BYTES, and reading stops
+at the first truncated or corrupt record of a segment.
+
+A spool directory belongs to one process, enforced with a lock on its .lock
+file (flock, or msvcrt.locking on Windows). Workers sharing TRACKING_SPOOL_DIR
+each claim a free worker-N subdirectory, so after a restart every slot (and
+its leftover segments) is picked up again by some worker.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import os
+import struct
+import threading
+import uuid
+import zlib
+from datetime import datetime
+from pathlib import Path
+from typing import BinaryIO, Iterable, List, Optional
+
+from app.core.config import settings
+from app.services.event_ingestion import TrackingEvent
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+logger = logging.getLogger(__name__)
+
+RECORD_HEADER = struct.Struct(">II")  # payload length, CRC32 of payload
+SEGMENT_SUFFIX = ".seg"
+LOCK_FILE = ".lock"
+MAX_WORKER_SLOTS = 64
+
+
+class SpoolLockedError(RuntimeError):
+    """The spool directory is already owned by another process."""
+
+
+def _lock_exclusive(lock_file: BinaryIO) -> None:
+    """Take a non-blocking exclusive lock on lock_file; OSError when another process holds it."""
+    if fcntl is not None:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        lock_file.seek(0)
+        msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+
+
+def encode_event(event: TrackingEvent) -> bytes:
+    return json.dumps({
+        "kind": event.kind,
+        "id": str(event.id),
+        "ad_creative_id": str(event.ad_creative_id),
+        "campaign_id": str(event.campaign_id),
+        "user_id": event.user_id,
+        "timestamp": event.timestamp.isoformat(),
+        "city": event.city,
+        "state": event.state,
+    }, separators=(",", ":")).encode()
+
+
+def decode_event(payload: bytes) -> TrackingEvent:
+    data = json.loads(payload)
+    return TrackingEvent(
+        kind=data["kind"],
+        id=uuid.UUID(data["id"]),
+        ad_creative_id=uuid.UUID(data["ad_creative_id"]),
+        campaign_id=uuid.UUID(data["campaign_id"]),
+        user_id=data["user_id"],
+        timestamp=datetime.fromisoformat(data["timestamp"]),
+        city=data["city"],
+        state=data["state"],
+    )
+
+
+def encode_record(event: TrackingEvent) -> bytes:
+    payload = encode_event(event)
+    return RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+class EventSpool:
+    """Append-only, CRC-checked segment files of tracking events (thread-safe)."""
+
+    def __init__(self, directory: str, segment_bytes: Optional[int] = None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock_file: Optional[BinaryIO] = open(self.directory / LOCK_FILE, "a+b")
+        try:
+            _lock_exclusive(self._lock_file)
+        except OSError:
+            self._lock_file.close()
+            raise SpoolLockedError(f"Spool directory {self.directory} is in use")
+        self.segment_bytes = segment_bytes or settings.TRACKING_SPOOL_SEGMENT_BYTES
+        self._lock = threading.Lock()
+        # Segments left by a previous run are replayed first; never appended to
+        self._sealed: List[Path] = sorted(self.directory.glob(f"*{SEGMENT_SUFFIX}"))
+        self._next_seq = int(self._sealed[-1].stem) + 1 if self._sealed else 1
+        self._file: Optional[BinaryIO] = None
+        self._path: Optional[Path] = None
+        self._size = 0
+        self._dirty = False
+        self.stats = {"spooled": 0, "replayed": 0, "corrupt_records": 0}
+
+    def pending(self) -> bool:
+        """True while spooled events are waiting to be replayed."""
+        return bool(self._sealed) or self._size > 0
+
+    def segments(self) -> int:
+        return len(self._sealed) + (1 if self._size else 0)
+
+    def append(self, events: Iterable[TrackingEvent], sync: bool = True) -> int:
+        """Append events; fsync before returning unless sync=False (see sync())."""
+        records = [encode_record(event) for event in events]
+        with self._lock:
+            if self._file is None:
+                self._path = self.directory / f"{self._next_seq:012d}{SEGMENT_SUFFIX}"
+                self._next_seq += 1
+                self._file = open(self._path, "ab")
+            for record in records:
+                self._file.write(record)
+                self._size += len(record)
+            self._dirty = True
+            if sync:
+                self._sync_locked()
+            if self._size >= self.segment_bytes:
+                self._seal_locked()
+        self.stats["spooled"] += len(records)
+        return len(records)
+
+    def sync(self) -> None:
+        """fsync appends made with sync=False."""
+        with self._lock:
+            self._sync_locked()
+
+    def _sync_locked(self) -> None:
+        if self._file is not None and self._dirty:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._dirty = False
+
+    def _seal_locked(self) -> None:
+        if self._file is None:
+            return
+        self._sync_locked()
+        self._file.close()
+        self._sealed.append(self._path)
+        self._file, self._path, self._size = None, None, 0
+
+    def oldest_segment(self) -> Optional[Path]:
+        """Oldest segment to replay; seals the open segment when it is the only one left."""
+        with self._lock:
+            if not self._sealed and self._size:
+                self._seal_locked()
+            return self._sealed[0] if self._sealed else None
+
+    def read_segment(self, path: Path) -> List[TrackingEvent]:
+        """Events of a sealed segment, up to the first truncated or corrupt record."""
+        try:
+            data = path.read_bytes()
+        except FileNotFoundError:
+            # Nothing left to replay; remove_segment() drops it from the queue
+            logger.error(f"Spool segment {path.name} is missing, skipping it")
+            return []
+        events: List[TrackingEvent] = []
+        offset = 0
+        while offset < len(data):
+            if offset + RECORD_HEADER.size > len(data):
+                break
+            length, crc = RECORD_HEADER.unpack_from(data, offset)
+            payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            events.append(decode_event(payload))
+            offset += RECORD_HEADER.size + length
+        if offset < len(data):
+            self.stats["corrupt_records"] += 1
+            logger.error(
+                f"Spool segment {path.name}: corrupt or truncated record at byte {offset}, "
+                f"skipping the rest ({len(data) - offset} bytes)"
+            )
+        return events
+
+    def remove_segment(self, path: Path, replayed: int = 0) -> None:
+        """Delete a segment whose events are in the database."""
+        with self._lock:
+            if path in self._sealed:
+                self._sealed.remove(path)
+            path.unlink(missing_ok=True)
+        self.stats["replayed"] += replayed
+
+    def close(self) -> None:
+        """fsync and close the open segment (it is replayed on the next start) and release the directory."""
+        with self._lock:
+            self._seal_locked()
+            if self._lock_file is not None:
+                self._lock_file.close()  # releases the flock
+                self._lock_file = None
+
+
+def claim_spool(root: str) -> EventSpool:
+    """Spool in the first worker-N subdirectory of root no other process holds."""
+    for slot in range(MAX_WORKER_SLOTS):
+        try:
+            return EventSpool(str(Path(root) / f"worker-{slot}"))
+        except SpoolLockedError:
+            continue
+    raise SpoolLockedError(f"All {MAX_WORKER_SLOTS} spool slots under {root} are in use")
+
+
+def default_spool() -> Optional[EventSpool]:
+    """This process's spool under TRACKING_SPOOL_DIR, or None when spooling is disabled."""
+    if not settings.TRACKING_SPOOL_DIR:
+        return None
+    return claim_spool(settings.TRACKING_SPOOL_DIR)
@@ -1,14 +1,19 @@
 """Resolve listener country (and optional city/region) from request IP."""
 from __future__ import annotations
 
+import asyncio
 import logging
 import re
+import time
+from collections import OrderedDict
 from dataclasses import dataclass
 from typing import Optional
 
 import httpx
 from fastapi import Request
 
+from app.core.config import settings
+
 logger = logging.getLogger(__name__)
 
 # ISO 3166-1 alpha-2
@@ -123,6 +128,77 @@ async def lookup_geo_from_ip(ip: str) -> GeoLocation:
     )
 
 
+class GeoCache:
+    """
+    Per-IP lookup results (TTL + LRU) and the lookups in flight.
+
+    A lookup runs as its own task and is shielded from the caller, so a
+    request that gives up on geo (ad deadline) still leaves the result here
+    for the listener's next request. Concurrent requests from one IP share a
+    single lookup.
+    """
+
+    def __init__(
+        self,
+        ttl_seconds: Optional[float] = None,
+        miss_ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+    ):
+        self.ttl = settings.GEOIP_CACHE_TTL if ttl_seconds is None else ttl_seconds
+        self.miss_ttl = settings.GEOIP_MISS_TTL if miss_ttl_seconds is None else miss_ttl_seconds
+        self.max_entries = settings.GEOIP_CACHE_SIZE if max_entries is None else max_entries
+        # ip -> (expires_at, geo)
+        self._entries: OrderedDict[str, tuple[float, GeoLocation]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Task] = {}
+
+    def get(self, ip: str) -> Optional[GeoLocation]:
+        entry = self._entries.get(ip)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[ip]
+            return None
+        self._entries.move_to_end(ip)
+        return entry[1]
+
+    def put(self, ip: str, geo: GeoLocation) -> None:
+        # Failed or empty lookups are retried sooner
+        ttl = self.ttl if geo.country else self.miss_ttl
+        if ttl <= 0 or self.max_entries <= 0:
+            return
+        self._entries.pop(ip, None)
+        self._entries[ip] = (time.monotonic() + ttl, geo)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def lookup(self, ip: str) -> GeoLocation:
+        geo = self.get(ip)
+        if geo is not None:
+            return geo
+        task = self._inflight.get(ip)
+        if task is None:
+            task = asyncio.create_task(self._lookup_and_store(ip))
+            self._inflight[ip] = task
+        return await asyncio.shield(task)
+
+    async def _lookup_and_store(self, ip: str) -> GeoLocation:
+        try:
+            geo = await lookup_geo_from_ip(ip)
+            self.put(ip, geo)
+            return geo
+        finally:
+            self._inflight.pop(ip, None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+geo_cache = GeoCache()
+
+
 async def resolve_request_geo(request: Request) -> GeoLocation:
     """Country/city/state for ad targeting from edge headers or IP lookup."""
     header_country = _country_from_headers(request)
@@ -131,7 +207,7 @@ async def resolve_request_geo(request: Request) -> GeoLocation:
 
     ip = get_client_ip(request)
     if ip:
-        geo = await lookup_geo_from_ip(ip)
+        geo = await geo_cache.lookup(ip)
         if geo.country:
             return geo
 
@@ -0,0 +1,289 @@
+"""
+Lease-based impression budget counters.
+
+Instead of an UPDATE + commit per served ad, each worker reserves impression
+quota from a campaign's budget in chunks (IMPRESSION_LEASE_SIZE) and spends it
+locally. The reservation is a single conditional UPDATE, so the sum of all
+leases can never exceed the budget: over-delivery is impossible and unspent
+quota held by a worker is bounded by one lease per campaign.
+
+Served counts are flushed in bulk on a timer and at shutdown: ad_creatives.times_served
+and campaigns.last_served_at are updated, and quota from idle leases is
+returned to the campaign budget.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Callable, Optional
+from uuid import UUID
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal, SessionLocal
+from app.models.ad_creative import AdCreative
+from app.models.campaign import Campaign
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Lease:
+    remaining: int = 0
+    last_used: float = 0.0
+    exhausted_until: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    async_lock: Optional[asyncio.Lock] = None
+
+
+class ImpressionBudgetLedger:
+    """Per-process holder of campaign impression leases and unflushed serve counts."""
+
+    def __init__(
+        self,
+        session_factory: Callable[[], Session] = SessionLocal,
+        lease_size: Optional[int] = None,
+        lease_ttl_seconds: Optional[int] = None,
+        async_session_factory: Callable[[], AsyncSession] = AsyncSessionLocal,
+    ):
+        self._session_factory = session_factory
+        self._async_session_factory = async_session_factory
+        self.lease_size = lease_size or settings.IMPRESSION_LEASE_SIZE
+        self.lease_ttl = (
+            settings.IMPRESSION_LEASE_TTL if lease_ttl_seconds is None else lease_ttl_seconds
+        )
+        self._lock = threading.Lock()
+        self._leases: dict[UUID, _Lease] = {}
+        self._creative_counts: dict[UUID, int] = {}
+        self._last_served: dict[UUID, datetime] = {}
+
+    def _lease(self, campaign_id: UUID) -> _Lease:
+        with self._lock:
+            lease = self._leases.get(campaign_id)
+            if lease is None:
+                lease = self._leases[campaign_id] = _Lease()
+            return lease
+
+    def may_serve(self, campaign) -> bool:
+        """False while this worker knows the campaign's budget is fully reserved."""
+        lease = self._leases.get(campaign.id)
+        if lease is None or lease.remaining > 0:
+            return True
+        return lease.exhausted_until <= time.monotonic()
+
+    def consume(self, campaign_id: UUID, creative_id: UUID) -> bool:
+        """
+        Spend one impression from the campaign's lease, reserving a new chunk when
+        the current one is used up. Returns False when the budget is exhausted.
+        """
+        lease = self._lease(campaign_id)
+        with lease.lock:
+            if lease.remaining == 0:
+                if lease.exhausted_until > time.monotonic():
+                    return False
+                self._apply_grant(lease, self._reserve(campaign_id))
+            if not self._take(lease):
+                return False
+        self._count(campaign_id, creative_id)
+        return True
+
+    async def consume_async(self, campaign_id: UUID, creative_id: UUID) -> bool:
+        """consume() for the async serving path; lease renewal goes through asyncpg."""
+        lease = self._lease(campaign_id)
+        with lease.lock:
+            taken = self._take(lease)
+        if not taken:
+            if lease.async_lock is None:
+                lease.async_lock = asyncio.Lock()
+            async with lease.async_lock:
+                with lease.lock:
+                    taken = self._take(lease)
+                    needs_lease = not taken and lease.exhausted_until <= time.monotonic()
+                if needs_lease:
+                    # Shielded: if the caller is cancelled (ad deadline), the reserved
+                    # quota still lands in the lease instead of being stranded.
+                    await asyncio.shield(self._renew_async(campaign_id, lease))
+                    with lease.lock:
+                        taken = self._take(lease)
+        if not taken:
+            return False
+        self._count(campaign_id, creative_id)
+        return True
+
+    async def _renew_async(self, campaign_id: UUID, lease: _Lease) -> None:
+        granted = await self._reserve_async(campaign_id)
+        with lease.lock:
+            self._apply_grant(lease, granted)
+
+    def refund(self, campaign_id: UUID, creative_id: UUID) -> None:
+        """Give back an impression that was consumed but not served."""
+        lease = self._lease(campaign_id)
+        with lease.lock:
+            lease.remaining += 1
+        with self._lock:
+            served = self._creative_counts.get(creative_id, 0)
+            if served > 1:
+                self._creative_counts[creative_id] = served - 1
+            else:
+                self._creative_counts.pop(creative_id, None)
+
+    def _take(self, lease: _Lease) -> bool:
+        """Spend one impression from the lease (caller holds lease.lock)."""
+        if lease.remaining == 0:
+            return False
+        lease.remaining -= 1
+        lease.last_used = time.monotonic()
+        return True
+
+    def _apply_grant(self, lease: _Lease, granted: int) -> None:
+        if granted == 0:
+            lease.exhausted_until = time.monotonic() + self.lease_ttl
+        lease.remaining += granted
+
+    def _count(self, campaign_id: UUID, creative_id: UUID) -> None:
+        with self._lock:
+            self._creative_counts[creative_id] = self._creative_counts.get(creative_id, 0) + 1
+            self._last_served[campaign_id] = datetime.utcnow()
+
+    def _grant_for(self, row) -> int:
+        if row is None:
+            return 0
+        return max(0, min(self.lease_size, row.impression_budget - row.impressions_served))
+
+    @staticmethod
+    def _budget_stmt(campaign_id: UUID):
+        return select(Campaign.impression_budget, Campaign.impressions_served).where(
+            Campaign.id == campaign_id
+        )
+
+    @staticmethod
+    def _reserve_stmt(campaign_id: UUID, granted: int):
+        return (
+            update(Campaign)
+            .where(
+                Campaign.id == campaign_id,
+                Campaign.impressions_served + granted <= Campaign.impression_budget,
+            )
+            .values(impressions_served=Campaign.impressions_served + granted)
+            .execution_options(synchronize_session=False)
+        )
+
+    def _reserve(self, campaign_id: UUID) -> int:
+        """Atomically move up to one lease of quota into impressions_served."""
+        db = self._session_factory()
+        try:
+            for _ in range(3):
+                granted = self._grant_for(db.execute(self._budget_stmt(campaign_id)).first())
+                if granted == 0:
+                    return 0
+                updated = db.execute(self._reserve_stmt(campaign_id, granted)).rowcount
+                db.commit()
+                if updated:
+                    return granted
+                # Another worker reserved in between; re-read the remaining budget.
+            return 0
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    async def _reserve_async(self, campaign_id: UUID) -> int:
+        async with self._async_session_factory() as db:
+            try:
+                for _ in range(3):
+                    row = (await db.execute(self._budget_stmt(campaign_id))).first()
+                    granted = self._grant_for(row)
+                    if granted == 0:
+                        return 0
+                    updated = (await db.execute(self._reserve_stmt(campaign_id, granted))).rowcount
+                    await db.commit()
+                    if updated:
+                        return granted
+                return 0
+            except Exception:
+                await db.rollback()
+                raise
+
+    def flush(self, release_all: bool = False) -> None:
+        """
+        Write buffered serve counts and return quota from idle leases
+        (or from every lease when release_all is set, e.g. at shutdown).
+        """
+        now = time.monotonic()
+        released: dict[UUID, int] = {}
+        with self._lock:
+            counts, self._creative_counts = self._creative_counts, {}
+            last_served, self._last_served = self._last_served, {}
+            leases = list(self._leases.items())
+
+        for campaign_id, lease in leases:
+            with lease.lock:
+                idle = now - lease.last_used >= self.lease_ttl
+                if lease.remaining and (release_all or idle):
+                    released[campaign_id] = lease.remaining
+                    lease.remaining = 0
+
+        if not (counts or last_served or released):
+            return
+
+        db = self._session_factory()
+        try:
+            for creative_id, served in counts.items():
+                db.query(AdCreative).filter(AdCreative.id == creative_id).update(
+                    {"times_served": AdCreative.times_served + served},
+                    synchronize_session=False,
+                )
+            for campaign_id, served_at in last_served.items():
+                db.query(Campaign).filter(Campaign.id == campaign_id).update(
+                    {"last_served_at": served_at},
+                    synchronize_session=False,
+                )
+            for campaign_id, unused in released.items():
+                db.query(Campaign).filter(Campaign.id == campaign_id).update(
+                    {"impressions_served": Campaign.impressions_served - unused},
+                    synchronize_session=False,
+                )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Impression budget flush failed, will retry: {str(e)}")
+            self._requeue(counts, last_served, released)
+        finally:
+            db.close()
+
+    def _requeue(
+        self,
+        counts: dict[UUID, int],
+        last_served: dict[UUID, datetime],
+        released: dict[UUID, int],
+    ) -> None:
+        with self._lock:
+            for creative_id, served in counts.items():
+                self._creative_counts[creative_id] = self._creative_counts.get(creative_id, 0) + served
+            for campaign_id, served_at in last_served.items():
+                self._last_served.setdefault(campaign_id, served_at)
+        # Unreleased quota goes back into the lease so it is still spent or returned later.
+        for campaign_id, unused in released.items():
+            lease = self._lease(campaign_id)
+            with lease.lock:
+                lease.remaining += unused
+
+    def release_all(self) -> None:
+        self.flush(release_all=True)
+
+    async def run_flush_loop(self, interval_seconds: float) -> None:
+        """Background task: flush counters every interval until cancelled."""
+        while True:
+            await asyncio.sleep(interval_seconds)
+            await asyncio.to_thread(self.flush)
+
+
+impression_budget = ImpressionBudgetLedger()
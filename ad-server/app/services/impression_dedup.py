@@ -0,0 +1,95 @@
+"""
+Time-windowed de-duplication of impressions per listener and creative.
+
+Clients on flaky networks retry beacons, and some re-render a banner and fire
+its impression again with a fresh token. The replay store cannot catch the
+latter, so tracking also drops an impression when the same (user_id,
+creative) pair already had one within IMPRESSION_DEDUP_WINDOW seconds, before
+anything is queued for the database.
+
+Pairs are kept as 64-bit digests in insertion (= time) order, bounded to
+IMPRESSION_DEDUP_MAX_ENTRIES. The window is per process.
+"""
+from __future__ import annotations
+
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from app.core.config import settings
+
+
+def dedup_digest(user_id: str, creative_id: uuid.UUID) -> int:
+    digest = hashlib.blake2b(f"{user_id}:{creative_id}".encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big")
+
+
+class ImpressionDeduper:
+    """Recent (user_id, creative) impressions; counts the ones it suppresses."""
+
+    def __init__(
+        self,
+        window_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.window = settings.IMPRESSION_DEDUP_WINDOW if window_seconds is None else window_seconds
+        self.max_entries = (
+            settings.IMPRESSION_DEDUP_MAX_ENTRIES if max_entries is None else max_entries
+        )
+        self._clock = clock
+        self._lock = threading.Lock()
+        # digest -> time of the impression that opened the window
+        self._entries: OrderedDict[int, float] = OrderedDict()
+        self.suppressed = 0
+
+    def _prune(self, now: float) -> None:
+        while self._entries:
+            digest, recorded_at = next(iter(self._entries.items()))
+            if recorded_at > now - self.window and len(self._entries) <= self.max_entries:
+                return
+            del self._entries[digest]
+
+    def is_duplicate(self, user_id: str, creative_id: uuid.UUID) -> bool:
+        """True (and counted as suppressed) if the pair had an impression within the window."""
+        if self.window <= 0:
+            return False
+        now = self._clock()
+        digest = dedup_digest(user_id, creative_id)
+        with self._lock:
+            recorded_at = self._entries.get(digest)
+            if recorded_at is None or recorded_at <= now - self.window:
+                return False
+            self.suppressed += 1
+            return True
+
+    def record(self, user_id: str, creative_id: uuid.UUID) -> None:
+        """Open the window for a tracked impression."""
+        if self.window <= 0:
+            return
+        now = self._clock()
+        digest = dedup_digest(user_id, creative_id)
+        with self._lock:
+            self._entries.pop(digest, None)
+            self._entries[digest] = now
+            self._prune(now)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {
+            "window_seconds": self.window,
+            "size": len(self._entries),
+            "suppressed": self.suppressed,
+        }
+
+
+impression_deduper = ImpressionDeduper()
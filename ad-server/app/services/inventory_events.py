@@ -0,0 +1,60 @@
+"""
+Process-local change version for campaigns and creatives.
+
+Admin endpoints, seeds and maintenance jobs all write through SQLAlchemy
+sessions. Any committed flush that touches a Campaign or AdCreative bumps a
+version counter, so in-memory ad-serving caches can compare versions instead
+of re-reading the database on every request.
+"""
+from __future__ import annotations
+
+import itertools
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from app.models.ad_creative import AdCreative
+from app.models.campaign import Campaign
+
+_INFO_KEY = "inventory_changed"
+
+_lock = threading.Lock()
+_version = 0
+
+
+def inventory_version() -> int:
+    """Current inventory version (monotonic within this process)."""
+    return _version
+
+
+def bump_inventory_version() -> int:
+    """Mark campaigns/creatives as changed; returns the new version."""
+    global _version
+    with _lock:
+        _version += 1
+        return _version
+
+
+def _touches_inventory(session: Session) -> bool:
+    return any(
+        isinstance(obj, (Campaign, AdCreative))
+        for obj in itertools.chain(session.new, session.dirty, session.deleted)
+    )
+
+
+@event.listens_for(Session, "before_flush")
+def _remember_inventory_writes(session, flush_context, instances) -> None:
+    if _touches_inventory(session):
+        session.info[_INFO_KEY] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_inventory_writes(session) -> None:
+    if session.info.pop(_INFO_KEY, False):
+        bump_inventory_version()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_inventory_writes(session) -> None:
+    session.info.pop(_INFO_KEY, None)
@@ -0,0 +1,133 @@
+"""
+Negative cache for placements with no paid inventory.
+
+In regions without paid campaigns most ad requests end in the house promo.
+Once a (placement, country) pair comes up empty it is remembered for
+AD_NO_FILL_TTL seconds (never past the snapshot's next campaign start/end), so
+repeat requests skip selection entirely. Entries are dropped when campaigns or
+creatives change.
+
+No-fill counts per pair are kept for the periodic diagnostic log
+(run_no_fill_report) instead of logging on every request.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.core.database import SessionLocal
+from app.models.campaign import Campaign, CampaignStatus
+from app.services.eligibility_snapshot import placement_key
+from app.services.inventory_events import inventory_version
+
+logger = logging.getLogger(__name__)
+
+NoFillKey = tuple[str, str]  # (placement, country or "")
+
+
+def no_fill_key(placement: str, country: Optional[str]) -> NoFillKey:
+    return (placement_key(placement), (country or "").upper())
+
+
+class NoFillCache:
+    """Remembers (placement, country) pairs that recently had nothing to serve."""
+
+    def __init__(self, ttl_seconds: Optional[float] = None):
+        self.ttl = settings.AD_NO_FILL_TTL if ttl_seconds is None else ttl_seconds
+        self._lock = threading.Lock()
+        # key -> (expires_at, inventory version)
+        self._entries: dict[NoFillKey, tuple[float, int]] = {}
+        self._counts: dict[NoFillKey, int] = {}
+
+    def is_empty(self, placement: str, country: Optional[str]) -> bool:
+        """True while the pair is known to have no eligible campaign (counts as a no-fill)."""
+        key = no_fill_key(placement, country)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            expires_at, version = entry
+            if expires_at <= time.monotonic() or version != inventory_version():
+                del self._entries[key]
+                return False
+            self._counts[key] = self._counts.get(key, 0) + 1
+            return True
+
+    def record(
+        self,
+        placement: str,
+        country: Optional[str],
+        valid_until: Optional[datetime] = None,
+        cacheable: bool = True,
+    ) -> None:
+        """
+        Count a no-fill; remember it when cacheable (the answer did not depend on
+        anything finer than placement and country).
+        """
+        key = no_fill_key(placement, country)
+        ttl = self.ttl
+        if valid_until is not None:
+            ttl = min(ttl, (valid_until - datetime.utcnow()).total_seconds())
+        with self._lock:
+            self._counts[key] = self._counts.get(key, 0) + 1
+            if cacheable and ttl > 0:
+                self._entries[key] = (time.monotonic() + ttl, inventory_version())
+
+    def take_counts(self) -> dict[NoFillKey, int]:
+        """No-fill counts since the last call."""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+            return counts
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._counts.clear()
+
+
+no_fill_cache = NoFillCache()
+
+
+def count_active_campaigns(db: Session) -> int:
+    return db.query(Campaign).filter(Campaign.status == CampaignStatus.ACTIVE).count()
+
+
+def log_no_fill_report(
+    cache: NoFillCache = no_fill_cache,
+    session_factory: Callable[[], Session] = SessionLocal,
+) -> None:
+    """Log no-fill counts since the last report with the number of ACTIVE campaigns."""
+    counts = cache.take_counts()
+    if not counts:
+        return
+    db = session_factory()
+    try:
+        active = count_active_campaigns(db)
+    finally:
+        db.close()
+    top = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:10]
+    logger.info(
+        "No-fill requests: %d total, top placement/country: %s. Active campaigns in DB: %d. "
+        "Check admin: campaigns must be ACTIVE, within dates, have budget, "
+        "and have active creatives matching placement size.",
+        sum(counts.values()),
+        ", ".join(f"{placement}/{country or '??'}={n}" for (placement, country), n in top),
+        active,
+    )
+
+
+async def run_no_fill_report(interval_seconds: float) -> None:
+    """Background task: log the no-fill report every interval until cancelled."""
+    while True:
+        await asyncio.sleep(interval_seconds)
+        try:
+            await asyncio.to_thread(log_no_fill_report)
+        except Exception as e:
+            logger.warning(f"No-fill report failed: {str(e)}")
@@ -0,0 +1,168 @@
+"""
+Approximate unique reach (distinct listeners) per campaign with HyperLogLog.
+
+COUNT(DISTINCT user_id) over impressions is a full scan of the range. Instead
+the rollup aggregator folds the user_ids of each newly inserted impression
+batch into one HyperLogLog sketch per (campaign, UTC day), stored compressed
+in campaign_reach_sketches. Sketches merge by register-wise max, so reach for
+a date range is a merge of one sketch per day (plus the raw rows newer than
+the rollup watermark), with a standard error of about 1.6% at precision 12.
+
+Reach is computed over whole UTC days overlapping the requested range.
+"""
+from __future__ import annotations
+
+import hashlib
+import math
+import zlib
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, Optional, Sequence
+from uuid import UUID
+
+from sqlalchemy import Date, cast, select, tuple_
+from sqlalchemy.orm import Session
+
+from app.core.config import settings
+from app.models.impression import Impression
+from app.models.reach_sketch import CampaignReachSketch
+
+# Stored sketches depend on it: changing it requires rebuilding the rollups
+HLL_PRECISION = 12
+
+
+def hll_hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HyperLogLog:
+    """HyperLogLog with 2**precision one-byte registers over a 64-bit hash."""
+
+    def __init__(self, precision: int = HLL_PRECISION, registers: Optional[bytearray] = None):
+        self.precision = precision
+        self.size = 1 << precision
+        self.registers = registers if registers is not None else bytearray(self.size)
+
+    def add(self, value: str) -> None:
+        hashed = hll_hash(value)
+        index = hashed >> (64 - self.precision)
+        rest = hashed & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, values: Iterable[str]) -> "HyperLogLog":
+        for value in values:
+            self.add(value)
+        return self
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge sketches of different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def estimate(self) -> int:
+        m = self.size
+        alpha = 0.7213 / (1 + 1.079 / m)
+        raw = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * m and zeros:
+            # Small-range correction (linear counting)
+            return round(m * math.log(m / zeros))
+        return round(raw)
+
+    def to_bytes(self) -> bytes:
+        return zlib.compress(bytes(self.registers))
+
+    @classmethod
+    def from_bytes(cls, data: bytes, precision: int = HLL_PRECISION) -> "HyperLogLog":
+        return cls(precision, bytearray(zlib.decompress(data)))
+
+
+def update_reach_sketches(db: Session, created_from: Optional[datetime], created_to: datetime) -> int:
+    """
+    Fold impressions created in [created_from, created_to) into the daily
+    sketches (the caller commits). Returns the number of sketches touched.
+    """
+    day = cast(Impression.timestamp, Date)
+    rows = select(Impression.campaign_id, day, Impression.user_id).distinct().where(
+        Impression.created_at < created_to
+    )
+    if created_from is not None:
+        rows = rows.where(Impression.created_at >= created_from)
+
+    sketches: Dict[tuple[UUID, date], HyperLogLog] = defaultdict(HyperLogLog)
+    result = db.execute(rows.execution_options(yield_per=settings.REPORT_EXPORT_YIELD_PER))
+    for campaign_id, event_day, user_id in result:
+        sketches[(campaign_id, event_day)].add(user_id)
+    if not sketches:
+        return 0
+    touched = len(sketches)
+
+    stored = (
+        db.query(CampaignReachSketch)
+        .filter(tuple_(CampaignReachSketch.campaign_id, CampaignReachSketch.day).in_(list(sketches)))
+        .with_for_update()
+    )
+    now = datetime.utcnow()
+    for row in stored:
+        merged = HyperLogLog.from_bytes(row.registers).merge(sketches.pop((row.campaign_id, row.day)))
+        row.registers = merged.to_bytes()
+        row.updated_at = now
+    for (campaign_id, event_day), sketch in sketches.items():
+        db.add(
+            CampaignReachSketch(
+                campaign_id=campaign_id,
+                day=event_day,
+                registers=sketch.to_bytes(),
+                updated_at=now,
+            )
+        )
+    db.flush()
+    return touched
+
+
+def unique_reach(
+    db: Session,
+    campaign_ids: Sequence[UUID],
+    start: Optional[datetime],
+    end: Optional[datetime],
+    watermark: Optional[datetime],
+) -> Dict[UUID, int]:
+    """
+    Estimated distinct user_ids per campaign over the UTC days overlapping
+    [start, end]: merged daily sketches plus raw impressions newer than the
+    watermark (all raw impressions in range when rollups never ran).
+    """
+    merged: Dict[UUID, HyperLogLog] = {campaign_id: HyperLogLog() for campaign_id in campaign_ids}
+    if not merged:
+        return {}
+
+    if watermark is not None:
+        sketches = select(CampaignReachSketch.campaign_id, CampaignReachSketch.registers).where(
+            CampaignReachSketch.campaign_id.in_(list(merged))
+        )
+        if start is not None:
+            sketches = sketches.where(CampaignReachSketch.day >= start.date())
+        if end is not None:
+            sketches = sketches.where(CampaignReachSketch.day <= end.date())
+        for campaign_id, registers in db.execute(sketches):
+            merged[campaign_id].merge(HyperLogLog.from_bytes(registers))
+
+    raw = select(Impression.campaign_id, Impression.user_id).distinct().where(
+        Impression.campaign_id.in_(list(merged))
+    )
+    if watermark is not None:
+        raw = raw.where(Impression.created_at >= watermark)
+    # Whole-day bounds on the timestamp itself, so the range scan can use indexes/pruning
+    if start is not None:
+        raw = raw.where(Impression.timestamp >= datetime.combine(start.date(), time.min))
+    if end is not None:
+        raw = raw.where(
+            Impression.timestamp < datetime.combine(end.date() + timedelta(days=1), time.min)
+        )
+    for campaign_id, user_id in db.execute(raw):
+        merged[campaign_id].add(user_id)
+
+    return {campaign_id: sketch.estimate() for campaign_id, sketch in merged.items()}
@@ -0,0 +1,376 @@
+"""
+Replay protection for tracking tokens.
+
+Every impression/click token may be tracked once per event type. Used tokens
+are remembered until the token itself expires (JWT "exp", or issue time plus
+TRACKING_TOKEN_MAX_AGE for compact tokens); after that the token no longer
+verifies, so there is nothing left to protect.
+
+Entries are grouped into time buckets by expiry. Expired buckets are dropped
+whole as time moves on, so memory follows the traffic of the last token
+lifetime instead of growing until a global clear re-opens every replay window
+at once. Keys are stored as 64-bit digests; a digest collision can make a
+fresh token look used, and stats() reports the estimated rate of that.
+
+ReplayStore only sees the current process. With several workers the async
+tracking path claims tokens through a shared backend (TRACKING_REPLAY_BACKEND:
+memory, redis or postgres). ReplayGuard coalesces the claims of concurrent
+requests into one backend call (a Redis pipeline or one INSERT), so the shared
+store costs about one round trip per burst of events, not per event.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Optional, Sequence, Set
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.database import AsyncSessionLocal
+from app.core.security import TRACKING_TOKEN_MAX_AGE
+
+logger = logging.getLogger(__name__)
+
+_DIGEST_SPACE = 2 ** 64
+
+
+def replay_digest(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class ReplayStore:
+    """Bounded, expiry-bucketed set of used token keys."""
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        bucket_seconds: Optional[float] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.max_entries = max_entries or settings.TRACKING_REPLAY_MAX_ENTRIES
+        self.bucket_seconds = bucket_seconds or settings.TRACKING_REPLAY_BUCKET_SECONDS
+        self._clock = clock
+        self._lock = threading.Lock()
+        # digest -> expires_at (epoch seconds), for O(1) lookups
+        self._expiry: Dict[int, float] = {}
+        # bucket index (expires_at // bucket_seconds) -> digests expiring in it
+        self._buckets: Dict[int, Set[int]] = {}
+        self.evicted = 0
+
+    def _bucket(self, expires_at: float) -> int:
+        return int(expires_at // self.bucket_seconds)
+
+    def _drop_bucket(self, index: int) -> int:
+        dropped = 0
+        for digest in self._buckets.pop(index, ()):
+            if self._expiry.pop(digest, None) is not None:
+                dropped += 1
+        return dropped
+
+    def _expire(self, now: float) -> None:
+        current = self._bucket(now)
+        for index in [index for index in self._buckets if index < current]:
+            self._drop_bucket(index)
+
+    def seen(self, key: str) -> bool:
+        """True while key has been added and has not expired yet."""
+        expires_at = self._expiry.get(replay_digest(key))
+        return expires_at is not None and expires_at > self._clock()
+
+    def add(self, key: str, expires_at: Optional[float] = None) -> None:
+        """Remember key until expires_at (default: a full token lifetime from now)."""
+        now = self._clock()
+        if expires_at is None:
+            expires_at = now + TRACKING_TOKEN_MAX_AGE
+        if expires_at <= now:
+            return
+        digest = replay_digest(key)
+        with self._lock:
+            self._expire(now)
+            if digest in self._expiry:
+                return
+            self._expiry[digest] = expires_at
+            self._buckets.setdefault(self._bucket(expires_at), set()).add(digest)
+            if len(self._expiry) > self.max_entries:
+                # Over the bound: forget the tokens closest to expiry first
+                dropped = self._drop_bucket(min(self._buckets))
+                self.evicted += dropped
+                logger.warning(
+                    f"Replay store full ({self.max_entries} tokens), "
+                    f"forgot {dropped} tokens before they expired"
+                )
+
+    def discard(self, key: str) -> None:
+        """Forget key (the event it was claimed for was not tracked)."""
+        digest = replay_digest(key)
+        with self._lock:
+            expires_at = self._expiry.pop(digest, None)
+            if expires_at is None:
+                return
+            # Also leave its bucket, so a re-add with another expiry is not dropped early
+            index = self._bucket(expires_at)
+            bucket = self._buckets.get(index)
+            if bucket is not None:
+                bucket.discard(digest)
+                if not bucket:
+                    del self._buckets[index]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._expiry.clear()
+            self._buckets.clear()
+
+    def __len__(self) -> int:
+        return len(self._expiry)
+
+    def stats(self) -> dict:
+        size = len(self._expiry)
+        return {
+            "size": size,
+            "max_entries": self.max_entries,
+            "buckets": len(self._buckets),
+            "evicted": self.evicted,
+            # Chance that an unseen token collides with a stored digest
+            "false_positive_rate": size / _DIGEST_SPACE,
+        }
+
+
+replay_store = ReplayStore()
+
+ClaimItem = tuple[str, float]  # (key, expires_at epoch seconds)
+
+
+class ReplayBackend(ABC):
+    """Check-and-set of used token keys, one call per batch of keys."""
+
+    name = "base"
+
+    @abstractmethod
+    async def claim_many(self, items: Sequence[ClaimItem]) -> List[bool]:
+        """Mark unique keys used; True where the key was not used yet."""
+
+    @abstractmethod
+    async def release_many(self, keys: Sequence[str]) -> None:
+        """Forget keys whose events were not tracked, so a retry is accepted."""
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryReplayBackend(ReplayBackend):
+    """Per-process backend over ReplayStore (single worker or development)."""
+
+    name = "memory"
+
+    def __init__(self, store: ReplayStore = replay_store):
+        self.store = store
+
+    async def claim_many(self, items: Sequence[ClaimItem]) -> List[bool]:
+        claimed = []
+        for key, expires_at in items:
+            if self.store.seen(key):
+                claimed.append(False)
+            else:
+                self.store.add(key, expires_at)
+                claimed.append(True)
+        return claimed
+
+    async def release_many(self, keys: Sequence[str]) -> None:
+        for key in keys:
+            self.store.discard(key)
+
+
+class RedisReplayBackend(ReplayBackend):
+    """Shared backend: SET key NX EX ttl, pipelined per batch."""
+
+    name = "redis"
+
+    def __init__(self, url: Optional[str] = None, prefix: str = "replay:", client=None):
+        if client is None:
+            url = url or settings.REDIS_URL
+            if not url:
+                raise ValueError("REDIS_URL is required for the redis replay backend")
+            import redis.asyncio as redis
+
+            client = redis.from_url(url)
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{replay_digest(key):016x}"
+
+    async def claim_many(self, items: Sequence[ClaimItem]) -> List[bool]:
+        now = time.time()
+        pipe = self.client.pipeline(transaction=False)
+        for key, expires_at in items:
+            pipe.set(self._key(key), 1, nx=True, ex=max(1, math.ceil(expires_at - now)))
+        return [bool(result) for result in await pipe.execute()]
+
+    async def release_many(self, keys: Sequence[str]) -> None:
+        if keys:
+            await self.client.delete(*(self._key(key) for key in keys))
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+class PostgresReplayBackend(ReplayBackend):
+    """
+    Shared backend: UNLOGGED table tracking_replay_keys (migration 006).
+
+    One INSERT ... ON CONFLICT per batch claims keys that are new or expired;
+    expired rows are purged at most every purge_interval seconds.
+    """
+
+    name = "postgres"
+
+    _claim = text(
+        "INSERT INTO tracking_replay_keys (key, expires_at) "
+        "SELECT * FROM unnest(CAST(:keys AS bigint[]), CAST(:expires AS double precision[])) "
+        "ON CONFLICT (key) DO UPDATE SET expires_at = EXCLUDED.expires_at "
+        "WHERE tracking_replay_keys.expires_at <= EXTRACT(EPOCH FROM now()) "
+        "RETURNING key"
+    )
+    _release = text("DELETE FROM tracking_replay_keys WHERE key = ANY(CAST(:keys AS bigint[]))")
+    _purge = text("DELETE FROM tracking_replay_keys WHERE expires_at <= EXTRACT(EPOCH FROM now())")
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession] = AsyncSessionLocal,
+        purge_interval: float = 60.0,
+    ):
+        self._session_factory = session_factory
+        self.purge_interval = purge_interval
+        self._last_purge = time.monotonic()
+
+    @staticmethod
+    def _key(key: str) -> int:
+        # bigint column: reinterpret the unsigned digest as signed
+        digest = replay_digest(key)
+        return digest - _DIGEST_SPACE if digest >= 2 ** 63 else digest
+
+    async def claim_many(self, items: Sequence[ClaimItem]) -> List[bool]:
+        keys = [self._key(key) for key, _ in items]
+        async with self._session_factory() as db:
+            rows = await db.execute(
+                self._claim, {"keys": keys, "expires": [expires_at for _, expires_at in items]}
+            )
+            claimed = set(rows.scalars())
+            if time.monotonic() - self._last_purge >= self.purge_interval:
+                self._last_purge = time.monotonic()
+                await db.execute(self._purge)
+            await db.commit()
+        return [key in claimed for key in keys]
+
+    async def release_many(self, keys: Sequence[str]) -> None:
+        if not keys:
+            return
+        async with self._session_factory() as db:
+            await db.execute(self._release, {"keys": [self._key(key) for key in keys]})
+            await db.commit()
+
+
+def create_replay_backend(name: Optional[str] = None) -> ReplayBackend:
+    name = (name or settings.TRACKING_REPLAY_BACKEND).lower()
+    if name == "redis":
+        return RedisReplayBackend()
+    if name == "postgres":
+        return PostgresReplayBackend()
+    if name != "memory":
+        logger.warning(f"Unknown TRACKING_REPLAY_BACKEND {name!r}, using memory")
+    return MemoryReplayBackend()
+
+
+class ReplayGuard:
+    """
+    Claims tracking tokens through a ReplayBackend.
+
+    claim() calls made in the same event-loop tick are sent to the backend
+    together. If the shared backend fails, claims fall back to this process's
+    ReplayStore instead of failing the request.
+    """
+
+    def __init__(self, backend: Optional[ReplayBackend] = None):
+        self._backend = backend
+        self._fallback = MemoryReplayBackend()
+        self._pending: List[tuple[str, float, asyncio.Future]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self.stats = {"claims": 0, "backend_calls": 0, "backend_errors": 0}
+
+    @property
+    def backend(self) -> ReplayBackend:
+        if self._backend is None:
+            self._backend = create_replay_backend()
+        return self._backend
+
+    async def claim(self, key: str, expires_at: Optional[float] = None) -> bool:
+        """True if key was unused and is now claimed."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((key, expires_at or time.time() + TRACKING_TOKEN_MAX_AGE, future))
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush())
+        return await future
+
+    async def claim_many(self, items: Sequence[tuple[str, Optional[float]]]) -> List[bool]:
+        """Claim a batch of keys in one backend call (repeated keys: first one wins)."""
+        now = time.time()
+        return await self._claim_now(
+            [(key, expires_at or now + TRACKING_TOKEN_MAX_AGE) for key, expires_at in items]
+        )
+
+    async def _flush(self) -> None:
+        # Let the other requests of this tick add their claims first
+        await asyncio.sleep(0)
+        batch, self._pending, self._flush_task = self._pending, [], None
+        try:
+            claimed = await self._claim_now([(key, expires_at) for key, expires_at, _ in batch])
+        except BaseException as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            raise
+        for (_, _, future), result in zip(batch, claimed):
+            if not future.done():
+                future.set_result(result)
+
+    async def _claim_now(self, items: List[ClaimItem]) -> List[bool]:
+        self.stats["claims"] += len(items)
+        # Repeated keys in one call: only the first occurrence can win
+        first: Dict[str, int] = {}
+        for index, (key, _) in enumerate(items):
+            first.setdefault(key, index)
+        unique = [items[index] for index in first.values()]
+        if not unique:
+            return []
+        self.stats["backend_calls"] += 1
+        try:
+            claimed = await self.backend.claim_many(unique)
+        except Exception as e:
+            self.stats["backend_errors"] += 1
+            logger.warning(f"Replay backend {self.backend.name} failed, using local store: {str(e)}")
+            claimed = await self._fallback.claim_many(unique)
+        won = {index: result for index, result in zip(first.values(), claimed)}
+        return [won.get(index, False) for index in range(len(items))]
+
+    async def release(self, keys: Sequence[str]) -> None:
+        if not keys:
+            return
+        try:
+            await self.backend.release_many(keys)
+        except Exception as e:
+            logger.warning(f"Replay backend {self.backend.name} release failed: {str(e)}")
+        await self._fallback.release_many(keys)
+
+    async def close(self) -> None:
+        if self._backend is not None:
+            await self._backend.close()
+
+
+replay_guard = ReplayGuard()
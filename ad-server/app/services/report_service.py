@@ -1,75 +1,127 @@
-"""Campaign reporting helpers — stats aggregation, CSV, and share tokens."""
+"""Campaign reporting helpers — stats aggregation, streamed CSV exports, and share tokens."""
 from __future__ import annotations
 
 import csv
+import hashlib
 import io
-from datetime import datetime, timedelta
-from typing import Optional
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Sequence
 from uuid import UUID
 
 from fastapi import HTTPException, status
+from sqlalchemy import null, select
 from sqlalchemy.orm import Session
 
+from app.core.config import settings
+from app.core.database import SessionLocal
 from app.core.security import create_report_share_token, verify_report_share_token
 from app.models.ad_creative import AdCreative
 from app.models.advertiser import Advertiser
 from app.models.campaign import Campaign
 from app.models.click import Click
 from app.models.impression import Impression
-from app.schemas.report import CampaignReportDetail, CreativeStatsBrief
+from app.schemas.report import (
+    CampaignReportDetail,
+    CampaignStats,
+    CreativeStatsBrief,
+    ReportTimeseries,
+    TimeseriesPoint,
+)
+from app.services.event_rollups import (
+    CountKey,
+    EventCounts,
+    bucket_count,
+    bucket_starts,
+    event_counts,
+    event_timeseries,
+    get_watermark,
+)
+from app.services.reach_sketch import unique_reach
+from app.services.share_report_cache import SharedReport, ShareReportCache, share_report_cache
 
 
-def _apply_date_filters(query, model, start_date: Optional[datetime], end_date: Optional[datetime]):
-    if start_date:
-        query = query.filter(model.timestamp >= start_date)
-    if end_date:
-        query = query.filter(model.timestamp <= end_date)
-    return query
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """Aware datetimes (e.g. toISOString() "...Z") as naive UTC, the way event columns are stored."""
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
 
 
-def get_campaign_report_detail(
+def campaign_totals(counts: Dict[CountKey, EventCounts]) -> Dict[UUID, EventCounts]:
+    """Per-(campaign, creative) counts summed per campaign."""
+    totals: Dict[UUID, EventCounts] = defaultdict(EventCounts)
+    for (campaign_id, _), value in counts.items():
+        totals[campaign_id].add(value)
+    return dict(totals)
+
+
+def _counts_for(
     db: Session,
-    campaign_id: UUID,
-    start_date: Optional[datetime] = None,
-    end_date: Optional[datetime] = None,
-) -> CampaignReportDetail:
-    campaign = (
-        db.query(Campaign)
-        .filter(Campaign.id == campaign_id)
-        .first()
+    campaigns: Sequence[Campaign],
+    start_date: Optional[datetime],
+    end_date: Optional[datetime],
+) -> Dict[CountKey, EventCounts]:
+    # One campaign: let the grouped queries use the campaign index
+    campaign_id = campaigns[0].id if len(campaigns) == 1 else None
+    return event_counts(db, start_date, end_date, campaign_id=campaign_id)
+
+
+def campaign_stats_row(campaign: Campaign, totals: EventCounts) -> CampaignStats:
+    return CampaignStats(
+        campaign_id=campaign.id,
+        campaign_name=campaign.name,
+        impressions=totals.impressions,
+        clicks=totals.clicks,
+        click_through_rate=round(totals.click_through_rate, 2),
+        impressions_served=campaign.impressions_served,
+        budget_remaining=max(0, campaign.impression_budget - campaign.impressions_served),
+        budget_utilized_percentage=campaign.budget_utilized_percentage,
     )
-    if not campaign:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Campaign not found")
 
-    advertiser = db.query(Advertiser).filter(Advertiser.id == campaign.advertiser_id).first()
-    advertiser_name = advertiser.company_name or advertiser.name if advertiser else "Unknown"
 
-    impression_query = db.query(Impression).filter(Impression.campaign_id == campaign_id)
-    click_query = db.query(Click).filter(Click.campaign_id == campaign_id)
-    impression_query = _apply_date_filters(impression_query, Impression, start_date, end_date)
-    click_query = _apply_date_filters(click_query, Click, start_date, end_date)
+def get_campaign_stats_rows(
+    db: Session,
+    campaigns: Sequence[Campaign],
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+) -> list[CampaignStats]:
+    """Stats for the given campaigns from one grouped count per event table."""
+    if not campaigns:
+        return []
+    totals = campaign_totals(_counts_for(db, campaigns, start_date, end_date))
+    return [
+        campaign_stats_row(campaign, totals.get(campaign.id, EventCounts()))
+        for campaign in campaigns
+    ]
 
-    impressions_count = impression_query.count()
-    clicks_count = click_query.count()
-    ctr = (clicks_count / impressions_count * 100) if impressions_count > 0 else 0.0
 
-    creatives = db.query(AdCreative).filter(AdCreative.campaign_id == campaign_id).all()
+def build_report_detail(
+    campaign: Campaign,
+    advertiser: Optional[Advertiser],
+    creatives: Sequence[AdCreative],
+    counts: Dict[CountKey, EventCounts],
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    unique_reach: Optional[int] = None,
+) -> CampaignReportDetail:
+    """Assemble a campaign report from already-computed event counts."""
+    advertiser_name = advertiser.company_name or advertiser.name if advertiser else "Unknown"
+
     creative_stats: list[CreativeStatsBrief] = []
+    totals = EventCounts()
+    for (campaign_id, _), value in counts.items():
+        if campaign_id == campaign.id:
+            totals.add(value)
     for creative in creatives:
-        c_imp_q = db.query(Impression).filter(Impression.ad_creative_id == creative.id)
-        c_clk_q = db.query(Click).filter(Click.ad_creative_id == creative.id)
-        c_imp_q = _apply_date_filters(c_imp_q, Impression, start_date, end_date)
-        c_clk_q = _apply_date_filters(c_clk_q, Click, start_date, end_date)
-        c_impressions = c_imp_q.count()
-        c_clicks = c_clk_q.count()
-        c_ctr = (c_clicks / c_impressions * 100) if c_impressions > 0 else 0.0
+        c_counts = counts.get((campaign.id, creative.id), EventCounts())
         creative_stats.append(
             CreativeStatsBrief(
                 creative_id=creative.id,
                 creative_name=creative.name,
-                impressions=c_impressions,
-                clicks=c_clicks,
-                click_through_rate=round(c_ctr, 2),
+                impressions=c_counts.impressions,
+                clicks=c_counts.clicks,
+                click_through_rate=round(c_counts.click_through_rate, 2),
             )
         )
 
@@ -80,28 +132,169 @@ def get_campaign_report_detail(
         status=campaign.status.value,
         campaign_start_date=campaign.start_date,
         campaign_end_date=campaign.end_date,
-        impressions=impressions_count,
-        clicks=clicks_count,
-        click_through_rate=round(ctr, 2),
+        impressions=totals.impressions,
+        clicks=totals.clicks,
+        click_through_rate=round(totals.click_through_rate, 2),
         impressions_served=campaign.impressions_served,
         budget_remaining=max(0, campaign.impression_budget - campaign.impressions_served),
         budget_utilized_percentage=round(campaign.budget_utilized_percentage, 2),
         report_period_start=start_date,
         report_period_end=end_date,
         generated_at=datetime.utcnow(),
+        unique_reach=unique_reach,
         creatives=creative_stats,
     )
 
 
-def build_campaigns_csv(
+def get_campaign_report_details(
+    db: Session,
+    campaigns: Sequence[Campaign],
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+) -> list[CampaignReportDetail]:
+    """
+    Detailed reports for the given campaigns: one grouped count per event
+    table plus one query each for creatives, advertisers and reach sketches,
+    however many campaigns and creatives there are.
+    """
+    if not campaigns:
+        return []
+    campaign_ids = [campaign.id for campaign in campaigns]
+    counts = _counts_for(db, campaigns, start_date, end_date)
+    reach = unique_reach(db, campaign_ids, start_date, end_date, get_watermark(db))
+
+    creatives_by_campaign: Dict[UUID, list[AdCreative]] = defaultdict(list)
+    for creative in db.query(AdCreative).filter(AdCreative.campaign_id.in_(campaign_ids)):
+        creatives_by_campaign[creative.campaign_id].append(creative)
+    advertiser_ids = {campaign.advertiser_id for campaign in campaigns}
+    advertisers = {
+        advertiser.id: advertiser
+        for advertiser in db.query(Advertiser).filter(Advertiser.id.in_(advertiser_ids))
+    }
+
+    return [
+        build_report_detail(
+            campaign,
+            advertisers.get(campaign.advertiser_id),
+            creatives_by_campaign.get(campaign.id, []),
+            counts,
+            start_date,
+            end_date,
+            reach.get(campaign.id),
+        )
+        for campaign in campaigns
+    ]
+
+
+def get_campaign_report_detail(
+    db: Session,
+    campaign_id: UUID,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+) -> CampaignReportDetail:
+    campaign = (
+        db.query(Campaign)
+        .filter(Campaign.id == campaign_id)
+        .first()
+    )
+    if not campaign:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Campaign not found")
+    return get_campaign_report_details(db, [campaign], start_date, end_date)[0]
+
+
+TIMESERIES_DEFAULT_SPAN = {
+    "hour": timedelta(hours=48),
+    "day": timedelta(days=30),
+    "week": timedelta(weeks=26),
+}
+
+
+def get_report_timeseries(
     db: Session,
+    bucket: str,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
-) -> str:
-    campaigns = db.query(Campaign).order_by(Campaign.name).all()
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow([
+    campaign_id: Optional[UUID] = None,
+    creative_id: Optional[UUID] = None,
+) -> ReportTimeseries:
+    """
+    Bucketed counts for a campaign or creative in one response, with empty
+    buckets filled in. The range defaults to the last 48 hours / 30 days /
+    26 weeks and may span at most REPORT_TIMESERIES_MAX_BUCKETS buckets.
+    """
+    end_date = naive_utc(end_date) or datetime.utcnow()
+    start_date = naive_utc(start_date) or end_date - TIMESERIES_DEFAULT_SPAN[bucket]
+    if end_date < start_date:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="end_date must not be before start_date",
+        )
+    count = bucket_count(start_date, end_date, bucket)
+    if count > settings.REPORT_TIMESERIES_MAX_BUCKETS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=(
+                f"Range spans {count} {bucket} buckets; "
+                f"at most {settings.REPORT_TIMESERIES_MAX_BUCKETS} are allowed"
+            ),
+        )
+
+    series = event_timeseries(
+        db, start_date, end_date, bucket, campaign_id=campaign_id, creative_id=creative_id
+    )
+    points = []
+    for bucket_start in bucket_starts(start_date, end_date, bucket):
+        counts = series.get(bucket_start, EventCounts())
+        points.append(
+            TimeseriesPoint(
+                bucket_start=bucket_start,
+                impressions=counts.impressions,
+                clicks=counts.clicks,
+                click_through_rate=round(counts.click_through_rate, 2),
+            )
+        )
+    return ReportTimeseries(
+        campaign_id=campaign_id,
+        creative_id=creative_id,
+        bucket=bucket,
+        start_date=start_date,
+        end_date=end_date,
+        points=points,
+    )
+
+
+CsvRow = Sequence[Any]
+
+
+def iter_csv(rows: Iterable[CsvRow], chunk_rows: int = 1000) -> Iterator[str]:
+    """Encode rows as CSV text, yielding one chunk per chunk_rows rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % chunk_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def campaigns_csv_rows(
+    db: Session,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+) -> Iterator[CsvRow]:
+    """
+    Summary row per campaign. Counts come from one grouped query per event
+    table; campaigns are read in batches from a server-side cursor.
+    """
+    totals = campaign_totals(event_counts(db, start_date, end_date))
+    advertisers = {
+        advertiser.id: advertiser.company_name or advertiser.name
+        for advertiser in db.query(Advertiser)
+    }
+    yield [
         "Campaign",
         "Advertiser",
         "Status",
@@ -112,60 +305,151 @@ def build_campaigns_csv(
         "Budget Total",
         "Budget Remaining",
         "Budget Used %",
-    ])
+    ]
+    campaigns = (
+        db.query(Campaign)
+        .order_by(Campaign.name)
+        .yield_per(settings.REPORT_EXPORT_YIELD_PER)
+    )
     for campaign in campaigns:
-        detail = get_campaign_report_detail(db, campaign.id, start_date, end_date)
-        writer.writerow([
-            detail.campaign_name,
-            detail.advertiser_name,
-            detail.status,
-            detail.impressions,
-            detail.clicks,
-            detail.click_through_rate,
-            detail.impressions_served,
+        counts = totals.get(campaign.id, EventCounts())
+        yield [
+            campaign.name,
+            advertisers.get(campaign.advertiser_id, "Unknown"),
+            campaign.status.value,
+            counts.impressions,
+            counts.clicks,
+            round(counts.click_through_rate, 2),
+            campaign.impressions_served,
             campaign.impression_budget,
-            detail.budget_remaining,
-            detail.budget_utilized_percentage,
-        ])
-    return output.getvalue()
+            max(0, campaign.impression_budget - campaign.impressions_served),
+            round(campaign.budget_utilized_percentage, 2),
+        ]
 
 
-def build_campaign_csv(
-    db: Session,
-    campaign_id: UUID,
-    start_date: Optional[datetime] = None,
-    end_date: Optional[datetime] = None,
-) -> str:
-    detail = get_campaign_report_detail(db, campaign_id, start_date, end_date)
-    output = io.StringIO()
-    writer = csv.writer(output)
-    writer.writerow(["Campaign Report", detail.campaign_name])
-    writer.writerow(["Advertiser", detail.advertiser_name])
-    writer.writerow(["Status", detail.status])
-    writer.writerow(["Generated", detail.generated_at.isoformat() + "Z"])
+def campaign_csv_rows(detail: CampaignReportDetail) -> Iterator[CsvRow]:
+    yield ["Campaign Report", detail.campaign_name]
+    yield ["Advertiser", detail.advertiser_name]
+    yield ["Status", detail.status]
+    yield ["Generated", detail.generated_at.isoformat() + "Z"]
     if detail.report_period_start or detail.report_period_end:
-        writer.writerow([
+        yield [
             "Report period",
             f"{detail.report_period_start or 'start'} — {detail.report_period_end or 'now'}",
-        ])
-    writer.writerow([])
-    writer.writerow(["Metric", "Value"])
-    writer.writerow(["Impressions", detail.impressions])
-    writer.writerow(["Clicks", detail.clicks])
-    writer.writerow(["CTR %", detail.click_through_rate])
-    writer.writerow(["Budget served", detail.impressions_served])
-    writer.writerow(["Budget remaining", detail.budget_remaining])
-    writer.writerow(["Budget used %", detail.budget_utilized_percentage])
-    writer.writerow([])
-    writer.writerow(["Creative", "Impressions", "Clicks", "CTR %"])
+        ]
+    yield []
+    yield ["Metric", "Value"]
+    yield ["Impressions", detail.impressions]
+    yield ["Clicks", detail.clicks]
+    yield ["CTR %", detail.click_through_rate]
+    yield ["Unique reach (approx.)", detail.unique_reach]
+    yield ["Budget served", detail.impressions_served]
+    yield ["Budget remaining", detail.budget_remaining]
+    yield ["Budget used %", detail.budget_utilized_percentage]
+    yield []
+    yield ["Creative", "Impressions", "Clicks", "CTR %"]
     for creative in detail.creatives:
-        writer.writerow([
+        yield [
             creative.creative_name,
             creative.impressions,
             creative.clicks,
             creative.click_through_rate,
-        ])
-    return output.getvalue()
+        ]
+
+
+EVENT_EXPORT_KINDS = ("impressions", "clicks")
+
+
+def event_csv_rows(
+    db: Session,
+    start_date: datetime,
+    end_date: datetime,
+    kinds: Sequence[str] = EVENT_EXPORT_KINDS,
+    campaign_id: Optional[UUID] = None,
+) -> Iterator[CsvRow]:
+    """
+    Raw impression/click rows with timestamp in [start_date, end_date], in
+    timestamp order per kind, streamed from a server-side cursor.
+    """
+    yield ["Type", "Event ID", "Timestamp", "Campaign ID", "Creative ID", "User ID", "City", "State"]
+    for kind in kinds:
+        model = Impression if kind == "impressions" else Click
+        location = (model.city, model.state) if model is Impression else (null(), null())
+        stmt = (
+            select(
+                model.id,
+                model.timestamp,
+                model.campaign_id,
+                model.ad_creative_id,
+                model.user_id,
+                *location,
+            )
+            .where(model.timestamp >= start_date, model.timestamp <= end_date)
+            .order_by(model.timestamp)
+        )
+        if campaign_id is not None:
+            stmt = stmt.where(model.campaign_id == campaign_id)
+        label = kind[:-1]
+        result = db.execute(
+            stmt.execution_options(yield_per=settings.REPORT_EXPORT_YIELD_PER)
+        )
+        for event_id, timestamp, c_id, creative_id, user_id, city, state in result:
+            yield [
+                label,
+                event_id,
+                timestamp.isoformat(),
+                c_id,
+                creative_id,
+                user_id,
+                city or "",
+                state or "",
+            ]
+
+
+def stream_in_new_session(rows: Callable[[Session], Iterable[CsvRow]]) -> Iterator[str]:
+    """
+    CSV chunks of rows(db) read in a session owned by the generator, so a
+    long download does not depend on the request's session lifetime.
+    """
+    db = SessionLocal()
+    try:
+        yield from iter_csv(rows(db))
+    finally:
+        db.close()
+
+
+def _digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_shared_report(
+    db: Session,
+    campaign_id: UUID,
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    cache: Optional[ShareReportCache] = None,
+) -> SharedReport:
+    """
+    Rendered share report, from the cache while fresh. A recomputed report
+    whose numbers did not change keeps the previous body and ETag, so
+    viewers holding it still get 304 Not Modified.
+    """
+    cache = cache if cache is not None else share_report_cache
+    key = (campaign_id, start_date, end_date)
+    report = cache.get(key)
+    if report is not None:
+        return report
+
+    detail = get_campaign_report_detail(db, campaign_id, start_date, end_date)
+    content_digest = _digest(detail.model_dump_json(exclude={"generated_at"}).encode())
+    previous = cache.previous(key)
+    if previous is not None and previous.content_digest == content_digest:
+        report = previous
+    else:
+        body = detail.model_dump_json().encode()
+        report = SharedReport(body=body, etag=f'"{_digest(body)[:32]}"', content_digest=content_digest)
+    cache.put(key, report)
+    return report
 
 
 def create_share_link_for_campaign(
@@ -0,0 +1,114 @@
+"""
+Cache of rendered public share reports.
+
+Advertisers leave /reports/share pages open or forward the link around, so
+the same (campaign, date range) report is requested over and over. Rendered
+reports are kept for SHARE_REPORT_CACHE_TTL seconds with a strong ETag, so
+repeat viewers revalidate with If-None-Match and get 304 Not Modified.
+
+An entry goes stale early once SHARE_REPORT_INVALIDATE_EVENTS impressions and
+clicks of its campaign have been written by this process, or when campaigns
+or creatives change (inventory version). Stale entries are kept (bounded to
+SHARE_REPORT_CACHE_SIZE, least recently used evicted first) so a recomputed
+report with unchanged numbers keeps its body and ETag.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Optional
+from uuid import UUID
+
+from app.core.config import settings
+from app.services.inventory_events import inventory_version
+
+ShareKey = tuple[UUID, Optional[datetime], Optional[datetime]]
+
+
+@dataclass(frozen=True)
+class SharedReport:
+    """A rendered report: JSON body, its ETag and a digest of its numbers."""
+    body: bytes
+    etag: str
+    # Digest of the report without generated_at, to tell whether numbers moved
+    content_digest: str
+
+
+class ShareReportCache:
+    """Thread-safe TTL + LRU map from (campaign, start, end) to a rendered report."""
+
+    def __init__(
+        self,
+        ttl_seconds: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        invalidate_events: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = settings.SHARE_REPORT_CACHE_TTL if ttl_seconds is None else ttl_seconds
+        self.max_entries = settings.SHARE_REPORT_CACHE_SIZE if max_entries is None else max_entries
+        self.invalidate_events = (
+            settings.SHARE_REPORT_INVALIDATE_EVENTS if invalidate_events is None else invalidate_events
+        )
+        self._clock = clock
+        self._lock = threading.Lock()
+        # key -> (expires_at, inventory version, campaign event count when cached, report)
+        self._entries: OrderedDict[ShareKey, tuple[float, int, int, SharedReport]] = OrderedDict()
+        # campaign id -> events written by this process
+        self._events: Dict[UUID, int] = defaultdict(int)
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, key: ShareKey) -> Optional[SharedReport]:
+        """Fresh report for key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not self._fresh(key, entry):
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[3]
+
+    def _fresh(self, key: ShareKey, entry: tuple[float, int, int, SharedReport]) -> bool:
+        expires_at, version, events_at, _ = entry
+        if expires_at <= self._clock() or version != inventory_version():
+            return False
+        return self._events[key[0]] - events_at < self.invalidate_events
+
+    def previous(self, key: ShareKey) -> Optional[SharedReport]:
+        """Last report rendered for key, fresh or not."""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry[3] if entry else None
+
+    def put(self, key: ShareKey, report: SharedReport) -> None:
+        if self.ttl <= 0 or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (
+                self._clock() + self.ttl,
+                inventory_version(),
+                self._events[key[0]],
+                report,
+            )
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def record_events(self, campaign_ids: Iterable[UUID]) -> None:
+        """Count written impressions/clicks towards their campaigns' thresholds."""
+        with self._lock:
+            for campaign_id in campaign_ids:
+                self._events[campaign_id] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+share_report_cache = ShareReportCache()
@@ -9,9 +9,12 @@ Includes:
 - Error handling
 """
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any, Set
+from typing import Optional, Dict, Any, List, Set
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
+import hmac
 import logging
 import uuid
 
@@ -19,22 +22,33 @@ from app.models.impression import Impression
 from app.models.click import Click
 from app.models.campaign import Campaign
 from app.models.ad_creative import AdCreative, CreativeStatus
-from app.core.security import verify_tracking_token
+from app.core.database import AsyncSessionLocal
+from app.core.security import click_url_digest, verify_tracking_token
+from app.services.creative_status_cache import (
+    CreativeState,
+    CreativeStatusCache,
+    creative_status_cache,
+)
+from app.services.eligibility_snapshot import EligibilityCache, eligibility_cache
+from app.services.impression_dedup import ImpressionDeduper, impression_deduper
+from app.services.event_ingestion import (
+    CLICK,
+    IMPRESSION,
+    EventIngestionQueue,
+    TrackingEvent,
+    event_ingestion,
+)
+from app.services.replay_store import ReplayGuard, replay_guard, replay_store
 
 logger = logging.getLogger(__name__)
 
 
-# In-memory set for tracking used tokens (prevents replay attacks)
-# In production, use Redis with TTL
-_used_tokens: Set[str] = set()
-_token_cleanup_threshold = 10000  # Clear set when it gets too large
-
-
 class TrackingService:
     """Service for tracking ad impressions and clicks."""
     
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, status_cache: Optional[CreativeStatusCache] = None):
         self.db = db
+        self.status_cache = status_cache if status_cache is not None else creative_status_cache
     
     def track_impression(
         self,
@@ -56,7 +70,7 @@ class TrackingService:
             ad_creative_id: UUID of the ad creative
             campaign_id: UUID of the campaign
             user_id: User/device identifier
-            tracking_token: JWT token for validation
+            tracking_token: Tracking token from the ad response (compact or JWT)
             timestamp: When the impression occurred
             city: User's city (optional)
             state: User's state (optional)
@@ -71,7 +85,7 @@ class TrackingService:
         
         try:
             # Step 1: Validate tracking token
-            self._validate_token(
+            payload = self._validate_token(
                 tracking_token,
                 ad_creative_id,
                 campaign_id,
@@ -79,7 +93,7 @@ class TrackingService:
             )
             
             # Step 2: Check for replay attack
-            if self._is_token_used(tracking_token):
+            if self._is_token_used(tracking_token, "impression"):
                 logger.warning(f"Token replay detected: {tracking_token[:20]}...")
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
@@ -118,7 +132,7 @@ class TrackingService:
             self.db.refresh(impression)
             
             # Step 7: Mark token as used
-            self._mark_token_used(tracking_token)
+            self._mark_token_used(tracking_token, "impression", payload)
             
             logger.info(f"Impression tracked: {impression.id}")
             return {"impression_id": str(impression.id)}
@@ -151,7 +165,7 @@ class TrackingService:
             ad_creative_id: UUID of the ad creative
             campaign_id: UUID of the campaign
             user_id: User/device identifier
-            tracking_token: JWT token for validation
+            tracking_token: Tracking token from the ad response (compact or JWT)
             timestamp: When the click occurred
         
         Returns:
@@ -164,7 +178,7 @@ class TrackingService:
         
         try:
             # Step 1: Validate tracking token
-            self._validate_token(
+            payload = self._validate_token(
                 tracking_token,
                 ad_creative_id,
                 campaign_id,
@@ -172,7 +186,7 @@ class TrackingService:
             )
             
             # Step 2: Check for replay attack
-            if self._is_token_used(tracking_token):
+            if self._is_token_used(tracking_token, "click"):
                 logger.warning(f"Token replay detected for click: {tracking_token[:20]}...")
                 # For clicks, still redirect but don't count twice
                 creative = self.db.query(AdCreative).filter(
@@ -196,6 +210,7 @@ class TrackingService:
             if not self._is_timestamp_valid(timestamp):
                 # Still redirect even if timestamp is old
                 logger.warning(f"Old timestamp for click, but redirecting anyway")
+                timestamp = self._click_timestamp(timestamp)
             
             # Step 5: Validate user_id
             if not self._is_user_id_valid(user_id):
@@ -217,7 +232,7 @@ class TrackingService:
             self.db.refresh(click)
             
             # Step 7: Mark token as used
-            self._mark_token_used(tracking_token)
+            self._mark_token_used(tracking_token, "click", payload)
             
             logger.info(f"Click tracked: {click.id}")
             return {
@@ -271,19 +286,27 @@ class TrackingService:
                 detail="Invalid tracking token"
             )
     
+    def _creative_state(self, creative_id: uuid.UUID) -> Optional[CreativeState]:
+        """Creative id -> campaign/status/click URL, from the status cache or the DB."""
+        state = self.status_cache.get(creative_id)
+        if state is None:
+            creative = self.db.query(AdCreative).filter(AdCreative.id == creative_id).first()
+            if creative is None:
+                return None
+            state = self.status_cache.put(creative)
+        return state
+    
     def _validate_ad_and_campaign(
         self,
         ad_creative_id: str,
         campaign_id: str
-    ) -> AdCreative:
+    ) -> CreativeState:
         """
-        Validate that ad creative and campaign exist and are active.
-        Returns the ad creative.
+        Validate that ad creative and campaign exist and the creative is active.
+        Returns the creative's cached state.
         """
         # Check ad creative exists and is active
-        creative = self.db.query(AdCreative).filter(
-            AdCreative.id == uuid.UUID(ad_creative_id)
-        ).first()
+        creative = self._creative_state(uuid.UUID(ad_creative_id))
         
         if not creative:
             raise HTTPException(
@@ -297,16 +320,17 @@ class TrackingService:
                 detail="Ad creative is not active"
             )
         
-        # Check campaign exists and is active
-        campaign = self.db.query(Campaign).filter(
-            Campaign.id == uuid.UUID(campaign_id)
-        ).first()
-        
-        if not campaign:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Campaign not found"
-            )
+        # Check campaign exists (implied when it is the creative's own campaign)
+        if creative.campaign_id != uuid.UUID(campaign_id):
+            campaign = self.db.query(Campaign).filter(
+                Campaign.id == uuid.UUID(campaign_id)
+            ).first()
+            
+            if not campaign:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Campaign not found"
+                )
         
         return creative
     
@@ -316,32 +340,432 @@ class TrackingService:
         diff = abs((now - timestamp).total_seconds())
         return diff <= 300  # 5 minutes
     
+    def _click_timestamp(self, timestamp: datetime) -> datetime:
+        """Clamp a future click timestamp to now (it would land in the DEFAULT event partition)."""
+        return min(timestamp, datetime.utcnow())
+    
     def _is_user_id_valid(self, user_id: str) -> bool:
         """Validate user_id format (alphanumeric, max 100 chars)."""
         if not user_id or len(user_id) > 100:
             return False
         return user_id.replace("-", "").replace("_", "").isalnum()
     
-    def _is_token_used(self, token: str) -> bool:
-        """Check if tracking token has already been used."""
-        return token in _used_tokens
+    def _is_token_used(self, token: str, token_type: str = "impression") -> bool:
+        """Check if tracking token has already been used for this event type."""
+        return replay_store.seen(f"{token_type}:{token}")
     
-    def _mark_token_used(self, token: str) -> None:
-        """Mark a tracking token as used to prevent replay attacks."""
-        global _used_tokens
-        
-        _used_tokens.add(token)
+    def _mark_token_used(
+        self,
+        token: str,
+        token_type: str = "impression",
+        payload: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """
+        Mark a tracking token as used to prevent replay attacks.
         
-        # Cleanup if set gets too large
-        # In production, use Redis with TTL instead
-        if len(_used_tokens) > _token_cleanup_threshold:
-            logger.info(f"Clearing token cache ({len(_used_tokens)} tokens)")
-            _used_tokens.clear()
-
+        Keyed by event type: one compact token covers both the impression and the click.
+        Remembered until the token expires (payload "exp" when known).
+        """
+        expires_at = payload.get("exp") if payload else None
+        replay_store.add(f"{token_type}:{token}", expires_at)
 
 
+class AsyncTrackingService(TrackingService):
+    """
+    TrackingService for the listener-facing async endpoints.
+    
+    Same validation and replay rules; reads go through an AsyncSession, tokens
+    are claimed through the shared replay backend (so a token is tracked once
+    across workers), repeat impressions of a creative by the same listener
+    within IMPRESSION_DEDUP_WINDOW are dropped, and accepted events are written
+    in bulk by the ingestion queue (write-behind).
+    """
+    
+    def __init__(
+        self,
+        db: AsyncSession,
+        ingestion: Optional[EventIngestionQueue] = None,
+        replay: Optional[ReplayGuard] = None,
+        status_cache: Optional[CreativeStatusCache] = None,
+        deduper: Optional[ImpressionDeduper] = None
+    ):
+        super().__init__(db, status_cache)
+        self.ingestion = ingestion or event_ingestion
+        self.replay = replay or replay_guard
+        self.deduper = deduper if deduper is not None else impression_deduper
+    
+    def _enqueue(self, event: TrackingEvent) -> None:
+        if not self.ingestion.accept(event):
+            logger.warning(f"Tracking queue full, rejecting {event.kind} for ad={event.ad_creative_id}")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Tracking is busy, retry later",
+                headers={"Retry-After": "1"}
+            )
+    
+    async def track_impression(
+        self,
+        ad_creative_id: str,
+        campaign_id: str,
+        user_id: str,
+        tracking_token: str,
+        timestamp: datetime,
+        city: Optional[str] = None,
+        state: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Track an ad impression (see TrackingService.track_impression)."""
+        logger.info(f"Tracking impression: ad={ad_creative_id}, user={user_id}")
+        
+        try:
+            payload = self._validate_token(
+                tracking_token,
+                ad_creative_id,
+                campaign_id,
+                "impression"
+            )
+            
+            if not self._is_timestamp_valid(timestamp):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Timestamp too old or in future"
+                )
+            
+            if not self._is_user_id_valid(user_id):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Invalid user_id format"
+                )
+            
+            replay_key = f"impression:{tracking_token}"
+            if not await self.replay.claim(replay_key, payload.get("exp")):
+                logger.warning(f"Token replay detected: {tracking_token[:20]}...")
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Tracking token already used"
+                )
+            
+            try:
+                creative = await self._validate_ad_and_campaign_async(ad_creative_id, campaign_id)
+                
+                if self.deduper.is_duplicate(user_id, creative.id):
+                    # Same listener and creative within the de-dup window: not written
+                    logger.info(f"Duplicate impression suppressed: ad={ad_creative_id}, user={user_id}")
+                    return {"impression_id": None, "duplicate": True}
+                
+                impression = TrackingEvent(
+                    kind=IMPRESSION,
+                    ad_creative_id=uuid.UUID(ad_creative_id),
+                    campaign_id=uuid.UUID(campaign_id),
+                    user_id=user_id,
+                    city=city,
+                    state=state,
+                    timestamp=timestamp
+                )
+                self._enqueue(impression)
+            except Exception:
+                # Not tracked, so the token stays usable for a retry
+                await self.replay.release([replay_key])
+                raise
+            self.deduper.record(user_id, creative.id)
+            
+            logger.info(f"Impression tracked: {impression.id}")
+            return {"impression_id": str(impression.id), "duplicate": False}
+            
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error tracking impression: {str(e)}", exc_info=True)
+            await self.db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed to track impression"
+            )
+    
+    async def track_click(
+        self,
+        ad_creative_id: str,
+        campaign_id: str,
+        user_id: str,
+        tracking_token: str,
+        timestamp: datetime
+    ) -> Dict[str, Any]:
+        """Track an ad click and return the redirect URL (see TrackingService.track_click)."""
+        logger.info(f"Tracking click: ad={ad_creative_id}, user={user_id}")
+        
+        try:
+            payload = self._validate_token(
+                tracking_token,
+                ad_creative_id,
+                campaign_id,
+                "click"
+            )
+            
+            replay_key = f"click:{tracking_token}"
+            if not await self.replay.claim(replay_key, payload.get("exp")):
+                logger.warning(f"Token replay detected for click: {tracking_token[:20]}...")
+                # For clicks, still redirect but don't count twice
+                creative = await self._creative_state_async(uuid.UUID(ad_creative_id))
+                if creative:
+                    return {
+                        "click_id": None,
+                        "click_url": creative.click_url,
+                        "duplicate": True
+                    }
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Ad creative not found"
+                )
+            
+            try:
+                creative = await self._validate_ad_and_campaign_async(ad_creative_id, campaign_id)
+                
+                if not self._is_timestamp_valid(timestamp):
+                    # Still redirect even if timestamp is old
+                    logger.warning(f"Old timestamp for click, but redirecting anyway")
+                    timestamp = self._click_timestamp(timestamp)
+                
+                if not self._is_user_id_valid(user_id):
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail="Invalid user_id format"
+                    )
+                
+                click = TrackingEvent(
+                    kind=CLICK,
+                    ad_creative_id=uuid.UUID(ad_creative_id),
+                    campaign_id=uuid.UUID(campaign_id),
+                    user_id=user_id,
+                    timestamp=timestamp
+                )
+                self._enqueue(click)
+            except Exception:
+                await self.replay.release([replay_key])
+                raise
+            
+            logger.info(f"Click tracked: {click.id}")
+            return {
+                "click_id": str(click.id),
+                "click_url": creative.click_url,
+                "duplicate": False
+            }
+            
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Error tracking click: {str(e)}", exc_info=True)
+            await self.db.rollback()
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail="Failed to track click"
+            )
+    
+    async def track_batch(self, events: List[Any]) -> List[Dict[str, Any]]:
+        """
+        Track a batch of impression/click events (see schemas.TrackingBatchEvent).
+        
+        Each event gets the same checks as track_impression/track_click, but the
+        tokens of the whole batch are claimed in one replay backend call and
+        creatives missing from the status cache are loaded with one query.
+        Returns one result per event, in order: status tracked, duplicate,
+        rejected (with error) or retry (ingestion queue full).
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(events)
+        checked: List[tuple[int, Any, Dict[str, Any]]] = []
+        
+        # Step 1: Per-event checks that need no database
+        for index, event in enumerate(events):
+            try:
+                payload = self._validate_token(
+                    event.tracking_token, event.ad_id, event.campaign_id, event.type
+                )
+            except HTTPException as e:
+                results[index] = {"index": index, "status": "rejected", "error": e.detail}
+                continue
+            if event.type == IMPRESSION and not self._is_timestamp_valid(event.timestamp):
+                results[index] = {
+                    "index": index, "status": "rejected", "error": "Timestamp too old or in future"
+                }
+                continue
+            if not self._is_user_id_valid(event.user_id):
+                results[index] = {"index": index, "status": "rejected", "error": "Invalid user_id format"}
+                continue
+            checked.append((index, event, payload))
+        
+        # Step 2: Claim all tokens at once (repeats within the batch are duplicates too)
+        claimed = await self.replay.claim_many([
+            (f"{event.type}:{event.tracking_token}", payload.get("exp"))
+            for _, event, payload in checked
+        ])
+        candidates = []
+        for (index, event, payload), is_new in zip(checked, claimed):
+            if is_new:
+                candidates.append((index, event))
+            elif event.type == CLICK:
+                results[index] = {"index": index, "status": "duplicate"}
+            else:
+                results[index] = {
+                    "index": index, "status": "rejected", "error": "Tracking token already used"
+                }
+        
+        # Step 3: Creatives (status cache, then one query for the misses) and
+        # campaigns other than the creative's own
+        creatives: Dict[uuid.UUID, CreativeState] = {}
+        for _, event in candidates:
+            creative_id = uuid.UUID(event.ad_id)
+            state = self.status_cache.get(creative_id)
+            if state is not None:
+                creatives[creative_id] = state
+        missing = {uuid.UUID(event.ad_id) for _, event in candidates} - creatives.keys()
+        if missing:
+            rows = await self.db.execute(select(AdCreative).where(AdCreative.id.in_(missing)))
+            for creative in rows.scalars():
+                creatives[creative.id] = self.status_cache.put(creative)
+        other_campaigns = {
+            uuid.UUID(event.campaign_id)
+            for _, event in candidates
+            if uuid.UUID(event.ad_id) in creatives
+            and creatives[uuid.UUID(event.ad_id)].campaign_id != uuid.UUID(event.campaign_id)
+        }
+        campaign_ids: Set[uuid.UUID] = set()
+        if other_campaigns:
+            rows = await self.db.execute(select(Campaign.id).where(Campaign.id.in_(other_campaigns)))
+            campaign_ids = set(rows.scalars())
+        
+        # Step 4: Queue valid events; give back the tokens of events not tracked
+        unused: List[str] = []
+        for index, event in candidates:
+            creative = creatives.get(uuid.UUID(event.ad_id))
+            campaign_id = uuid.UUID(event.campaign_id)
+            if creative is None:
+                error = "Ad creative not found"
+            elif creative.status != CreativeStatus.ACTIVE:
+                error = "Ad creative is not active"
+            elif creative.campaign_id != campaign_id and campaign_id not in campaign_ids:
+                error = "Campaign not found"
+            else:
+                error = None
+            if error:
+                results[index] = {"index": index, "status": "rejected", "error": error}
+                unused.append(f"{event.type}:{event.tracking_token}")
+                continue
+            
+            if event.type == IMPRESSION and self.deduper.is_duplicate(event.user_id, creative.id):
+                results[index] = {"index": index, "status": "duplicate"}
+                continue
+            
+            location = getattr(event, "location", None)
+            tracking_event = TrackingEvent(
+                kind=event.type,
+                ad_creative_id=creative.id,
+                campaign_id=campaign_id,
+                user_id=event.user_id,
+                city=location.city if location and event.type == IMPRESSION else None,
+                state=location.state if location and event.type == IMPRESSION else None,
+                timestamp=(
+                    self._click_timestamp(event.timestamp) if event.type == CLICK else event.timestamp
+                )
+            )
+            if not self.ingestion.accept(tracking_event):
+                results[index] = {"index": index, "status": "retry"}
+                unused.append(f"{event.type}:{event.tracking_token}")
+                continue
+            if event.type == IMPRESSION:
+                self.deduper.record(event.user_id, creative.id)
+            results[index] = {"index": index, "status": "tracked", "id": str(tracking_event.id)}
+        await self.replay.release(unused)
+        
+        tracked = sum(1 for result in results if result["status"] == "tracked")
+        logger.info(f"Batch tracked: {tracked}/{len(events)} events")
+        return results
+    
+    async def _creative_state_async(self, creative_id: uuid.UUID) -> Optional[CreativeState]:
+        """Async counterpart of _creative_state."""
+        state = self.status_cache.get(creative_id)
+        if state is None:
+            creative = await self.db.get(AdCreative, creative_id)
+            if creative is None:
+                return None
+            state = self.status_cache.put(creative)
+        return state
+    
+    async def _validate_ad_and_campaign_async(
+        self,
+        ad_creative_id: str,
+        campaign_id: str
+    ) -> CreativeState:
+        """Async counterpart of _validate_ad_and_campaign (primary-key lookups on a miss)."""
+        creative = await self._creative_state_async(uuid.UUID(ad_creative_id))
+        
+        if not creative:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Ad creative not found"
+            )
+        
+        if creative.status != CreativeStatus.ACTIVE:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Ad creative is not active"
+            )
+        
+        if creative.campaign_id != uuid.UUID(campaign_id):
+            campaign = await self.db.get(Campaign, uuid.UUID(campaign_id))
+            
+            if not campaign:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Campaign not found"
+                )
+        
+        return creative
 
 
+def cached_click_url(
+    payload: Dict[str, Any],
+    cache: EligibilityCache = eligibility_cache,
+) -> Optional[str]:
+    """
+    Destination for a verified click token, answered from the in-memory snapshot.
+    
+    Only used when the token pins the URL it was served with (click_url_digest)
+    and the cached creative still has that URL; otherwise None and the caller
+    falls back to the database.
+    """
+    digest = payload.get("click_url_digest")
+    snapshot = cache.peek()
+    if digest is None or snapshot is None:
+        return None
+    found = snapshot.creatives.get(uuid.UUID(payload["ad_id"]))
+    if found is None:
+        return None
+    campaign, creative = found
+    if str(campaign.id) != payload.get("campaign_id"):
+        return None
+    if not hmac.compare_digest(click_url_digest(creative.click_url), digest):
+        return None
+    return creative.click_url
 
 
+async def record_click_detached(
+    ad_creative_id: str,
+    campaign_id: str,
+    user_id: str,
+    tracking_token: str,
+    timestamp: datetime,
+    session_factory=AsyncSessionLocal,
+) -> None:
+    """Record a click after the redirect has been sent (run as a background task)."""
+    try:
+        async with session_factory() as db:
+            await AsyncTrackingService(db).track_click(
+                ad_creative_id=ad_creative_id,
+                campaign_id=campaign_id,
+                user_id=user_id,
+                tracking_token=tracking_token,
+                timestamp=timestamp
+            )
+    except HTTPException as e:
+        logger.warning(f"Click for ad={ad_creative_id} not recorded: {e.detail}")
+    except Exception as e:
+        logger.error(f"Error recording click after redirect: {str(e)}", exc_info=True)
 
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Backfill the hourly impression/click rollups and reach sketches that reports
+read from.
+
+Run once after migrating (007) on a database with existing events, or with
+--rebuild to recompute the rollups and reach sketches from the raw tables
+(e.g. after migration 009). --rebuild only sees events still in attached
+partitions, so months detached by manage_event_partitions.py drop out.
+
+Usage:
+  cd ad-server
+  python scripts/backfill_rollups.py                  # roll up everything not yet counted
+  python scripts/backfill_rollups.py --rebuild        # drop and recompute all rollups
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+# Allow `python scripts/backfill_rollups.py` from ad-server/
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.core.database import SessionLocal
+from app.maintenance.event_rollups import backfill_event_rollups
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Backfill hourly event rollups.")
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Delete all rollups and recompute them from the raw tables.",
+    )
+    parser.add_argument(
+        "--step-hours",
+        type=int,
+        default=24,
+        help="Hours of inserted events rolled up per transaction (default 24).",
+    )
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        summary = backfill_event_rollups(db, rebuild=args.rebuild, step_hours=args.step_hours)
+
+        if summary.rebuilt:
+            print(
+                f"Deleted {summary.deleted_rows} rollup row(s) and "
+                f"{summary.deleted_sketches} reach sketch(es)."
+            )
+        print(f"Previous watermark: {summary.previous_watermark or 'none'}")
+        print(f"Rolled up {summary.steps} step(s); watermark now {summary.watermark}.")
+        return 0
+    except Exception as exc:
+        db.rollback()
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
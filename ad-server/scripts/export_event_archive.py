@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Export impressions, clicks and song likes to compressed Parquet files,
+partitioned by day (<out>/<table>/day=YYYY-MM-DD/part-<run>.parquet).
+
+By default each table is exported incrementally from its stored watermark, so
+a cron job archives every row exactly once. Archive months before detaching
+their partitions with manage_event_partitions.py.
+
+Usage:
+  cd ad-server
+  python scripts/export_event_archive.py --out /data/archive
+  python scripts/export_event_archive.py --out /data/archive --tables clicks
+  python scripts/export_event_archive.py --out /tmp/march \\
+      --since 2026-03-01 --until 2026-04-01          # ad-hoc range, watermark untouched
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+from datetime import datetime
+from pathlib import Path
+
+# Allow `python scripts/export_event_archive.py` from ad-server/
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.core.database import SessionLocal
+from app.maintenance.event_archive import ARCHIVE_TABLES, export_event_archive
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Export event tables to Parquet.")
+    parser.add_argument("--out", required=True, type=Path, help="Archive root directory.")
+    parser.add_argument(
+        "--tables",
+        nargs="+",
+        choices=sorted(ARCHIVE_TABLES),
+        default=None,
+        help="Tables to export (default: all).",
+    )
+    parser.add_argument(
+        "--since",
+        type=datetime.fromisoformat,
+        default=None,
+        help="Export rows created from this UTC time (disables the watermark).",
+    )
+    parser.add_argument(
+        "--until",
+        type=datetime.fromisoformat,
+        default=None,
+        help="Export rows created before this UTC time (default: now minus settle delay).",
+    )
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        summary = export_event_archive(
+            db, args.out, tables=args.tables, since=args.since, until=args.until
+        )
+        for result in summary.results:
+            print(
+                f"{result.table}: {result.rows} row(s) created "
+                f"{result.since or 'start'} — {result.until}, {len(result.files)} file(s)"
+            )
+            for path in result.files:
+                print(f"  • {path}")
+        if summary.incremental:
+            print("\nWatermarks advanced.")
+        return 0
+    except Exception as exc:
+        db.rollback()
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
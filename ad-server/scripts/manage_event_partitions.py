@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Maintain monthly impression/click partitions (see migration 008).
+
+Creates partitions for the current month and EVENT_PARTITION_PREMAKE_MONTHS
+ahead, and detaches partitions older than EVENT_RETENTION_MONTHS once the
+hourly rollups cover them. Detached partitions remain as standalone tables
+(e.g. impressions_p202501) for archiving; --drop removes them instead.
+
+Usage:
+  cd ad-server
+  python scripts/manage_event_partitions.py                          # dry run (default)
+  python scripts/manage_event_partitions.py --apply                  # create/detach
+  python scripts/manage_event_partitions.py --apply --retention-months 13 --drop
+"""
+from __future__ import annotations
+
+import argparse
+import sys
+from pathlib import Path
+
+# Allow `python scripts/manage_event_partitions.py` from ad-server/
+ROOT = Path(__file__).resolve().parents[1]
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+from app.core.database import SessionLocal
+from app.maintenance.event_partitions import maintain_event_partitions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Create and retire event partitions.")
+    parser.add_argument(
+        "--apply",
+        action="store_true",
+        help="Persist changes (default is dry run only).",
+    )
+    parser.add_argument(
+        "--premake-months",
+        type=int,
+        default=None,
+        help="Months of partitions to create ahead (default EVENT_PARTITION_PREMAKE_MONTHS).",
+    )
+    parser.add_argument(
+        "--retention-months",
+        type=int,
+        default=None,
+        help="Detach partitions older than this many months (default EVENT_RETENTION_MONTHS, 0 keeps all).",
+    )
+    parser.add_argument(
+        "--drop",
+        action="store_true",
+        help="Drop detached partitions instead of keeping them as standalone tables.",
+    )
+    args = parser.parse_args()
+    dry_run = not args.apply
+
+    db = SessionLocal()
+    try:
+        summary = maintain_event_partitions(
+            db,
+            dry_run=dry_run,
+            premake_months=args.premake_months,
+            retention_months=args.retention_months,
+            drop_detached=args.drop,
+        )
+
+        verb = "Would" if dry_run else "Did"
+        print(f"{verb} create {len(summary.created)} partition(s):")
+        for name in summary.created:
+            moved = " (rows moved from DEFAULT)" if name in summary.moved_from_default else ""
+            print(f"  • {name}{moved}")
+        print(f"{verb} detach {len(summary.detached)} partition(s):")
+        for name in summary.detached:
+            print(f"  • {name}{' (dropped)' if name in summary.dropped else ''}")
+        if summary.held_for_rollup:
+            print(f"Kept {len(summary.held_for_rollup)} partition(s) not yet rolled up:")
+            for name in summary.held_for_rollup:
+                print(f"  • {name}")
+
+        if dry_run:
+            print("\nDry run only. Re-run with --apply to make these changes.")
+        return 0
+    except Exception as exc:
+        db.rollback()
+        print(f"Error: {exc}", file=sys.stderr)
+        return 1
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
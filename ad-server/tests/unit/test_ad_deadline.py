@@ -0,0 +1,56 @@
+"""Unit tests for the ad decision deadline."""
+import asyncio
+
+import pytest
+
+from app.services.ad_deadline import (
+    GEO,
+    SELECTION,
+    TOKENS,
+    AdDeadline,
+    AdDeadlineExceeded,
+    DeadlineCounters,
+)
+
+
+async def _sleep_then(value, seconds):
+    await asyncio.sleep(seconds)
+    return value
+
+
+@pytest.mark.asyncio
+async def test_run_returns_result_within_budget():
+    counters = DeadlineCounters()
+    deadline = AdDeadline(timeout_ms=1000, counters=counters)
+
+    assert await deadline.run(GEO, _sleep_then("NA", 0)) == "NA"
+    assert counters.snapshot() == {
+        "requests": 1,
+        "overruns": {GEO: 0, SELECTION: 0, TOKENS: 0},
+    }
+
+
+@pytest.mark.asyncio
+async def test_run_cancels_slow_stage_and_counts_overrun():
+    counters = DeadlineCounters()
+    deadline = AdDeadline(timeout_ms=20, counters=counters)
+
+    with pytest.raises(AdDeadlineExceeded) as exc_info:
+        await deadline.run(GEO, _sleep_then("NA", 1))
+
+    assert exc_info.value.stage == GEO
+    assert counters.snapshot()["overruns"][GEO] == 1
+
+
+@pytest.mark.asyncio
+async def test_later_stage_fails_fast_once_budget_is_spent():
+    counters = DeadlineCounters()
+    deadline = AdDeadline(timeout_ms=10, counters=counters)
+    await asyncio.sleep(0.02)
+
+    with pytest.raises(AdDeadlineExceeded):
+        await deadline.run(SELECTION, _sleep_then(None, 0))
+    with pytest.raises(AdDeadlineExceeded):
+        deadline.check(TOKENS)
+
+    assert counters.snapshot()["overruns"] == {GEO: 0, SELECTION: 1, TOKENS: 1}
@@ -0,0 +1,61 @@
+"""Unit tests for the per-listener ad request cache."""
+from __future__ import annotations
+
+import time
+
+from app.services.ad_request_cache import AdRequestCache, request_key
+from app.services.inventory_events import bump_inventory_version
+
+
+def _ad(n):
+    return {"ad_id": f"ad-{n}", "campaign_id": f"campaign-{n}"}
+
+
+def test_repeat_request_within_ttl_gets_same_ad():
+    cache = AdRequestCache(ttl_seconds=10, max_entries=10)
+    key = request_key("user-1", "Banner_Top", "NA", "Windhoek", None)
+    cache.put(key, _ad(1))
+
+    assert cache.get(request_key("user-1", "banner_top", "NA", "Windhoek", None)) == _ad(1)
+    assert cache.get(request_key("user-1", "banner_top", "ZA", "Windhoek", None)) is None
+    assert cache.get(request_key("user-2", "banner_top", "NA", "Windhoek", None)) is None
+
+
+def test_entries_expire_after_ttl():
+    cache = AdRequestCache(ttl_seconds=0.01, max_entries=10)
+    key = request_key("user-1", "banner_top")
+    cache.put(key, _ad(1))
+    time.sleep(0.02)
+
+    assert cache.get(key) is None
+    assert len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = AdRequestCache(ttl_seconds=10, max_entries=2)
+    first, second, third = (request_key(f"user-{n}", "banner_top") for n in range(3))
+    cache.put(first, _ad(1))
+    cache.put(second, _ad(2))
+    cache.get(first)
+    cache.put(third, _ad(3))
+
+    assert cache.get(second) is None
+    assert cache.get(first) == _ad(1)
+    assert cache.get(third) == _ad(3)
+
+
+def test_inventory_change_drops_cached_ads():
+    cache = AdRequestCache(ttl_seconds=10, max_entries=10)
+    key = request_key("user-1", "banner_top")
+    cache.put(key, _ad(1))
+    bump_inventory_version()
+
+    assert cache.get(key) is None
+
+
+def test_zero_ttl_disables_cache():
+    cache = AdRequestCache(ttl_seconds=0, max_entries=10)
+    key = request_key("user-1", "banner_top")
+    cache.put(key, _ad(1))
+
+    assert cache.get(key) is None
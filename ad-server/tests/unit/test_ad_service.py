@@ -0,0 +1,56 @@
+"""Unit tests for the legacy AdService (queries compiled, no database required)."""
+from __future__ import annotations
+
+from datetime import datetime
+from unittest.mock import Mock
+from uuid import uuid4
+
+from sqlalchemy.dialects import postgresql
+
+from app.services.ad_service import AdService, ImpressionRecord
+
+
+def _sql(query) -> str:
+    return str(query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+
+def test_eligible_creatives_query_is_one_statement_with_size_filter():
+    sql = _sql(AdService.eligible_creatives_query(datetime(2026, 1, 1), width=728, height=90))
+
+    assert sql.count("SELECT") == 1
+    assert "JOIN campaigns" in sql
+    assert "ad_creatives.image_width BETWEEN 582 AND 873" in sql
+    assert "ad_creatives.image_height BETWEEN 72 AND 108" in sql
+    assert "ORDER BY campaigns.priority DESC, random()" in sql
+
+
+def test_eligible_creatives_query_without_size_has_no_size_filter():
+    sql = _sql(AdService.eligible_creatives_query(datetime(2026, 1, 1)))
+
+    assert "image_width" not in sql.split("WHERE", 1)[1]
+
+
+def test_record_impressions_bulk_inserts_and_updates_each_campaign_once():
+    db = Mock()
+    first, second = uuid4(), uuid4()
+    records = [
+        ImpressionRecord(creative_id=uuid4(), campaign_id=first, user_id="user-1"),
+        ImpressionRecord(creative_id=uuid4(), campaign_id=first, user_id="user-2"),
+        ImpressionRecord(creative_id=uuid4(), campaign_id=second, user_id="user-3"),
+    ]
+
+    ids = AdService.record_impressions(db, records)
+
+    assert len(ids) == 3
+    insert_call, *update_calls = db.execute.call_args_list
+    assert len(insert_call.args[1]) == 3
+    assert len(update_calls) == 2
+    db.commit.assert_called_once()
+
+
+def test_record_impressions_with_nothing_to_write_skips_the_database():
+    db = Mock()
+
+    assert AdService.record_impressions(db, []) == []
+    db.execute.assert_not_called()
+    db.commit.assert_not_called()
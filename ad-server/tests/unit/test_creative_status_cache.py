@@ -0,0 +1,54 @@
+"""Unit tests for the tracking creative status cache."""
+from __future__ import annotations
+
+import time
+import uuid
+from types import SimpleNamespace
+
+from app.models.ad_creative import CreativeStatus
+from app.services.creative_status_cache import CreativeStatusCache
+from app.services.inventory_events import bump_inventory_version
+
+
+def _creative(status=CreativeStatus.ACTIVE):
+    return SimpleNamespace(
+        id=uuid.uuid4(), campaign_id=uuid.uuid4(), status=status, click_url="https://advertiser.com"
+    )
+
+
+def test_put_then_get_returns_state_without_orm_object():
+    cache = CreativeStatusCache(ttl_seconds=10, max_entries=10)
+    creative = _creative()
+
+    cache.put(creative)
+    state = cache.get(creative.id)
+
+    assert (state.id, state.campaign_id, state.status, state.click_url) == (
+        creative.id, creative.campaign_id, CreativeStatus.ACTIVE, "https://advertiser.com"
+    )
+    assert cache.get(uuid.uuid4()) is None
+    assert cache.stats == {"hits": 1, "misses": 1}
+
+
+def test_inventory_change_and_ttl_drop_entries():
+    cache = CreativeStatusCache(ttl_seconds=10, max_entries=10)
+    creative = _creative()
+    cache.put(creative)
+    bump_inventory_version()
+    assert cache.get(creative.id) is None
+
+    cache = CreativeStatusCache(ttl_seconds=0.01, max_entries=10)
+    cache.put(creative)
+    time.sleep(0.02)
+    assert cache.get(creative.id) is None
+
+
+def test_size_is_bounded_oldest_first():
+    cache = CreativeStatusCache(ttl_seconds=10, max_entries=2)
+    first, second, third = _creative(), _creative(), _creative()
+    for creative in (first, second, third):
+        cache.put(creative)
+
+    assert len(cache) == 2
+    assert cache.get(first.id) is None
+    assert cache.get(third.id) is not None
@@ -0,0 +1,176 @@
+"""Unit tests for the in-memory eligibility snapshot (no database required)."""
+from __future__ import annotations
+
+import asyncio
+import random
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from uuid import uuid4
+
+import pytest
+
+from app.models.ad_creative import CreativeStatus
+from app.models.campaign import CampaignStatus
+from app.services.eligibility_snapshot import EligibilityCache, build_snapshot
+from app.services.inventory_events import bump_inventory_version, inventory_version
+
+NOW = datetime(2026, 6, 1, 12, 0, 0)
+MAX_AGE = timedelta(seconds=30)
+
+
+def _creative(width=728, height=90, status=CreativeStatus.ACTIVE):
+    return SimpleNamespace(
+        id=uuid4(),
+        image_width=width,
+        image_height=height,
+        click_url="https://advertiser.example.org",
+        alt_text=None,
+        status=status,
+    )
+
+
+def _campaign(
+    priority=5,
+    countries=None,
+    states=None,
+    cities=None,
+    start=NOW - timedelta(days=1),
+    end=NOW + timedelta(days=1),
+    creatives=None,
+):
+    return SimpleNamespace(
+        id=uuid4(),
+        name="Campaign",
+        status=CampaignStatus.ACTIVE,
+        priority=priority,
+        start_date=start,
+        end_date=end,
+        impression_budget=1000,
+        impressions_served=0,
+        target_countries=countries,
+        target_states=states,
+        target_cities=cities,
+        creatives=creatives if creatives is not None else [_creative()],
+    )
+
+
+def test_buckets_by_placement_and_targeting():
+    worldwide = _campaign()
+    namibia = _campaign(countries=["NA"], creatives=[_creative(320, 50)])
+    snapshot = build_snapshot([worldwide, namibia], NOW, 0, MAX_AGE)
+
+    assert [e.campaign.id for e in snapshot.buckets[("banner_top", "worldwide", "")].entries] == [worldwide.id]
+    assert [e.campaign.id for e in snapshot.buckets[("events_modal", "country", "NA")].entries] == [namibia.id]
+    assert snapshot.pick("banner_top", None, now=NOW).campaign.id == worldwide.id
+    assert snapshot.pick("banner_top", "ZA", now=NOW).campaign.id == worldwide.id
+
+
+def test_unknown_country_never_sees_targeted_inventory():
+    snapshot = build_snapshot([_campaign(countries=["NA"])], NOW, 0, MAX_AGE)
+    assert snapshot.pick("banner_top", None, now=NOW) is None
+    assert snapshot.pick("banner_top", "na", now=NOW) is not None
+
+
+def test_campaign_targeting_country_and_city_is_not_double_weighted():
+    both = _campaign(priority=1, countries=["NA"], cities=["Windhoek"])
+    other = _campaign(priority=1)
+    snapshot = build_snapshot([both, other], NOW, 0, MAX_AGE)
+    rng = random.Random(7)
+
+    picks = [
+        snapshot.pick("banner_top", "NA", "Windhoek", now=NOW, rng=rng).campaign.id
+        for _ in range(2000)
+    ]
+    assert 0.4 < picks.count(both.id) / len(picks) < 0.6
+
+
+def test_cumulative_weights_follow_priority():
+    snapshot = build_snapshot([_campaign(priority=5), _campaign(priority=1)], NOW, 0, MAX_AGE)
+    assert snapshot.buckets[("banner_top", "worldwide", "")].cumulative_weights == (5, 6)
+
+
+def test_events_modal_keeps_only_best_fit_size():
+    mobile = _creative(320, 50)
+    campaign = _campaign(creatives=[_creative(728, 90), mobile])
+    snapshot = build_snapshot([campaign], NOW, 0, MAX_AGE)
+    entry = snapshot.pick("events_modal", now=NOW)
+    assert [c.id for c in entry.creatives] == [mobile.id]
+
+
+def test_valid_until_is_next_start_or_end_boundary():
+    soon = NOW + timedelta(seconds=10)
+    upcoming = _campaign(start=soon, end=NOW + timedelta(days=2))
+    snapshot = build_snapshot([_campaign(), upcoming], NOW, 0, MAX_AGE)
+    assert snapshot.valid_until == soon
+    assert snapshot.pick("banner_top", now=NOW).campaign.id != upcoming.id
+
+
+def test_cache_rebuilds_on_inventory_change_and_boundary():
+    loads = []
+
+    def loader(db, now):
+        loads.append(now)
+        return [_campaign()]
+
+    cache = EligibilityCache(loader=loader, max_age_seconds=30)
+    first = cache.get(None, NOW)
+    assert cache.get(None, NOW + timedelta(seconds=5)) is first
+    assert len(loads) == 1
+
+    bump_inventory_version()
+    second = cache.get(None, NOW + timedelta(seconds=6))
+    assert second is not first
+    assert second.version == inventory_version()
+
+    cache.get(None, NOW + timedelta(seconds=40))
+    assert len(loads) == 3
+
+
+class _NullSession:
+    async def __aenter__(self):
+        return None
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+@pytest.mark.asyncio
+async def test_async_rebuild_survives_caller_timeout_and_serves_stale_snapshot():
+    release = asyncio.Event()
+    loads = []
+
+    async def loader(db, now):
+        loads.append(now)
+        if len(loads) > 1:
+            await release.wait()
+        return [_campaign()]
+
+    cache = EligibilityCache(
+        max_age_seconds=30, async_loader=loader, async_session_factory=_NullSession
+    )
+    first = await cache.get_async(NOW)
+
+    bump_inventory_version()
+    # A stale snapshot is served straight away while one rebuild runs in the background.
+    assert await cache.get_async(NOW + timedelta(seconds=1)) is first
+    assert await cache.get_async(NOW + timedelta(seconds=2)) is first
+    await asyncio.sleep(0)
+    assert len(loads) == 2
+
+    cache.invalidate()
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(cache.get_async(NOW + timedelta(seconds=3)), timeout=0.01)
+
+    release.set()
+    rebuilt = await cache.get_async(NOW + timedelta(seconds=4))
+    assert rebuilt is not first
+    assert rebuilt.version == inventory_version()
+    assert len(loads) == 2
+
+
+def test_fully_reserved_budget_stays_in_snapshot():
+    # impressions_served counts quota leased to workers; the ledger decides exhaustion
+    campaign = _campaign()
+    campaign.impressions_served = campaign.impression_budget
+    snapshot = build_snapshot([campaign], NOW, 0, MAX_AGE)
+    assert snapshot.pick("banner_top", now=NOW).campaign.id == campaign.id
@@ -0,0 +1,127 @@
+"""Unit tests for the Parquet event archive (no database required)."""
+from __future__ import annotations
+
+import uuid
+from datetime import date, datetime
+from pathlib import Path
+
+import pytest
+
+from app.maintenance import event_archive
+from app.maintenance.event_archive import (
+    ARCHIVE_TABLES,
+    DayPartitionedBuffer,
+    export_event_archive,
+    export_table,
+    partition_path,
+)
+
+
+def test_partition_path_is_hive_style():
+    path = partition_path(Path("/archive"), "clicks", date(2026, 3, 4), "20260305T000000")
+    assert path == Path("/archive/clicks/day=2026-03-04/part-20260305T000000.parquet")
+
+
+def test_buffer_writes_full_batches_and_closes_each_passed_day():
+    events = []
+    buffer = DayPartitionedBuffer(
+        lambda day, rows: events.append(("write", day, list(rows))),
+        batch_rows=2,
+        close_day=lambda day: events.append(("close", day)),
+    )
+    monday, tuesday = date(2026, 3, 2), date(2026, 3, 3)
+    for i, day in enumerate([monday, monday, monday, tuesday]):
+        buffer.add(day, (i,))
+    assert events == [
+        ("write", monday, [(0,), (1,)]),
+        ("write", monday, [(2,)]),
+        ("close", monday),
+    ]
+
+    buffer.flush()
+    assert events[3:] == [("write", tuesday, [(3,)]), ("close", tuesday)]
+    assert buffer.total == 4
+
+
+def test_buffer_rejects_rows_out_of_day_order():
+    buffer = DayPartitionedBuffer(lambda day, rows: None, batch_rows=10)
+    buffer.add(date(2026, 3, 3), (0,))
+    with pytest.raises(ValueError):
+        buffer.add(date(2026, 3, 2), (1,))
+
+
+class _RowsDb:
+    def __init__(self, rows):
+        self.rows = rows
+        self.statements = []
+
+    def execute(self, stmt):
+        self.statements.append(stmt)
+        return iter(self.rows)
+
+
+def test_export_table_writes_one_parquet_file_per_day(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    rows = []
+    for day, count in ((2, 3), (3, 2)):
+        for hour in range(count):
+            at = datetime(2026, 3, day, hour)
+            rows.append((uuid.uuid4(), uuid.uuid4(), uuid.uuid4(), f"user-{day}-{hour}", at, at))
+    db = _RowsDb(rows)
+    until = datetime(2026, 3, 4)
+
+    result = export_table(db, ARCHIVE_TABLES["clicks"], tmp_path, None, until, batch_rows=2)
+
+    assert "ORDER BY clicks.timestamp" in str(db.statements[0])
+    assert result.rows == 5
+    assert result.files == [
+        str(partition_path(tmp_path, "clicks", date(2026, 3, day), "20260304T000000"))
+        for day in (2, 3)
+    ]
+    first_day = pq.read_table(result.files[0])
+    assert first_day.num_rows == 3
+    assert first_day.column("user_id").to_pylist() == ["user-2-0", "user-2-1", "user-2-2"]
+    assert first_day.column("id").to_pylist()[0] == str(rows[0][0])
+    assert pq.ParquetFile(result.files[0]).metadata.num_row_groups == 2
+    assert pq.read_table(result.files[1]).num_rows == 2
+
+
+class _Mark:
+    def __init__(self, watermark):
+        self.watermark = watermark
+        self.updated_at = None
+
+
+class _Db:
+    def __init__(self):
+        self.marks = {}
+        self.commits = 0
+
+    def commit(self):
+        self.commits += 1
+
+
+def test_incremental_export_advances_each_watermark(monkeypatch):
+    db = _Db()
+    db.marks["archive:clicks"] = _Mark(datetime(2026, 3, 1))
+    exported = []
+
+    def _lock(db, name):
+        return db.marks.setdefault(name, _Mark(None))
+
+    def _export(db, table, root, since, until):
+        exported.append((table.name, since))
+        return event_archive.TableArchiveResult(table.name, since, until, rows=1)
+
+    monkeypatch.setattr(event_archive, "lock_watermark", _lock)
+    monkeypatch.setattr(event_archive, "export_table", _export)
+    until = datetime(2026, 3, 2)
+    summary = export_event_archive(db, Path("/archive"), until=until)
+
+    assert summary.incremental
+    assert exported == [
+        ("impressions", None),
+        ("clicks", datetime(2026, 3, 1)),
+        ("song_like_records", None),
+    ]
+    assert all(db.marks[f"archive:{name}"].watermark == until for name in ARCHIVE_TABLES)
@@ -0,0 +1,96 @@
+"""Unit tests for the write-behind tracking event queue."""
+from __future__ import annotations
+
+import uuid
+from datetime import datetime
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from app.services.event_ingestion import CLICK, IMPRESSION, EventIngestionQueue, TrackingEvent
+
+
+def _event(kind=IMPRESSION):
+    return TrackingEvent(
+        kind=kind,
+        ad_creative_id=uuid.uuid4(),
+        campaign_id=uuid.uuid4(),
+        user_id="user-1",
+        timestamp=datetime.utcnow(),
+        city="Windhoek" if kind == IMPRESSION else None,
+    )
+
+
+def _session_factory(fail_times=0):
+    db = MagicMock()
+    calls = {"n": 0}
+
+    async def execute(statement, rows):
+        calls["n"] += 1
+        if calls["n"] <= fail_times:
+            raise RuntimeError("database unavailable")
+
+    db.execute = AsyncMock(side_effect=execute)
+    db.commit = AsyncMock()
+    db.rollback = AsyncMock()
+    factory = MagicMock()
+    factory.return_value.__aenter__ = AsyncMock(return_value=db)
+    factory.return_value.__aexit__ = AsyncMock(return_value=False)
+    return factory, db
+
+
+@pytest.mark.asyncio
+async def test_batch_is_written_with_one_insert_per_table():
+    factory, db = _session_factory()
+    queue = EventIngestionQueue(factory, max_size=100, batch_size=10, flush_interval=0.01)
+    for kind in (IMPRESSION, IMPRESSION, CLICK):
+        assert queue.accept(_event(kind))
+
+    assert await queue.flush_once() == 3
+
+    (impression_stmt, impression_rows), (click_stmt, click_rows) = (
+        call.args for call in db.execute.await_args_list
+    )
+    assert impression_stmt.table.name == "impressions" and len(impression_rows) == 2
+    assert click_stmt.table.name == "clicks" and len(click_rows) == 1
+    assert "city" not in click_rows[0]
+    db.commit.assert_awaited_once()
+    assert queue.stats["written"] == 3
+
+
+@pytest.mark.asyncio
+async def test_batches_are_capped_at_batch_size():
+    factory, _ = _session_factory()
+    queue = EventIngestionQueue(factory, max_size=100, batch_size=2, flush_interval=0.01)
+    for _ in range(5):
+        queue.accept(_event())
+
+    assert [await queue.flush_once() for _ in range(4)] == [2, 2, 1, 0]
+
+
+@pytest.mark.asyncio
+async def test_full_queue_rejects_events():
+    factory, _ = _session_factory()
+    queue = EventIngestionQueue(factory, max_size=2, batch_size=10, flush_interval=0.01)
+
+    assert [queue.accept(_event()) for _ in range(3)] == [True, True, False]
+    assert queue.stats["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_is_retried_and_drained():
+    factory, db = _session_factory(fail_times=1)
+    queue = EventIngestionQueue(factory, max_size=10, batch_size=10, flush_interval=0.01)
+    queue.accept(_event())
+    queue.accept(_event())
+
+    assert await queue.flush_once() == 0
+    assert queue.pending() == 2
+    db.rollback.assert_awaited_once()
+
+    await queue.drain()
+
+    assert queue.pending() == 0
+    assert queue.stats == {
+        "accepted": 2, "rejected": 0, "written": 2, "failed_flushes": 1, "spooled": 0,
+    }
@@ -0,0 +1,98 @@
+"""Unit tests for monthly event partition maintenance."""
+from __future__ import annotations
+
+from datetime import datetime
+
+from app.maintenance import event_partitions
+from app.maintenance.event_partitions import (
+    add_months,
+    create_partition_sql,
+    maintain_event_partitions,
+    partition_month,
+    partition_name,
+)
+
+
+def test_month_arithmetic_and_names():
+    assert add_months(datetime(2026, 11, 1), 3) == datetime(2027, 2, 1)
+    assert add_months(datetime(2026, 1, 1), -1) == datetime(2025, 12, 1)
+    assert partition_name("clicks", datetime(2026, 3, 1)) == "clicks_p202603"
+    assert partition_month("clicks_p202603") == datetime(2026, 3, 1)
+    assert partition_month("clicks_default") is None
+
+
+def test_create_partition_sql_bounds_one_month():
+    sql = create_partition_sql("impressions", datetime(2026, 12, 1))
+    assert "impressions_p202612 PARTITION OF impressions" in sql
+    assert "FROM ('2026-12-01') TO ('2027-01-01')" in sql
+
+
+class _Result(list):
+    def scalar(self):
+        return self[0][0] if self else None
+
+
+class _Db:
+    def __init__(self, partitions, default_rows=0):
+        self.partitions = partitions
+        self.default_rows = default_rows
+        self.executed = []
+
+    def execute(self, statement, params=None):
+        sql = str(statement)
+        self.executed.append(sql)
+        if sql.startswith("SELECT count(*)"):
+            return _Result([(self.default_rows,)])
+        return _Result((name,) for name in self.partitions.get((params or {}).get("table"), []))
+
+    def commit(self):
+        pass
+
+
+def _run(monkeypatch, watermark, default_rows=0, **kwargs):
+    monkeypatch.setattr(event_partitions, "get_watermark", lambda db: watermark)
+    db = _Db({
+        "impressions": ["impressions_default", "impressions_p202601", "impressions_p202602",
+                        "impressions_p202609", "impressions_p202610"],
+        "clicks": ["clicks_p202610"],
+    }, default_rows=default_rows)
+    summary = maintain_event_partitions(
+        db, now=datetime(2026, 10, 16), premake_months=1, retention_months=6, **kwargs
+    )
+    return db, summary
+
+
+def test_premakes_and_detaches_rolled_up_partitions(monkeypatch):
+    db, summary = _run(monkeypatch, datetime(2026, 2, 10), dry_run=False)
+
+    assert summary.created == ["impressions_p202611", "clicks_p202611"]
+    assert summary.detached == ["impressions_p202601"]
+    # February is past retention but not fully rolled up yet
+    assert summary.held_for_rollup == ["impressions_p202602"]
+    assert any("DETACH PARTITION impressions_p202601" in sql for sql in db.executed)
+
+
+def test_dry_run_changes_nothing(monkeypatch):
+    db, summary = _run(monkeypatch, datetime(2026, 10, 1), drop_detached=True)
+
+    assert summary.detached == summary.dropped == ["impressions_p202601", "impressions_p202602"]
+    assert not any(sql.startswith(("CREATE", "ALTER", "DROP")) for sql in db.executed)
+
+
+def test_rows_in_default_are_moved_into_the_new_partition(monkeypatch):
+    db, summary = _run(monkeypatch, datetime(2026, 2, 10), default_rows=3, dry_run=False)
+
+    # Only impressions has a DEFAULT partition in this fixture
+    assert summary.created == ["impressions_p202611", "clicks_p202611"]
+    assert summary.moved_from_default == ["impressions_p202611"]
+    statements = [sql for sql in db.executed if sql.startswith(("CREATE", "WITH", "ALTER"))]
+    assert statements[:3] == [
+        "CREATE TABLE impressions_p202611 "
+        "(LIKE impressions INCLUDING DEFAULTS INCLUDING CONSTRAINTS)",
+        "WITH moved AS (DELETE FROM impressions_default "
+        "WHERE timestamp >= '2026-11-01' AND timestamp < '2026-12-01' RETURNING *) "
+        "INSERT INTO impressions_p202611 SELECT * FROM moved",
+        "ALTER TABLE impressions ATTACH PARTITION impressions_p202611 "
+        "FOR VALUES FROM ('2026-11-01') TO ('2026-12-01')",
+    ]
+    assert any("clicks_p202611 PARTITION OF clicks" in sql for sql in statements)
@@ -0,0 +1,93 @@
+"""Unit tests for hourly event rollups and the report counts read from them."""
+from __future__ import annotations
+
+from datetime import datetime
+
+from sqlalchemy.dialects import postgresql
+
+from app.models.click import Click
+from app.models.impression import Impression
+from app.services.event_rollups import (
+    EventCounts,
+    _raw_condition,
+    bucket_count,
+    bucket_floor,
+    bucket_starts,
+    hour_ceil,
+    hour_floor,
+    rollup_statement,
+    total_counts,
+)
+
+
+def _sql(clause) -> str:
+    return str(clause.compile(dialect=postgresql.dialect()))
+
+
+def test_hour_floor_and_ceil():
+    value = datetime(2026, 3, 4, 10, 25, 7)
+    assert hour_floor(value) == datetime(2026, 3, 4, 10)
+    assert hour_ceil(value) == datetime(2026, 3, 4, 11)
+    on_hour = datetime(2026, 3, 4, 10)
+    assert hour_ceil(on_hour) == on_hour
+
+
+def test_event_counts_ctr_and_totals():
+    counts = {
+        ("c1", "a"): EventCounts(impressions=150, clicks=3),
+        ("c1", "b"): EventCounts(impressions=50, clicks=1),
+    }
+    total = total_counts(counts)
+    assert (total.impressions, total.clicks) == (200, 4)
+    assert total.click_through_rate == 2.0
+    assert EventCounts().click_through_rate == 0.0
+
+
+def test_rollup_statement_adds_counts_on_conflict():
+    sql = _sql(rollup_statement(Click, "clicks", datetime(2026, 3, 4), datetime(2026, 3, 5)))
+    assert "INSERT INTO event_hourly_rollups" in sql
+    assert "date_trunc" in sql
+    assert "ON CONFLICT (hour, campaign_id, ad_creative_id) DO UPDATE" in sql
+    assert "clicks = (event_hourly_rollups.clicks + excluded.clicks)" in sql
+    assert "clicks.created_at >=" in sql
+
+
+def test_raw_condition_without_watermark_reads_whole_range():
+    start, end = datetime(2026, 3, 4, 10, 30), datetime(2026, 3, 5, 8, 15)
+    sql = _sql(_raw_condition(Impression, start, end, hour_ceil(start), hour_floor(end), None))
+    assert "created_at" not in sql
+    assert "impressions.timestamp >=" in sql and "impressions.timestamp <=" in sql
+
+
+def test_raw_condition_with_watermark_reads_edges_and_new_rows():
+    start, end = datetime(2026, 3, 4, 10, 30), datetime(2026, 3, 5, 8, 15)
+    watermark = datetime(2026, 3, 5, 9)
+    clause = _raw_condition(Impression, start, end, hour_ceil(start), hour_floor(end), watermark)
+    sql = _sql(clause)
+    assert "impressions.created_at >=" in sql
+    assert sql.count(" OR ") == 2
+
+
+def test_bucket_floor_matches_date_trunc():
+    value = datetime(2026, 3, 5, 10, 25)  # a Thursday
+    assert bucket_floor(value, "hour") == datetime(2026, 3, 5, 10)
+    assert bucket_floor(value, "day") == datetime(2026, 3, 5)
+    assert bucket_floor(value, "week") == datetime(2026, 3, 2)  # Monday
+
+
+def test_bucket_starts_cover_the_range():
+    starts = bucket_starts(datetime(2026, 3, 5, 22, 30), datetime(2026, 3, 6, 1, 0), "hour")
+    assert starts == [
+        datetime(2026, 3, 5, 22),
+        datetime(2026, 3, 5, 23),
+        datetime(2026, 3, 6, 0),
+        datetime(2026, 3, 6, 1),
+    ]
+    assert len(bucket_starts(datetime(2026, 3, 5), datetime(2026, 3, 18), "week")) == 3
+
+
+def test_bucket_count_matches_bucket_starts():
+    start = datetime(2026, 3, 5, 22, 30)
+    for end in (start, datetime(2026, 3, 6, 1, 0), datetime(2026, 3, 19, 0, 0), datetime(2026, 5, 1)):
+        for bucket in ("hour", "day", "week"):
+            assert bucket_count(start, end, bucket) == len(bucket_starts(start, end, bucket))
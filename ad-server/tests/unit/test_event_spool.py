@@ -0,0 +1,147 @@
+"""Unit tests for the durable tracking event spool and its replay."""
+from __future__ import annotations
+
+import importlib.util
+import sys
+import uuid
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from app.services import event_spool
+from app.services.event_ingestion import CLICK, IMPRESSION, EventIngestionQueue, TrackingEvent
+from app.services.event_spool import EventSpool, SpoolLockedError, claim_spool, encode_record
+from tests.unit.test_event_ingestion import _session_factory
+
+
+def _event(kind=IMPRESSION):
+    return TrackingEvent(
+        kind=kind,
+        ad_creative_id=uuid.uuid4(),
+        campaign_id=uuid.uuid4(),
+        user_id="user-1",
+        timestamp=datetime.utcnow(),
+        city="Windhoek" if kind == IMPRESSION else None,
+    )
+
+
+def test_events_round_trip_in_order(tmp_path):
+    spool = EventSpool(str(tmp_path))
+    events = [_event(IMPRESSION), _event(CLICK), _event(IMPRESSION)]
+    spool.append(events[:2])
+    spool.append(events[2:], sync=False)
+
+    path = spool.oldest_segment()
+
+    assert spool.read_segment(path) == events
+    spool.remove_segment(path, replayed=3)
+    assert not spool.pending()
+    assert not path.exists()
+
+
+def test_segments_roll_over_and_leftovers_are_replayed_first(tmp_path):
+    record_size = len(encode_record(_event()))
+    spool = EventSpool(str(tmp_path), segment_bytes=record_size * 2)
+    spool.append([_event() for _ in range(2)])
+    spool.append([_event()])
+    assert spool.segments() == 2
+    spool.close()
+
+    restarted = EventSpool(str(tmp_path), segment_bytes=record_size * 2)
+    restarted.append([_event()])
+
+    names = [p.name for p in sorted(tmp_path.glob("*.seg"))]
+    assert names == ["000000000001.seg", "000000000002.seg", "000000000003.seg"]
+    assert restarted.oldest_segment().name == "000000000001.seg"
+
+
+def test_each_process_claims_its_own_spool_directory(tmp_path):
+    first = claim_spool(str(tmp_path))
+    second = claim_spool(str(tmp_path))
+    assert first.directory != second.directory
+    with pytest.raises(SpoolLockedError):
+        EventSpool(str(first.directory))
+
+    first.close()
+    # A released slot (and its leftover segments) is picked up again
+    assert claim_spool(str(tmp_path)).directory == first.directory
+
+
+def test_spool_locks_with_msvcrt_where_fcntl_is_missing(tmp_path, monkeypatch):
+    locks = []
+    msvcrt = SimpleNamespace(LK_NBLCK=2, locking=lambda fd, mode, nbytes: locks.append(mode))
+    monkeypatch.setitem(sys.modules, "fcntl", None)
+    monkeypatch.setitem(sys.modules, "msvcrt", msvcrt)
+    # A separate copy of the module, imported as it would be on Windows
+    spec = importlib.util.spec_from_file_location("event_spool_windows", event_spool.__file__)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    spool = module.EventSpool(str(tmp_path))
+    spool.append([_event()])
+    assert locks == [msvcrt.LK_NBLCK]
+    spool.close()
+
+
+def test_missing_segment_is_dropped_instead_of_retried(tmp_path):
+    spool = EventSpool(str(tmp_path))
+    spool.append([_event()])
+    path = spool.oldest_segment()
+    path.unlink()
+
+    assert spool.read_segment(path) == []
+    spool.remove_segment(path)
+    assert not spool.pending()
+
+
+def test_reading_stops_at_corrupt_or_truncated_record(tmp_path):
+    spool = EventSpool(str(tmp_path))
+    good = _event()
+    spool.append([good, _event()])
+    path = spool.oldest_segment()
+    data = bytearray(path.read_bytes())
+    data[-3] ^= 0xFF  # flip bits in the second record's payload
+    path.write_bytes(bytes(data) + b"\x00\x00")
+
+    assert spool.read_segment(path) == [good]
+    assert spool.stats["corrupt_records"] == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_flush_spools_and_replay_writes_idempotently(tmp_path):
+    factory, db = _session_factory(fail_times=1)
+    spool = EventSpool(str(tmp_path))
+    queue = EventIngestionQueue(factory, max_size=100, batch_size=10, flush_interval=0.01, spool=spool)
+    first, second = _event(), _event()
+    queue.accept(first)
+
+    assert await queue.flush_once() == 1
+    assert spool.pending() and queue._retry == []
+
+    # Later events queue up behind the spool to keep their order
+    queue.accept(second)
+    assert await queue.flush_once() == 1
+    assert db.execute.await_count == 1
+
+    assert await queue.replay_spool() == 2
+    statement, rows = db.execute.await_args.args
+    assert [row["id"] for row in rows] == [first.id, second.id]
+    assert "ON CONFLICT" in str(statement.compile(dialect=postgresql.dialect()))
+    assert not spool.pending()
+    assert queue.stats["spooled"] == 2
+
+
+def test_full_queue_overflows_to_spool(tmp_path):
+    factory, _ = _session_factory()
+    spool = EventSpool(str(tmp_path))
+    queue = EventIngestionQueue(factory, max_size=1, spool=spool)
+
+    assert queue.accept(_event())
+    assert queue.accept(_event())
+
+    assert queue.stats["rejected"] == 0
+    assert queue.stats["spooled"] == 1
+    assert spool.pending()
+
@@ -0,0 +1,48 @@
+"""Unit tests for the per-IP geo cache and geo handling under the ad deadline."""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.api.v1.endpoints import ads
+from app.schemas.ad_serving import AdRequestLocation
+from app.services import geoip
+from app.services.ad_deadline import AdDeadline, DeadlineCounters
+from app.services.geoip import GeoCache, GeoLocation
+
+
+@pytest.mark.asyncio
+async def test_abandoned_lookup_still_fills_the_cache(monkeypatch):
+    calls = []
+
+    async def _slow_lookup(ip):
+        calls.append(ip)
+        await asyncio.sleep(0.05)
+        return GeoLocation(country="NA", source="ip-api")
+
+    monkeypatch.setattr(geoip, "lookup_geo_from_ip", _slow_lookup)
+    cache = GeoCache(ttl_seconds=60, miss_ttl_seconds=5, max_entries=10)
+
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(cache.lookup("41.182.0.1"), timeout=0.01)
+    # A concurrent request joins the lookup already in flight
+    assert (await cache.lookup("41.182.0.1")).country == "NA"
+    assert (await cache.lookup("41.182.0.1")).country == "NA"
+    assert calls == ["41.182.0.1"]
+
+
+@pytest.mark.asyncio
+async def test_geo_overrun_continues_with_client_location(monkeypatch):
+    async def _slow_geo(request):
+        await asyncio.sleep(1)
+        return GeoLocation(country="ZA", source="ip-api")
+
+    monkeypatch.setattr(ads, "resolve_request_geo", _slow_geo)
+    counters = DeadlineCounters()
+    deadline = AdDeadline(timeout_ms=20, counters=counters)
+    location = AdRequestLocation(country="NA", city="Windhoek")
+
+    geo = await ads._resolve_geo(SimpleNamespace(), location, deadline)
+
+    assert geo == ("NA", "Windhoek", None)
+    assert counters.snapshot()["overruns"]["geo"] == 1
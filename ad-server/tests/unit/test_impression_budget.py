@@ -0,0 +1,117 @@
+"""Unit tests for lease-based impression budget counters (file-backed SQLite)."""
+from __future__ import annotations
+
+import threading
+import uuid
+
+import pytest
+from sqlalchemy import bindparam, create_engine, text
+from sqlalchemy.orm import sessionmaker
+
+from app.models.ad_creative import AdCreative
+from app.models.campaign import Campaign
+from app.services.impression_budget import ImpressionBudgetLedger
+
+LEASE_SIZE = 7
+BUDGET = 100
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'budget.db'}",
+        connect_args={"check_same_thread": False, "timeout": 30},
+    )
+    with engine.begin() as conn:
+        # Only the columns the ledger touches (JSONB targeting columns do not exist in SQLite).
+        conn.execute(text(
+            "CREATE TABLE campaigns (id CHAR(32) PRIMARY KEY, impression_budget INTEGER NOT NULL, "
+            "impressions_served INTEGER NOT NULL, last_served_at DATETIME, updated_at DATETIME)"
+        ))
+        conn.execute(text(
+            "CREATE TABLE ad_creatives (id CHAR(32) PRIMARY KEY, times_served INTEGER NOT NULL, "
+            "updated_at DATETIME)"
+        ))
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def _by_id(sql, model):
+    # Bind ids through the ORM column type so they match whatever the ledger writes,
+    # even when another test module has swapped UUID columns for SQLite strings.
+    return text(sql).bindparams(bindparam("id", type_=model.__table__.c.id.type))
+
+
+def _insert(session_factory, budget=BUDGET):
+    campaign_id, creative_id = uuid.uuid4(), uuid.uuid4()
+    db = session_factory()
+    db.execute(
+        _by_id("INSERT INTO campaigns VALUES (:id, :budget, 0, NULL, NULL)", Campaign),
+        {"id": campaign_id, "budget": budget},
+    )
+    db.execute(_by_id("INSERT INTO ad_creatives VALUES (:id, 0, NULL)", AdCreative), {"id": creative_id})
+    db.commit()
+    db.close()
+    return campaign_id, creative_id
+
+
+def _counters(session_factory, campaign_id, creative_id):
+    db = session_factory()
+    served = db.execute(
+        _by_id("SELECT impressions_served FROM campaigns WHERE id = :id", Campaign), {"id": campaign_id}
+    ).scalar()
+    times = db.execute(
+        _by_id("SELECT times_served FROM ad_creatives WHERE id = :id", AdCreative), {"id": creative_id}
+    ).scalar()
+    db.close()
+    return served, times
+
+
+def test_lease_reserves_in_chunks_and_flush_returns_unused(session_factory):
+    campaign_id, creative_id = _insert(session_factory)
+    ledger = ImpressionBudgetLedger(session_factory, lease_size=LEASE_SIZE)
+
+    for _ in range(3):
+        assert ledger.consume(campaign_id, creative_id)
+    assert _counters(session_factory, campaign_id, creative_id) == (LEASE_SIZE, 0)
+
+    ledger.release_all()
+    assert _counters(session_factory, campaign_id, creative_id) == (3, 3)
+
+
+def test_consume_stops_at_budget(session_factory):
+    campaign_id, creative_id = _insert(session_factory, budget=10)
+    ledger = ImpressionBudgetLedger(session_factory, lease_size=LEASE_SIZE)
+
+    results = [ledger.consume(campaign_id, creative_id) for _ in range(15)]
+
+    assert results.count(True) == 10
+    assert not ledger.may_serve(type("C", (), {"id": campaign_id})())
+
+
+def test_concurrent_workers_never_over_deliver(session_factory):
+    """Several workers (ledgers) with many threads each: total served stays within budget."""
+    campaign_id, creative_id = _insert(session_factory)
+    ledgers = [ImpressionBudgetLedger(session_factory, lease_size=LEASE_SIZE) for _ in range(3)]
+    served = []
+    served_lock = threading.Lock()
+
+    def hammer(ledger):
+        count = sum(1 for _ in range(60) if ledger.consume(campaign_id, creative_id))
+        with served_lock:
+            served.append(count)
+
+    threads = [threading.Thread(target=hammer, args=(ledger,)) for ledger in ledgers for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    total = sum(served)
+    assert total <= BUDGET
+    # Quota still leased to a worker is the only budget that can go unspent.
+    assert total >= BUDGET - LEASE_SIZE * len(ledgers)
+
+    for ledger in ledgers:
+        ledger.release_all()
+    assert _counters(session_factory, campaign_id, creative_id) == (total, total)
@@ -0,0 +1,63 @@
+"""Unit tests for the per-listener impression de-dup window."""
+from __future__ import annotations
+
+import uuid
+
+from app.services.impression_dedup import ImpressionDeduper
+
+
+class _Clock:
+    def __init__(self, now: float = 100.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_repeat_within_window_is_suppressed_and_counted():
+    clock = _Clock()
+    deduper = ImpressionDeduper(window_seconds=30, max_entries=100, clock=clock)
+    creative = uuid.uuid4()
+
+    assert not deduper.is_duplicate("user-1", creative)
+    deduper.record("user-1", creative)
+
+    assert deduper.is_duplicate("user-1", creative)
+    assert not deduper.is_duplicate("user-2", creative)
+    assert not deduper.is_duplicate("user-1", uuid.uuid4())
+    clock.now += 30
+    assert not deduper.is_duplicate("user-1", creative)
+    assert deduper.stats()["suppressed"] == 1
+
+
+def test_window_is_not_extended_by_suppressed_repeats():
+    clock = _Clock()
+    deduper = ImpressionDeduper(window_seconds=30, max_entries=100, clock=clock)
+    creative = uuid.uuid4()
+    deduper.record("user-1", creative)
+
+    clock.now += 20
+    assert deduper.is_duplicate("user-1", creative)
+    clock.now += 15
+    assert not deduper.is_duplicate("user-1", creative)
+
+
+def test_entries_are_bounded_and_pruned_by_age():
+    clock = _Clock()
+    deduper = ImpressionDeduper(window_seconds=30, max_entries=2, clock=clock)
+    creatives = [uuid.uuid4() for _ in range(3)]
+    for creative in creatives:
+        deduper.record("user-1", creative)
+    assert len(deduper) == 2
+    assert not deduper.is_duplicate("user-1", creatives[0])
+
+    clock.now += 60
+    deduper.record("user-2", creatives[0])
+    assert len(deduper) == 1
+
+
+def test_zero_window_disables_dedup():
+    deduper = ImpressionDeduper(window_seconds=0, max_entries=10)
+    creative = uuid.uuid4()
+    deduper.record("user-1", creative)
+    assert not deduper.is_duplicate("user-1", creative)
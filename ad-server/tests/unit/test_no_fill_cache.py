@@ -0,0 +1,60 @@
+"""Unit tests for the no-fill negative cache and its periodic report."""
+from __future__ import annotations
+
+import logging
+import time
+from datetime import datetime, timedelta
+from unittest.mock import Mock, patch
+
+from app.services.inventory_events import bump_inventory_version
+from app.services.no_fill_cache import NoFillCache, log_no_fill_report
+
+
+def test_recorded_no_fill_is_remembered_per_placement_and_country():
+    cache = NoFillCache(ttl_seconds=10)
+    cache.record("banner_top", "na")
+
+    assert cache.is_empty("Banner_Top", "NA")
+    assert not cache.is_empty("banner_top", "ZA")
+    assert not cache.is_empty("events_modal", "NA")
+
+
+def test_no_fill_expires_and_respects_snapshot_boundary():
+    cache = NoFillCache(ttl_seconds=0.01)
+    cache.record("banner_top", "NA")
+    time.sleep(0.02)
+    assert not cache.is_empty("banner_top", "NA")
+
+    cache = NoFillCache(ttl_seconds=10)
+    cache.record("banner_top", "NA", valid_until=datetime.utcnow() - timedelta(seconds=1))
+    assert not cache.is_empty("banner_top", "NA")
+
+
+def test_inventory_change_and_uncacheable_answers_are_not_remembered():
+    cache = NoFillCache(ttl_seconds=10)
+    cache.record("banner_top", "NA")
+    bump_inventory_version()
+    assert not cache.is_empty("banner_top", "NA")
+
+    cache.record("banner_top", "ZA", cacheable=False)
+    assert not cache.is_empty("banner_top", "ZA")
+
+
+def test_report_logs_counts_once_with_active_campaign_count(caplog):
+    cache = NoFillCache(ttl_seconds=10)
+    cache.record("banner_top", "NA")
+    cache.is_empty("banner_top", "NA")
+    cache.record("events_modal", None, cacheable=False)
+    session_factory = Mock()
+
+    with patch("app.services.no_fill_cache.count_active_campaigns", return_value=3):
+        with caplog.at_level(logging.INFO, logger="app.services.no_fill_cache"):
+            log_no_fill_report(cache, session_factory)
+            log_no_fill_report(cache, session_factory)
+
+    assert len(caplog.records) == 1
+    message = caplog.records[0].getMessage()
+    assert "3 total" in message
+    assert "banner_top/NA=2" in message
+    assert "Active campaigns in DB: 3" in message
+    session_factory.return_value.close.assert_called_once()
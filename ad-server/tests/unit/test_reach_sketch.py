@@ -0,0 +1,41 @@
+"""Unit tests for the HyperLogLog unique-reach sketches."""
+from __future__ import annotations
+
+import pytest
+
+from app.services.reach_sketch import HyperLogLog
+
+
+def _listeners(start: int, stop: int) -> list[str]:
+    return [f"listener-{i}" for i in range(start, stop)]
+
+
+def test_small_counts_are_nearly_exact():
+    sketch = HyperLogLog().update(_listeners(0, 100))
+    sketch.update(_listeners(0, 100))  # repeats do not count
+    assert abs(sketch.estimate() - 100) <= 2
+    assert HyperLogLog().estimate() == 0
+
+
+def test_large_count_within_error_bound():
+    sketch = HyperLogLog().update(_listeners(0, 50_000))
+    assert abs(sketch.estimate() - 50_000) / 50_000 < 0.05
+
+
+def test_days_merge_to_union():
+    monday = HyperLogLog().update(_listeners(0, 6_000))
+    tuesday = HyperLogLog().update(_listeners(4_000, 10_000))
+    union = HyperLogLog().merge(monday).merge(tuesday)
+    assert abs(union.estimate() - 10_000) / 10_000 < 0.05
+
+
+def test_round_trip_is_compact():
+    sketch = HyperLogLog().update(_listeners(0, 300))
+    data = sketch.to_bytes()
+    assert len(data) < sketch.size
+    assert HyperLogLog.from_bytes(data).registers == sketch.registers
+
+
+def test_merge_rejects_other_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(12).merge(HyperLogLog(10))
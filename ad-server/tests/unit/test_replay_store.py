@@ -0,0 +1,196 @@
+"""Unit tests for the replay store, replay backends and ReplayGuard."""
+from __future__ import annotations
+
+import asyncio
+import time
+
+import pytest
+
+from app.services.replay_store import (
+    MemoryReplayBackend,
+    RedisReplayBackend,
+    ReplayBackend,
+    ReplayGuard,
+    ReplayStore,
+)
+
+
+class _Clock:
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_token_is_seen_until_its_own_expiry():
+    clock = _Clock()
+    store = ReplayStore(max_entries=100, bucket_seconds=30, clock=clock)
+    store.add("impression:a", expires_at=clock.now + 100)
+    store.add("impression:b", expires_at=clock.now + 250)
+
+    assert store.seen("impression:a")
+    assert not store.seen("click:a")
+    clock.now += 100
+    assert not store.seen("impression:a")
+    assert store.seen("impression:b")
+
+
+def test_expired_buckets_are_dropped_as_time_moves_on():
+    clock = _Clock()
+    store = ReplayStore(max_entries=100, bucket_seconds=30, clock=clock)
+    for i in range(10):
+        store.add(f"impression:{i}", expires_at=clock.now + 60)
+    assert len(store) == 10
+
+    clock.now += 300
+    store.add("impression:new")
+
+    assert len(store) == 1
+    assert store.stats()["buckets"] == 1
+
+
+def test_default_expiry_is_one_token_lifetime_and_expired_keys_are_ignored():
+    clock = _Clock()
+    store = ReplayStore(max_entries=100, bucket_seconds=30, clock=clock)
+    store.add("impression:a")
+    store.add("impression:old", expires_at=clock.now - 1)
+
+    assert not store.seen("impression:old")
+    clock.now += 299
+    assert store.seen("impression:a")
+    clock.now += 1
+    assert not store.seen("impression:a")
+
+
+def test_discarded_key_re_added_keeps_its_new_expiry():
+    clock = _Clock()
+    store = ReplayStore(max_entries=100, bucket_seconds=30, clock=clock)
+    store.add("impression:a", expires_at=clock.now + 40)
+    store.discard("impression:a")
+    assert store.stats()["buckets"] == 0
+
+    store.add("impression:a")  # default expiry, a full token lifetime
+    clock.now += 100
+    store.add("impression:b")  # drops the buckets that have passed
+
+    assert store.seen("impression:a")
+    assert len(store) == 2
+
+
+def test_size_is_bounded_by_forgetting_tokens_closest_to_expiry():
+    clock = _Clock()
+    store = ReplayStore(max_entries=3, bucket_seconds=30, clock=clock)
+    store.add("impression:soon", expires_at=clock.now + 10)
+    store.add("impression:later-1", expires_at=clock.now + 200)
+    store.add("impression:later-2", expires_at=clock.now + 200)
+    store.add("impression:later-3", expires_at=clock.now + 200)
+
+    assert len(store) == 3
+    assert not store.seen("impression:soon")
+    assert store.seen("impression:later-3")
+    stats = store.stats()
+    assert stats["evicted"] == 1
+    assert stats["size"] == 3
+    assert 0 < stats["false_positive_rate"] < 1e-15
+
+
+class _RecordingBackend(ReplayBackend):
+    name = "recording"
+
+    def __init__(self, fail: bool = False):
+        self.inner = MemoryReplayBackend(ReplayStore(max_entries=100))
+        self.calls = []
+        self.fail = fail
+
+    async def claim_many(self, items):
+        self.calls.append([key for key, _ in items])
+        if self.fail:
+            raise ConnectionError("down")
+        return await self.inner.claim_many(items)
+
+    async def release_many(self, keys):
+        await self.inner.release_many(keys)
+
+
+def test_incomplete_backend_fails_at_construction():
+    class _ClaimOnly(ReplayBackend):
+        async def claim_many(self, items):
+            return [True] * len(items)
+
+    with pytest.raises(TypeError):
+        _ClaimOnly()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_claims_share_one_backend_call():
+    backend = _RecordingBackend()
+    guard = ReplayGuard(backend)
+
+    results = await asyncio.gather(
+        guard.claim("impression:a"), guard.claim("impression:b"), guard.claim("impression:a")
+    )
+
+    assert results == [True, True, False]
+    assert backend.calls == [["impression:a", "impression:b"]]
+    assert await guard.claim_many([("impression:b", None), ("click:b", None)]) == [False, True]
+
+
+@pytest.mark.asyncio
+async def test_released_key_can_be_claimed_again():
+    guard = ReplayGuard(_RecordingBackend())
+    assert await guard.claim("impression:a")
+
+    await guard.release(["impression:a"])
+
+    assert await guard.claim("impression:a")
+
+
+@pytest.mark.asyncio
+async def test_backend_failure_falls_back_to_local_store():
+    guard = ReplayGuard(_RecordingBackend(fail=True))
+    guard._fallback = MemoryReplayBackend(ReplayStore(max_entries=100))
+
+    assert await guard.claim_many([("impression:a", None), ("impression:a", None)]) == [True, False]
+    assert not await guard.claim("impression:a")
+    assert guard.stats["backend_errors"] == 2
+
+
+class _FakePipeline:
+    def __init__(self, existing, commands):
+        self.existing = existing
+        self.commands = commands
+
+    def set(self, key, value, nx, ex):
+        self.commands.append((key, nx, ex))
+
+    async def execute(self):
+        results = []
+        for key, _, _ in self.commands:
+            results.append(None if key in self.existing else True)
+            self.existing.add(key)
+        return results
+
+
+class _FakeRedis:
+    def __init__(self):
+        self.existing = set()
+        self.pipelines = []
+
+    def pipeline(self, transaction):
+        self.pipelines.append([])
+        return _FakePipeline(self.existing, self.pipelines[-1])
+
+
+@pytest.mark.asyncio
+async def test_redis_backend_pipelines_set_nx_ex():
+    client = _FakeRedis()
+    backend = RedisReplayBackend(client=client)
+    expires_at = time.time() + 120
+
+    assert await backend.claim_many([("impression:a", expires_at), ("click:a", expires_at)]) == [True, True]
+    assert await backend.claim_many([("impression:a", expires_at)]) == [False]
+
+    assert len(client.pipelines) == 2
+    key, nx, ex = client.pipelines[0][0]
+    assert key.startswith("replay:") and nx is True and 119 <= ex <= 120
@@ -1,8 +1,10 @@
-"""Unit tests for report share tokens (no database required)."""
+"""Unit tests for report share tokens and report assembly (no database required)."""
 from __future__ import annotations
 
 from uuid import uuid4
 
+import pytest
+
 from app.core.security import create_report_share_token, verify_report_share_token
 
 
@@ -20,3 +22,217 @@ def test_invalid_share_token_rejected():
 
     with pytest.raises(HTTPException):
         verify_report_share_token("not-a-valid-token")
+
+
+def _campaign(name: str, served: int = 0, budget: int = 1000):
+    from datetime import datetime
+    from types import SimpleNamespace
+
+    from app.models.campaign import CampaignStatus
+
+    return SimpleNamespace(
+        id=uuid4(),
+        name=name,
+        advertiser_id=uuid4(),
+        status=CampaignStatus.ACTIVE,
+        start_date=datetime(2026, 1, 1),
+        end_date=datetime(2026, 12, 31),
+        impressions_served=served,
+        impression_budget=budget,
+        budget_utilized_percentage=served / budget * 100,
+    )
+
+
+def test_campaign_totals_sum_creatives_per_campaign():
+    from app.services.event_rollups import EventCounts
+    from app.services.report_service import campaign_totals
+
+    first, second = uuid4(), uuid4()
+    totals = campaign_totals({
+        (first, uuid4()): EventCounts(100, 2),
+        (first, uuid4()): EventCounts(50, 1),
+        (second, uuid4()): EventCounts(10, 0),
+    })
+    assert (totals[first].impressions, totals[first].clicks) == (150, 3)
+    assert totals[second].impressions == 10
+
+
+def test_build_report_detail_from_shared_counts():
+    from types import SimpleNamespace
+
+    from app.services.event_rollups import EventCounts
+    from app.services.report_service import build_report_detail
+
+    campaign, other = _campaign("Spring", served=400), _campaign("Other")
+    seen = SimpleNamespace(id=uuid4(), name="Banner A")
+    unseen = SimpleNamespace(id=uuid4(), name="Banner B")
+    counts = {
+        (campaign.id, seen.id): EventCounts(200, 5),
+        (other.id, uuid4()): EventCounts(999, 99),
+    }
+    advertiser = SimpleNamespace(company_name=None, name="Acme")
+
+    detail = build_report_detail(campaign, advertiser, [seen, unseen], counts)
+
+    assert detail.advertiser_name == "Acme"
+    assert (detail.impressions, detail.clicks, detail.click_through_rate) == (200, 5, 2.5)
+    assert detail.budget_remaining == 600
+    assert [(c.creative_name, c.impressions) for c in detail.creatives] == [
+        ("Banner A", 200),
+        ("Banner B", 0),
+    ]
+
+
+def test_iter_csv_yields_chunks_of_rows():
+    from app.services.report_service import iter_csv
+
+    chunks = list(iter_csv(([i, f"row {i}"] for i in range(5)), chunk_rows=2))
+    assert len(chunks) == 3
+    assert "".join(chunks).splitlines() == [f"{i},row {i}" for i in range(5)]
+    assert list(iter_csv([])) == []
+
+
+def test_event_csv_rows_streams_each_kind_with_yield_per():
+    from datetime import datetime
+
+    from app.services.report_service import event_csv_rows
+
+    campaign_id, creative_id, event_id = uuid4(), uuid4(), uuid4()
+    ts = datetime(2026, 3, 4, 10, 30)
+
+    class _Db:
+        def __init__(self):
+            self.statements = []
+
+        def execute(self, stmt):
+            self.statements.append(stmt)
+            city = "Austin" if "impressions" in str(stmt) else None
+            return iter([(event_id, ts, campaign_id, creative_id, "listener-1", city, None)])
+
+    db = _Db()
+    rows = list(event_csv_rows(db, datetime(2026, 3, 1), datetime(2026, 3, 31)))
+
+    assert rows[0][0] == "Type"
+    assert [row[0] for row in rows[1:]] == ["impression", "click"]
+    assert rows[1][2] == ts.isoformat() and rows[1][6] == "Austin"
+    assert rows[2][6] == ""
+    assert all(
+        stmt.get_execution_options()["yield_per"] > 0 for stmt in db.statements
+    )
+
+
+def test_timeseries_fills_empty_buckets(monkeypatch):
+    from datetime import datetime
+
+    from app.services import report_service
+    from app.services.event_rollups import EventCounts
+
+    campaign_id = uuid4()
+    calls = []
+
+    def _series(db, start, end, bucket, campaign_id=None, creative_id=None):
+        calls.append((bucket, campaign_id))
+        return {datetime(2026, 3, 5): EventCounts(400, 6)}
+
+    monkeypatch.setattr(report_service, "event_timeseries", _series)
+    report = report_service.get_report_timeseries(
+        None, "day", datetime(2026, 3, 4, 12), datetime(2026, 3, 6, 8), campaign_id=campaign_id
+    )
+
+    assert calls == [("day", campaign_id)]
+    assert [(p.bucket_start.day, p.impressions, p.click_through_rate) for p in report.points] == [
+        (4, 0, 0.0),
+        (5, 400, 1.5),
+        (6, 0, 0.0),
+    ]
+
+
+def test_timeseries_accepts_utc_iso_timestamps(monkeypatch):
+    from datetime import datetime, timedelta, timezone
+
+    from app.services import report_service
+    from app.services.event_rollups import EventCounts
+
+    def _series(db, start, end, bucket, campaign_id=None, creative_id=None):
+        assert start.tzinfo is None and end.tzinfo is None
+        return {datetime(2026, 3, 5): EventCounts(400, 6)}
+
+    monkeypatch.setattr(report_service, "event_timeseries", _series)
+    # Admin panel toISOString() values: "2026-03-04T12:00:00.000Z"
+    start = datetime(2026, 3, 4, 12, tzinfo=timezone.utc)
+    report = report_service.get_report_timeseries(
+        None, "day", start, datetime(2026, 3, 6, 10, tzinfo=timezone(timedelta(hours=2)))
+    )
+    assert [(p.bucket_start, p.impressions) for p in report.points] == [
+        (datetime(2026, 3, 4), 0),
+        (datetime(2026, 3, 5), 400),
+        (datetime(2026, 3, 6), 0),
+    ]
+
+    only_start = report_service.get_report_timeseries(
+        None, "hour", datetime.now(timezone.utc) - timedelta(hours=2)
+    )
+    assert len(only_start.points) == 3
+
+
+def test_timeseries_rejects_too_many_buckets(monkeypatch):
+    from datetime import datetime
+
+    import pytest
+    from fastapi import HTTPException
+
+    from app.services import report_service
+
+    monkeypatch.setattr(report_service.settings, "REPORT_TIMESERIES_MAX_BUCKETS", 24)
+    with pytest.raises(HTTPException) as exc:
+        report_service.get_report_timeseries(
+            None, "hour", datetime(2026, 3, 1), datetime(2026, 3, 3)
+        )
+    assert exc.value.status_code == 400
+
+
+def test_timeseries_rejects_huge_range_without_listing_buckets(monkeypatch):
+    from datetime import datetime
+
+    import pytest
+    from fastapi import HTTPException
+
+    from app.services import report_service
+
+    def _no_listing(*args):
+        raise AssertionError("bucket list built before the size check")
+
+    monkeypatch.setattr(report_service, "bucket_starts", _no_listing)
+    with pytest.raises(HTTPException) as exc:
+        report_service.get_report_timeseries(
+            None, "hour", datetime(1, 1, 1), datetime(9999, 12, 31)
+        )
+    assert exc.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_event_export_mixes_aware_and_naive_dates():
+    from datetime import datetime, timezone
+
+    from fastapi import HTTPException
+
+    from app.api.v1.endpoints.reports import export_events_csv
+
+    response = await export_events_csv(
+        start_date=datetime(2026, 3, 1, tzinfo=timezone.utc),
+        end_date=datetime(2026, 3, 2),
+        kind=None,
+        campaign_id=None,
+        current_user=None,
+    )
+    assert "20260301-20260302" in response.headers["content-disposition"]
+
+    with pytest.raises(HTTPException) as exc:
+        await export_events_csv(
+            start_date=datetime(2026, 3, 2),
+            end_date=datetime(2026, 3, 1, tzinfo=timezone.utc),
+            kind=None,
+            campaign_id=None,
+            current_user=None,
+        )
+    assert exc.value.status_code == 400
@@ -0,0 +1,86 @@
+"""Unit tests for cached public share reports and their ETags."""
+from __future__ import annotations
+
+from datetime import datetime
+from types import SimpleNamespace
+from uuid import uuid4
+
+from app.api.v1.endpoints.reports import _etag_matches
+from app.services import report_service
+from app.services.inventory_events import bump_inventory_version
+from app.services.share_report_cache import SharedReport, ShareReportCache
+
+
+class _Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _report(tag: str = "a") -> SharedReport:
+    return SharedReport(body=b"{}", etag=f'"{tag}"', content_digest=tag)
+
+
+def test_entries_expire_and_follow_inventory_version():
+    clock = _Clock()
+    cache = ShareReportCache(ttl_seconds=60, max_entries=10, invalidate_events=100, clock=clock)
+    key = (uuid4(), None, None)
+    cache.put(key, _report())
+    assert cache.get(key) is not None
+
+    bump_inventory_version()
+    assert cache.get(key) is None
+    cache.put(key, _report())
+    clock.now += 61
+    assert cache.get(key) is None
+    # Stale entries are still available for ETag reuse
+    assert cache.previous(key) == _report()
+
+
+def test_new_events_past_threshold_invalidate_campaign_reports():
+    cache = ShareReportCache(ttl_seconds=60, max_entries=10, invalidate_events=3)
+    campaign, other = uuid4(), uuid4()
+    key = (campaign, datetime(2026, 3, 1), None)
+    cache.put(key, _report())
+
+    cache.record_events([campaign, campaign, other, other, other])
+    assert cache.get(key) is not None
+    cache.record_events([campaign])
+    assert cache.get(key) is None
+
+
+def test_recomputed_report_keeps_etag_while_numbers_are_unchanged(monkeypatch):
+    clock = _Clock()
+    cache = ShareReportCache(ttl_seconds=60, max_entries=10, invalidate_events=100, clock=clock)
+    campaign_id = uuid4()
+    impressions = [100]
+
+    def _detail(db, cid, start, end):
+        return SimpleNamespace(
+            model_dump_json=lambda exclude=None: (
+                f'{{"impressions": {impressions[0]}}}' if exclude
+                else f'{{"impressions": {impressions[0]}, "generated_at": "{clock.now}"}}'
+            )
+        )
+
+    monkeypatch.setattr(report_service, "get_campaign_report_detail", _detail)
+    first = report_service.get_shared_report(None, campaign_id, cache=cache)
+    assert first.etag.startswith('"') and b'"impressions": 100' in first.body
+
+    clock.now += 61
+    assert report_service.get_shared_report(None, campaign_id, cache=cache) == first
+
+    clock.now += 61
+    impressions[0] = 150
+    changed = report_service.get_shared_report(None, campaign_id, cache=cache)
+    assert changed.etag != first.etag
+
+
+def test_if_none_match_comparison():
+    assert _etag_matches('"abc"', '"abc"')
+    assert _etag_matches('W/"abc", "def"', '"abc"')
+    assert _etag_matches("*", '"abc"')
+    assert not _etag_matches('"abd"', '"abc"')
+    assert not _etag_matches(None, '"abc"')
@@ -3,11 +3,24 @@ Unit tests for Tracking Service.
 """
 import pytest
 from datetime import datetime, timedelta
-from unittest.mock import Mock, patch
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, Mock, patch
 import uuid
 from fastapi import HTTPException
 
-from app.services.tracking import TrackingService
+from app.api.v1.endpoints.ads import _parse_batch_body
+from app.core.security import create_compact_tracking_token, verify_tracking_token
+from app.schemas.ad_serving import TrackingBatchEvent
+from app.services.creative_status_cache import CreativeStatusCache
+from app.services.eligibility_snapshot import EligibilityCache
+from app.services.impression_dedup import ImpressionDeduper
+from app.services.event_ingestion import EventIngestionQueue
+from app.services.tracking import (
+    AsyncTrackingService,
+    TrackingService,
+    cached_click_url,
+    record_click_detached,
+)
 from app.models.impression import Impression
 from app.models.click import Click
 from app.models.campaign import Campaign, CampaignStatus
@@ -281,3 +294,356 @@ class TestTrackingService:
         assert service._is_timestamp_valid(now - timedelta(minutes=6)) is False
         assert service._is_timestamp_valid(now + timedelta(minutes=6)) is False
 
+
+class TestAsyncTrackingService:
+    """Test cases for the AsyncSession-based Tracking Service."""
+    
+    def _mock_db(self, *gets):
+        mock_db = Mock()
+        mock_db.get = AsyncMock(side_effect=list(gets))
+        mock_db.commit = AsyncMock()
+        mock_db.rollback = AsyncMock()
+        return mock_db
+    
+    @pytest.mark.asyncio
+    async def test_track_impression_creates_impression_record(self):
+        ad_id = str(uuid.uuid4())
+        campaign_id = str(uuid.uuid4())
+        mock_creative = Mock(spec=AdCreative)
+        mock_creative.status = CreativeStatus.ACTIVE
+        mock_db = self._mock_db(mock_creative, Mock(spec=Campaign))
+        ingestion = EventIngestionQueue(session_factory=Mock(), max_size=10)
+        service = AsyncTrackingService(mock_db, ingestion=ingestion)
+        
+        with patch('app.services.tracking.verify_tracking_token') as mock_verify:
+            mock_verify.return_value = {"ad_id": ad_id, "campaign_id": campaign_id}
+            result = await service.track_impression(
+                ad_creative_id=ad_id,
+                campaign_id=campaign_id,
+                user_id="test-user-123",
+                tracking_token=f"impression-token-{uuid.uuid4()}",
+                timestamp=datetime.utcnow()
+            )
+        
+        assert result["impression_id"]
+        event = ingestion.queue.get_nowait()
+        assert event.kind == "impression"
+        assert str(event.id) == result["impression_id"]
+        mock_db.add.assert_not_called()
+    
+    @pytest.mark.asyncio
+    async def test_track_click_redirects_even_for_duplicate(self):
+        ad_id = str(uuid.uuid4())
+        campaign_id = str(uuid.uuid4())
+        token = f"click-token-{uuid.uuid4()}"
+        mock_creative = Mock(spec=AdCreative)
+        mock_creative.status = CreativeStatus.ACTIVE
+        mock_creative.click_url = "https://advertiser.com"
+        mock_db = self._mock_db(mock_creative, Mock(spec=Campaign), mock_creative)
+        ingestion = EventIngestionQueue(session_factory=Mock(), max_size=10)
+        service = AsyncTrackingService(mock_db, ingestion=ingestion)
+        
+        with patch('app.services.tracking.verify_tracking_token') as mock_verify:
+            mock_verify.return_value = {"ad_id": ad_id, "campaign_id": campaign_id}
+            first = await service.track_click(ad_id, campaign_id, "user-1", token, datetime.utcnow())
+            second = await service.track_click(ad_id, campaign_id, "user-2", token, datetime.utcnow())
+        
+        assert first["duplicate"] is False
+        assert second == {"click_id": None, "click_url": "https://advertiser.com", "duplicate": True}
+        assert ingestion.pending() == 1
+    
+    @pytest.mark.asyncio
+    async def test_future_click_timestamp_is_clamped_to_now(self):
+        """A far-future click would land in the DEFAULT event partition."""
+        ad_id = str(uuid.uuid4())
+        campaign_id = str(uuid.uuid4())
+        mock_creative = Mock(spec=AdCreative)
+        mock_creative.status = CreativeStatus.ACTIVE
+        mock_creative.click_url = "https://advertiser.com"
+        mock_db = self._mock_db(mock_creative, Mock(spec=Campaign))
+        ingestion = EventIngestionQueue(session_factory=Mock(), max_size=10)
+        service = AsyncTrackingService(mock_db, ingestion=ingestion)
+        
+        with patch('app.services.tracking.verify_tracking_token') as mock_verify:
+            mock_verify.return_value = {"ad_id": ad_id, "campaign_id": campaign_id}
+            await service.track_click(
+                ad_id, campaign_id, "user-1", f"click-token-{uuid.uuid4()}",
+                datetime.utcnow() + timedelta(days=400)
+            )
+        
+        event = ingestion.queue.get_nowait()
+        assert event.timestamp <= datetime.utcnow()
+    
+    @pytest.mark.asyncio
+    async def test_compact_token_tracks_impression_then_click(self):
+        """One compact token is replay-checked separately per event type."""
+        ad_id = uuid.uuid4()
+        campaign_id = uuid.uuid4()
+        token = create_compact_tracking_token(ad_id, campaign_id, datetime.utcnow())
+        mock_creative = Mock(spec=AdCreative)
+        mock_creative.status = CreativeStatus.ACTIVE
+        mock_creative.click_url = "https://advertiser.com"
+        mock_db = self._mock_db(
+            mock_creative, Mock(spec=Campaign), mock_creative, Mock(spec=Campaign), mock_creative
+        )
+        ingestion = EventIngestionQueue(session_factory=Mock(), max_size=10)
+        service = AsyncTrackingService(mock_db, ingestion=ingestion)
+        
+        impression = await service.track_impression(
+            str(ad_id), str(campaign_id), "user-1", token, datetime.utcnow()
+        )
+        click = await service.track_click(str(ad_id), str(campaign_id), "user-1", token, datetime.utcnow())
+        repeat = await service.track_click(str(ad_id), str(campaign_id), "user-1", token, datetime.utcnow())
+        
+        assert impression["impression_id"]
+        assert click["duplicate"] is False
+        assert repeat["duplicate"] is True
+    
+    @pytest.mark.asyncio
+    async def test_full_ingestion_queue_answers_503(self):
+        ad_id = str(uuid.uuid4())
+        campaign_id = str(uuid.uuid4())
+        mock_creative = Mock(spec=AdCreative)
+        mock_creative.status = CreativeStatus.ACTIVE
+        mock_db = self._mock_db(mock_creative, Mock(spec=Campaign))
+        ingestion = EventIngestionQueue(session_factory=Mock(), max_size=1)
+        ingestion.queue.put_nowait(Mock())
+        service = AsyncTrackingService(mock_db, ingestion=ingestion)
+        token = f"impression-token-{uuid.uuid4()}"
+        
+        with patch('app.services.tracking.verify_tracking_token') as mock_verify:
+            mock_verify.return_value = {"ad_id": ad_id, "campaign_id": campaign_id}
+            with pytest.raises(HTTPException) as exc_info:
+                await service.track_impression(ad_id, campaign_id, "user-1", token, datetime.utcnow())
+        
+        assert exc_info.value.status_code == 503
+        assert exc_info.value.headers == {"Retry-After": "1"}
+        # Not marked as used, so the client's retry is accepted
+        assert not service._is_token_used(token, "impression")
+    
+    @pytest.mark.asyncio
+    async def test_cached_creative_status_skips_database(self):
+        ad_id, campaign_id = uuid.uuid4(), uuid.uuid4()
+        creative = SimpleNamespace(
+            id=ad_id, campaign_id=campaign_id, status=CreativeStatus.ACTIVE, click_url="https://a.com"
+        )
+        status_cache = CreativeStatusCache(ttl_seconds=10, max_entries=10)
+        mock_db = self._mock_db(creative)
+        ingestion = EventIngestionQueue(session_factory=Mock(), max_size=10)
+        service = AsyncTrackingService(mock_db, ingestion=ingestion, status_cache=status_cache)
+        
+        with patch('app.services.tracking.verify_tracking_token') as mock_verify:
+            mock_verify.return_value = {"ad_id": str(ad_id), "campaign_id": str(campaign_id)}
+            for user in ("user-1", "user-2", "user-3"):
+                await service.track_impression(
+                    str(ad_id), str(campaign_id), user, f"token-{uuid.uuid4()}", datetime.utcnow()
+                )
+        
+        # One creative read; its own campaign needs no lookup
+        assert mock_db.get.await_count == 1
+        assert ingestion.pending() == 3
+    
+    @pytest.mark.asyncio
+    async def test_repeat_impression_with_fresh_token_is_suppressed(self):
+        ad_id, campaign_id = uuid.uuid4(), uuid.uuid4()
+        creative = SimpleNamespace(
+            id=ad_id, campaign_id=campaign_id, status=CreativeStatus.ACTIVE, click_url="https://a.com"
+        )
+        ingestion = EventIngestionQueue(session_factory=Mock(), max_size=10)
+        deduper = ImpressionDeduper(window_seconds=30, max_entries=10)
+        service = AsyncTrackingService(
+            self._mock_db(creative, creative), ingestion=ingestion,
+            status_cache=CreativeStatusCache(ttl_seconds=0), deduper=deduper
+        )
+        
+        with patch('app.services.tracking.verify_tracking_token') as mock_verify:
+            mock_verify.return_value = {"ad_id": str(ad_id), "campaign_id": str(campaign_id)}
+            first = await service.track_impression(
+                str(ad_id), str(campaign_id), "user-1", f"token-{uuid.uuid4()}", datetime.utcnow()
+            )
+            second = await service.track_impression(
+                str(ad_id), str(campaign_id), "user-1", f"token-{uuid.uuid4()}", datetime.utcnow()
+            )
+        
+        assert first["duplicate"] is False
+        assert second == {"impression_id": None, "duplicate": True}
+        assert ingestion.pending() == 1
+        assert deduper.suppressed == 1
+    
+    @pytest.mark.asyncio
+    async def test_track_impression_rejects_unknown_creative(self):
+        ad_id = str(uuid.uuid4())
+        campaign_id = str(uuid.uuid4())
+        service = AsyncTrackingService(self._mock_db(None), ingestion=EventIngestionQueue(Mock(), max_size=10))
+        
+        with patch('app.services.tracking.verify_tracking_token') as mock_verify:
+            mock_verify.return_value = {"ad_id": ad_id, "campaign_id": campaign_id}
+            with pytest.raises(HTTPException) as exc_info:
+                await service.track_impression(
+                    ad_creative_id=ad_id,
+                    campaign_id=campaign_id,
+                    user_id="test-user-123",
+                    tracking_token=f"impression-token-{uuid.uuid4()}",
+                    timestamp=datetime.utcnow()
+                )
+        
+        assert exc_info.value.status_code == 404
+
+
+class TestTrackingBatch:
+    """Batch beacon: events validated together, one result per event."""
+    
+    def _mock_db(self, creatives, campaign_ids):
+        mock_db = Mock()
+        mock_db.execute = AsyncMock(side_effect=[
+            Mock(scalars=Mock(return_value=creatives)),
+            Mock(scalars=Mock(return_value=campaign_ids)),
+        ])
+        return mock_db
+    
+    def _event(self, kind, ad_id, campaign_id, token, **overrides):
+        return TrackingBatchEvent(
+            type=kind,
+            ad_id=str(ad_id),
+            campaign_id=str(campaign_id),
+            user_id=overrides.pop("user_id", "user-1"),
+            tracking_token=token,
+            timestamp=overrides.pop("timestamp", datetime.utcnow()),
+            **overrides
+        )
+    
+    @pytest.mark.asyncio
+    async def test_track_batch_returns_status_per_event(self):
+        ad_id, campaign_id, inactive_id = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+        creative = Mock(spec=AdCreative, id=ad_id, status=CreativeStatus.ACTIVE)
+        inactive = Mock(spec=AdCreative, id=inactive_id, status=CreativeStatus.INACTIVE)
+        mock_db = self._mock_db([creative, inactive], [campaign_id])
+        ingestion = EventIngestionQueue(session_factory=Mock(), max_size=10)
+        service = AsyncTrackingService(mock_db, ingestion=ingestion)
+        token = create_compact_tracking_token(ad_id, campaign_id, datetime.utcnow())
+        events = [
+            self._event("impression", ad_id, campaign_id, token,
+                        location={"city": "Windhoek", "state": "Khomas"}),
+            self._event("click", ad_id, campaign_id, token),
+            self._event("click", ad_id, campaign_id, token),
+            self._event("impression", inactive_id, campaign_id,
+                        create_compact_tracking_token(inactive_id, campaign_id, datetime.utcnow())),
+            self._event("impression", ad_id, campaign_id,
+                        create_compact_tracking_token(
+                            ad_id, campaign_id, datetime.utcnow() - timedelta(seconds=5)
+                        ),
+                        timestamp=datetime.utcnow() - timedelta(hours=1)),
+        ]
+        
+        results = await service.track_batch(events)
+        
+        assert [r["status"] for r in results] == [
+            "tracked", "tracked", "duplicate", "rejected", "rejected"
+        ]
+        assert results[3]["error"] == "Ad creative is not active"
+        assert results[4]["error"] == "Timestamp too old or in future"
+        # Creatives and campaigns are loaded once for the whole batch
+        assert mock_db.execute.await_count == 2
+        impression, click = ingestion.queue.get_nowait(), ingestion.queue.get_nowait()
+        assert (impression.kind, impression.city, impression.state) == ("impression", "Windhoek", "Khomas")
+        assert str(impression.id) == results[0]["id"]
+        assert (click.kind, click.city) == ("click", None)
+    
+    @pytest.mark.asyncio
+    async def test_track_batch_marks_events_retry_when_queue_full(self):
+        ad_id, campaign_id = uuid.uuid4(), uuid.uuid4()
+        creative = Mock(spec=AdCreative, id=ad_id, status=CreativeStatus.ACTIVE)
+        ingestion = EventIngestionQueue(session_factory=Mock(), max_size=1)
+        service = AsyncTrackingService(self._mock_db([creative], [campaign_id]), ingestion=ingestion)
+        retried_token = f"token-{uuid.uuid4()}"
+        events = [
+            self._event("impression", ad_id, campaign_id, f"token-{uuid.uuid4()}"),
+            self._event("impression", ad_id, campaign_id, retried_token, user_id="user-2"),
+        ]
+        
+        with patch('app.services.tracking.verify_tracking_token') as mock_verify:
+            mock_verify.return_value = {"ad_id": str(ad_id), "campaign_id": str(campaign_id)}
+            results = await service.track_batch(events)
+        
+        assert [r["status"] for r in results] == ["tracked", "retry"]
+        # The refused event's token stays usable for the client's retry
+        assert not service._is_token_used(retried_token, "impression")
+    
+    @pytest.mark.asyncio
+    async def test_track_batch_rejects_bad_token_without_db(self):
+        service = AsyncTrackingService(Mock(), ingestion=EventIngestionQueue(session_factory=Mock()))
+        event = self._event("impression", uuid.uuid4(), uuid.uuid4(), "bad-token")
+        
+        with patch('app.services.tracking.verify_tracking_token', side_effect=ValueError("bad")):
+            results = await service.track_batch([event])
+        
+        assert results == [{"index": 0, "status": "rejected", "error": "Invalid tracking token"}]
+    
+    def test_parse_batch_body_accepts_array_object_and_ndjson(self):
+        assert _parse_batch_body(b'[{"a": 1}, {"a": 2}]') == [{"a": 1}, {"a": 2}]
+        assert _parse_batch_body(b'{"events": [{"a": 1}]}') == [{"a": 1}]
+        assert _parse_batch_body(b'{"a": 1}\n\n{"a": 2}\nnot json\n') == [{"a": 1}, {"a": 2}, None]
+        assert _parse_batch_body(b"  ") == []
+    
+    def test_parse_batch_body_rejects_scalar(self):
+        with pytest.raises(HTTPException) as exc_info:
+            _parse_batch_body(b'"hello"')
+        assert exc_info.value.status_code == 400
+
+
+class TestClickRedirectFastPath:
+    """Click redirects answered from the snapshot, recorded after the response."""
+    
+    def _cache_with(self, campaign_id, creative_id, click_url):
+        campaign = SimpleNamespace(
+            id=campaign_id, name="Promo", status=CampaignStatus.ACTIVE, priority=1,
+            start_date=datetime.utcnow() - timedelta(days=1),
+            end_date=datetime.utcnow() + timedelta(days=1),
+            impression_budget=100, impressions_served=0,
+            target_countries=None, target_states=None, target_cities=None,
+            creatives=[SimpleNamespace(
+                id=creative_id, status=CreativeStatus.ACTIVE, image_width=728,
+                image_height=90, click_url=click_url, alt_text=None,
+            )],
+        )
+        cache = EligibilityCache(loader=lambda db, now: [campaign])
+        cache.get(Mock())
+        return cache
+    
+    def test_cached_click_url_requires_matching_digest(self):
+        ad_id, campaign_id = uuid.uuid4(), uuid.uuid4()
+        cache = self._cache_with(campaign_id, ad_id, "https://advertiser.com/new")
+        pinned_new = verify_tracking_token(create_compact_tracking_token(
+            ad_id, campaign_id, datetime.utcnow(), click_url="https://advertiser.com/new"
+        ), "click")
+        pinned_old = verify_tracking_token(create_compact_tracking_token(
+            ad_id, campaign_id, datetime.utcnow(), click_url="https://advertiser.com/old"
+        ), "click")
+        unpinned = verify_tracking_token(
+            create_compact_tracking_token(ad_id, campaign_id, datetime.utcnow()), "click"
+        )
+        
+        assert cached_click_url(pinned_new, cache) == "https://advertiser.com/new"
+        assert cached_click_url(pinned_old, cache) is None
+        assert cached_click_url(unpinned, cache) is None
+        assert cached_click_url(pinned_new, EligibilityCache()) is None
+    
+    @pytest.mark.asyncio
+    async def test_record_click_detached_swallows_validation_errors(self):
+        db = Mock()
+        db.get = AsyncMock(return_value=None)
+        session_factory = MagicMock()
+        session_factory.return_value.__aenter__ = AsyncMock(return_value=db)
+        session_factory.return_value.__aexit__ = AsyncMock(return_value=False)
+        ad_id, campaign_id = str(uuid.uuid4()), str(uuid.uuid4())
+        
+        with patch('app.services.tracking.verify_tracking_token') as mock_verify:
+            mock_verify.return_value = {"ad_id": ad_id, "campaign_id": campaign_id}
+            await record_click_detached(
+                ad_id, campaign_id, "user-1", f"click-{uuid.uuid4()}", datetime.utcnow(),
+                session_factory=session_factory,
+            )
+        
+        db.get.assert_awaited_once()
+        db.add.assert_not_called()
+
@@ -0,0 +1,75 @@
+"""Unit tests for compact HMAC tracking tokens."""
+from __future__ import annotations
+
+import base64
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import pytest
+from fastapi import HTTPException
+
+from app.core.security import (
+    click_url_digest,
+    create_compact_tracking_token,
+    create_tracking_token,
+    verify_tracking_token,
+)
+
+
+def test_one_compact_token_covers_impression_and_click():
+    ad_id, campaign_id = uuid4(), uuid4()
+    token = create_compact_tracking_token(ad_id, campaign_id, datetime.utcnow())
+
+    impression = verify_tracking_token(token, "impression")
+    click = verify_tracking_token(token, "click")
+
+    assert impression["ad_id"] == click["ad_id"] == str(ad_id)
+    assert impression["campaign_id"] == str(campaign_id)
+    assert impression["type"] == "impression" and click["type"] == "click"
+    assert datetime.fromisoformat(click["timestamp"]) <= datetime.utcnow()
+    assert len(token) == 72 and "." not in token
+
+
+def test_token_with_click_url_carries_its_digest():
+    token = create_compact_tracking_token(
+        uuid4(), uuid4(), datetime.utcnow(), click_url="https://advertiser.com"
+    )
+
+    payload = verify_tracking_token(token, "click")
+
+    assert payload["click_url_digest"] == click_url_digest("https://advertiser.com")
+    assert len(token) == 83
+
+
+def test_compact_token_limited_to_its_types():
+    token = create_compact_tracking_token(uuid4(), uuid4(), datetime.utcnow(), ("impression",))
+
+    verify_tracking_token(token, "impression")
+    with pytest.raises(HTTPException) as exc_info:
+        verify_tracking_token(token, "click")
+    assert exc_info.value.detail == "Invalid tracking token type"
+
+
+def test_tampered_or_expired_compact_token_rejected():
+    token = create_compact_tracking_token(uuid4(), uuid4(), datetime.utcnow())
+    raw = bytearray(base64.urlsafe_b64decode(token + "=="))
+    raw[5] ^= 0x01  # flip a bit in the ad id
+    tampered = base64.urlsafe_b64encode(bytes(raw)).rstrip(b"=").decode()
+    expired = create_compact_tracking_token(
+        uuid4(), uuid4(), datetime.utcnow() - timedelta(minutes=6)
+    )
+
+    for bad in (tampered, expired, token[:-4], "not-a-token"):
+        with pytest.raises(HTTPException) as exc_info:
+            verify_tracking_token(bad, "impression")
+        assert exc_info.value.status_code == 400
+
+
+def test_jwt_tracking_tokens_still_accepted():
+    ad_id, campaign_id = str(uuid4()), str(uuid4())
+    token = create_tracking_token(ad_id, campaign_id, datetime.utcnow(), "click")
+
+    payload = verify_tracking_token(token, "click")
+
+    assert payload["ad_id"] == ad_id
+    assert payload["campaign_id"] == campaign_id